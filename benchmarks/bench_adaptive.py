@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+自适应并发控制基准：模拟站点在在途请求超过阈值时返回429，并随机注入5xx
+对比固定高并发与AIMD控制下的成功率、429次数和吞吐量
+用法: python benchmarks/bench_adaptive.py --count 300 --max-inflight 4 --error-rate 0.02
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from fixture_site import FixtureSite
+
+import fang
+
+
+def run(site, xiaoqu_list, controller, workers):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fang.db = fang.SQLiteDB(os.path.join(tmp_dir, 'bench.db'))
+        fang.create_table()
+        fang.fetch_controller = controller
+        site.status_counts.clear()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            fang.process_list(xiaoqu_list, workers=workers, per_host_limit=workers)
+        elapsed = time.perf_counter() - start
+        rows = fang.db.count('ftx_xiaoqu_detail')
+        fang.db.close()
+    return elapsed, rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=300)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--max-inflight', type=int, default=4)
+    parser.add_argument('--error-rate', type=float, default=0.02)
+    parser.add_argument('--workers', type=int, default=16)
+    args = parser.parse_args()
+    fang.http_cache = fang.HttpCache(enabled=False)
+    fang.page_archive = fang.PageArchive(enabled=False)
+    with FixtureSite(latency=args.latency, max_inflight=args.max_inflight,
+                     error_rates={500: args.error_rate}) as site:
+        xiaoqu_list = [{'xiaoqu_id': str(1000 + i), 'xiaoqu_url': f"{site.base_url}/loupan/{1000 + i}.htm"}
+                       for i in range(args.count)]
+        controllers = (
+            ('fixed, no retry', fang.AdaptiveController(initial=args.workers, min_limit=args.workers,
+                                                        max_limit=args.workers, max_delay=0, max_retries=0)),
+            ('aimd + retry', fang.AdaptiveController(initial=args.workers, max_limit=args.workers,
+                                                     backoff=0.1)),
+        )
+        for name, controller in controllers:
+            elapsed, rows = run(site, xiaoqu_list, controller, args.workers)
+            snapshot = controller.snapshot()
+            print(f"{name:<16} saved={rows:<5}/{args.count} {elapsed:6.2f}s {rows / elapsed:7.1f} pages/s "
+                  f"server={dict(site.status_counts)} limit={snapshot['limit']} delay={snapshot['delay']} "
+                  f"retries={snapshot['retry']} p50={snapshot['latency_p50']} p99={snapshot['latency_p99']}")
+
+
+if __name__ == '__main__':
+    main()
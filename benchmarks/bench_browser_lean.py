@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""
+精简浏览器模式基准：用playwright浏览器依次打开模拟站点的小区列表页（页面引用样式、脚本、字体、图片及第三方统计脚本），
+对比默认模式（等待load，BROWSER_LAUNCH_OPTIONS中的slow_mo）与精简模式（拦截非文档请求，等待DOMContentLoaded）的
+pages/min 及站点实际发送的字节数
+需要安装playwright及chromium（playwright install chromium），或用--executable-path指定已有的Chrome
+用法: python benchmarks/bench_browser_lean.py --pages 30 --latency 0.05
+"""
+import argparse
+import sys
+import time
+
+from fixture_site import FixtureSite, sub_region_id
+
+import fang
+
+
+def run(name, site, urls, lean, launch_options):
+    fang.BROWSER_LEAN_MODE = lean
+    fang.metrics = fang.Metrics(enabled=True)
+    site.bytes_sent.clear()
+    with fang.open_browser_page(launch_options=launch_options, lean=lean) as page:
+        start = time.perf_counter()
+        for url in urls:
+            fang.browser_goto(page, url)
+            assert 'houseList' in page.content()
+        elapsed = time.perf_counter() - start
+    counters = fang.metrics.snapshot()['counters']
+    total = sum(site.bytes_sent.values())
+    print(f"{name:<8} {len(urls) / elapsed * 60:8.1f} pages/min  sent={total / 1024:9.1f}KB "
+          f"({total / len(urls) / 1024:.1f}KB/page) blocked={counters.get('browser_blocked_requests', 0):<5} "
+          f"by_type={ {kind: round(size / 1024) for kind, size in sorted(site.bytes_sent.items())} }")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--pages', type=int, default=30)
+    parser.add_argument('--latency', type=float, default=0.05, help='每个请求（含资源）的模拟延迟')
+    parser.add_argument('--no-slow-mo', action='store_true', help='默认模式也不使用slow_mo，只比较资源拦截的效果')
+    parser.add_argument('--executable-path', default=None)
+    args = parser.parse_args()
+    fang.BROWSER_ALLOWED_DOMAINS = ('esf.fixture.test',)
+    common = {'headless': True, 'args': ['--host-resolver-rules=MAP *.fixture.test 127.0.0.1']}
+    if args.executable_path:
+        common['executable_path'] = args.executable_path
+    default_options = {**fang.BROWSER_LAUNCH_OPTIONS, **common}
+    if args.no_slow_mo:
+        default_options.pop('slow_mo', None)
+    with FixtureSite(latency=args.latency, list_pages=args.pages, page_assets=True) as site:
+        port = site.server.server_address[1]
+        sid = sub_region_id(1, 1, 1)
+        urls = [f"http://c1.esf.fixture.test:{port}/housing/{sid}_0_0_0_0_{n}_0_0_0/"
+                for n in range(1, args.pages + 1)]
+        try:
+            run('default', site, urls, lean=False, launch_options=default_options)
+            run('lean', site, urls, lean=True, launch_options={**fang.BROWSER_LEAN_LAUNCH_OPTIONS, **common})
+        except Exception as e:
+            print(f"浏览器启动或运行失败: {e}", file=sys.stderr)
+            sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
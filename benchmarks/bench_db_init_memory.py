@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""
+db_init内存基准：在模拟站点上按不同城市规模（区域数×子区域数）运行db_init，
+输出tracemalloc峰值内存、写入的子区域/小区数，以及首条区域数据写入数据库前经过的请求数
+区域、子区域逐个写入时峰值内存不随城市规模增长（小区去重集合除外，可用DEDUP_BLOOM_CAPACITY限制）
+用法: python benchmarks/bench_db_init_memory.py --scales 2x2,4x4,8x8 --pages 2
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+import tracemalloc
+
+from fixture_site import FixtureSite, HttpPage, resolve_fixture_hosts
+
+import fang
+
+
+class FirstWriteProbe(HttpPage):
+    """
+    记录第一次写入ftx_base_areas时已经请求过的页面数
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.requests = 0
+        self.requests_before_first_write = None
+
+    def goto(self, url, *args, **kwargs):
+        self.requests += 1
+        if self.requests_before_first_write is None and fang.db.count('ftx_base_areas'):
+            self.requests_before_first_write = self.requests - 1
+        return super().goto(url, *args, **kwargs)
+
+
+def run(regions, sub_regions, pages):
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+            FixtureSite(list_pages=pages, regions=regions, sub_regions=sub_regions) as site:
+        fang.esf_cities_url = f"{site.base_url}/newsecond/esfcities.aspx"
+        fang.http_cache = fang.HttpCache(enabled=False)
+        fang.db = fang.SQLiteDB(os.path.join(tmp_dir, 'bench.db'))
+        page = FirstWriteProbe()
+        with contextlib.redirect_stdout(io.StringIO()):
+            fang.create_table()
+            tracemalloc.start()
+            start = time.perf_counter()
+            fang.db_init(page=page, province_name='模拟省1', pool_size=1)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        areas = fang.db.count('ftx_base_areas')
+        xiaoqu = fang.db.count('ftx_base_xiaoqu')
+        fang.db.close()
+    print(f"{regions}x{sub_regions:<4} {elapsed:6.2f}s peak={peak / 1024 / 1024:6.2f}MB sub_regions={areas:<5} "
+          f"xiaoqu={xiaoqu:<6} browser_pages_before_first_area_write={page.requests_before_first_write}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scales', default='2x2,4x4,8x8', help='逗号分隔的 区域数x每个区域的子区域数')
+    parser.add_argument('--pages', type=int, default=2, help='每个子区域的列表页数')
+    args = parser.parse_args()
+    fang.site_scheme = 'http:'
+    with resolve_fixture_hosts():
+        for scale in args.scales.split(','):
+            regions, sub_regions = (int(n) for n in scale.split('x'))
+            run(regions, sub_regions, args.pages)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+小区去重基准：模拟站点中每页有一部分小区同时出现在多个城市/子区域的列表中
+对比不去重、内存集合去重、布隆过滤器去重时db_init写入的小区数及详情请求数
+用法: python benchmarks/bench_dedup.py --cities 2 --regions 2 --sub-regions 3 --pages 2 --overlap 8
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from fixture_site import FixtureSite, HttpPage, resolve_fixture_hosts
+
+import fang
+
+
+def run(name, bloom_capacity=None, dedup=True):
+    original_add = fang.XiaoquDedup.add
+    fang.DEDUP_BLOOM_CAPACITY = bloom_capacity
+    if not dedup:
+        fang.XiaoquDedup.add = lambda self, xiaoqu_id: True
+    fang.metrics = fang.Metrics(enabled=True)
+    cwd = os.getcwd()
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            os.chdir(tmp_dir)
+            fang.http_cache = fang.HttpCache(enabled=False)
+            fang.db = fang.SQLiteDB(os.path.join(tmp_dir, 'bench.db'))
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                fang.create_table()
+                fang.db_init(page=HttpPage(), province_name='模拟省1', pool_size=1)
+                list_seconds = time.perf_counter() - start
+                list_counters = fang.metrics.snapshot()['counters']
+                fang.fetch_controller = fang.AdaptiveController()
+                fang.spider_by_condition('模拟省1', workers=8)
+            detail_requests = fang.fetch_controller.counters['success']
+            counters = fang.metrics.snapshot()['counters']
+            rows = fang.db.count('ftx_base_xiaoqu')
+            fang.db.close()
+    finally:
+        os.chdir(cwd)
+        fang.XiaoquDedup.add = original_add
+    print(f"{name:<9} db_init={list_seconds:5.2f}s xiaoqu_rows={rows:<6} "
+          f"skipped_writes={list_counters.get('dedup_duplicate', 0):<5} "
+          f"false_positive={list_counters.get('dedup_false_positive', 0):<3} detail_requests={detail_requests:<6} "
+          f"skipped_fetches={counters.get('dedup_duplicate', 0) - list_counters.get('dedup_duplicate', 0)}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cities', type=int, default=2)
+    parser.add_argument('--regions', type=int, default=2)
+    parser.add_argument('--sub-regions', type=int, default=3)
+    parser.add_argument('--pages', type=int, default=2)
+    parser.add_argument('--overlap', type=int, default=8, help='每页20个小区中与其它城市/子区域重复的数量')
+    args = parser.parse_args()
+    fang.site_scheme = 'http:'
+    with resolve_fixture_hosts(), FixtureSite(list_pages=args.pages, cities_per_province=args.cities,
+                                              regions=args.regions, sub_regions=args.sub_regions,
+                                              list_overlap=args.overlap) as site:
+        fang.esf_cities_url = f"{site.base_url}/newsecond/esfcities.aspx"
+        run('no dedup', dedup=False)
+        run('set')
+        run('bloom', bloom_capacity=10000)
+
+
+if __name__ == '__main__':
+    main()
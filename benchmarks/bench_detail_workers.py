@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+多进程详情采集任务队列基准：登记任务后启动多个 python fang.py worker 进程共同消费
+并模拟一个领取任务后异常退出的进程，验证租约过期后任务会被重新领取
+用法: python benchmarks/bench_detail_workers.py --count 300 --processes 1,4 --latency 0.05
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from fixture_site import FixtureSite
+
+import fang
+
+FANG_PY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'fang.py')
+
+
+def prepare(db_path, base_url, count):
+    fang.db = fang.SQLiteDB(db_path)
+    fang.create_table()
+    fang.db.execute("INSERT INTO ftx_base_province (province_name, city_id, city_name, city_url) "
+                    "VALUES ('省份', 'c1', '城市', '//c1.esf.fang.com')")
+    fang.db.execute("INSERT INTO ftx_base_areas (city_id, region_id, region_name, sub_region_id, sub_region_name) "
+                    "VALUES ('c1', 'r1', '区域', 's1', '子区域')")
+    for i in range(count):
+        fang.db.buffer_insert('ftx_base_xiaoqu', {
+            'city_id': 'c1', 'region_id': 'r1', 'sub_region_id': 's1', 'xiaoqu_id': str(1000 + i),
+            'xiaoqu_name': f'小区{i}', 'xiaoqu_url': f'{base_url}/loupan/{1000 + i}.htm'})
+    fang.db.flush()
+    fang.enqueue_detail_jobs('省份')
+    # 模拟领取任务后崩溃的进程：领取一批任务但不回写，租约1秒后过期
+    crashed = fang.DetailJobQueue(fang.db, lease_seconds=1).claim('crashed-worker', limit=10)
+    fang.db.close()
+    return len(crashed)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=300)
+    parser.add_argument('--processes', default='1,4')
+    parser.add_argument('--latency', type=float, default=0.05)
+    args = parser.parse_args()
+    env = dict(os.environ, PYTHONUNBUFFERED='1')
+    with FixtureSite(latency=args.latency) as site:
+        for processes in [int(n) for n in args.processes.split(',')]:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                db_path = os.path.join(tmp_dir, 'bench.db')
+                crashed = prepare(db_path, site.base_url, args.count)
+                time.sleep(1.1)
+                start = time.perf_counter()
+                children = [subprocess.Popen([sys.executable, FANG_PY, 'worker', '--db', db_path, '--workers', '4',
+                                              '--owner', f'worker-{i}'], cwd=tmp_dir, env=env,
+                                             stdout=subprocess.DEVNULL)
+                            for i in range(processes)]
+                for child in children:
+                    child.wait()
+                elapsed = time.perf_counter() - start
+                fang.db = fang.SQLiteDB(db_path)
+                counts = fang.DetailJobQueue(fang.db).counts()
+                details = fang.db.count('ftx_xiaoqu_detail')
+                fang.db.close()
+                print(f"processes={processes:<3} {elapsed:7.2f}s {details / elapsed:8.1f} pages/s "
+                      f"details={details} jobs={counts} (requeued {crashed} from crashed worker)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+离线端到端基准：在本地模拟站点上依次运行
+  1. get_base_province  城市列表
+  2. db_init            区域/子区域发现 + 小区列表分页（get_base_xiaoqu_list）
+  3. spider_by_condition/process_list  小区详情
+  4. to_excel           导出
+输出各阶段 items/s、请求耗时p50/p99 和进程峰值内存
+
+用法:
+  python benchmarks/bench_e2e.py --cities 2 --regions 3 --sub-regions 3 --pages 3 --latency 0.01
+  python benchmarks/bench_e2e.py --json > baseline.json
+  python benchmarks/bench_e2e.py --baseline baseline.json --tolerance 0.3   # 吞吐低于基线30%时退出码为1
+  python benchmarks/bench_e2e.py --profile profile --profile-phases process_list   # 按阶段输出性能分析数据
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+from collections import deque
+
+from fixture_site import FixtureSite, HttpPage, resolve_fixture_hosts
+
+import fang
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * p))], 4)
+
+
+def peak_rss_mb():
+    # Linux下ru_maxrss单位为KB
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+class Phase:
+    """
+    记录一个阶段的耗时、处理条数和请求耗时分布
+    """
+
+    def __init__(self, name, page):
+        self.name = name
+        self.page = page
+        self.items = 0
+        self.result = None
+
+    def __enter__(self):
+        fang.fetch_controller = fang.AdaptiveController()
+        fang.fetch_controller.latencies = deque()
+        self.page.latencies = []
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        elapsed = time.perf_counter() - self.start
+        latencies = list(fang.fetch_controller.latencies) + self.page.latencies
+        self.result = {
+            'seconds': round(elapsed, 3),
+            'items': self.items,
+            'items_per_sec': round(self.items / elapsed, 1) if elapsed else None,
+            'requests': len(latencies),
+            'latency_p50': percentile(latencies, 0.5),
+            'latency_p99': percentile(latencies, 0.99),
+            'peak_rss_mb': peak_rss_mb(),
+        }
+        return False
+
+
+def run(args):
+    page = HttpPage()
+    phases = []
+    province_names = [f"模拟省{p}" for p in range(1, args.provinces + 1)]
+    with Phase('province', page) as phase:
+        phase.items = len(fang.get_base_province())
+    phases.append(phase)
+    with Phase('list', page) as phase:
+        for province_name in province_names:
+            fang.db_init(page=page, province_name=province_name, pool_size=1)
+        phase.items = fang.db.count('ftx_base_xiaoqu')
+    phases.append(phase)
+    with Phase('detail', page) as phase:
+        for province_name in province_names:
+            fang.spider_by_condition(province_name, workers=args.workers)
+        phase.items = fang.db.count('ftx_xiaoqu_detail')
+    phases.append(phase)
+    with Phase('export', page) as phase:
+        before = fang.metrics.counters.get('export_rows', 0)
+        for province_name in province_names:
+            fang.to_excel(province_name, None, None, fmt=args.export_format)
+        phase.items = fang.metrics.counters.get('export_rows', 0) - before
+    phases.append(phase)
+    return {phase.name: phase.result for phase in phases}
+
+
+def compare(results, baseline, tolerance):
+    """
+    与基线比较吞吐，低于 基线*(1-tolerance) 视为退化
+    :return: 退化描述列表
+    """
+    regressions = []
+    for name, expected in baseline.get('phases', {}).items():
+        actual = results['phases'].get(name)
+        if not actual or not expected.get('items_per_sec'):
+            continue
+        floor = expected['items_per_sec'] * (1 - tolerance)
+        if actual['items_per_sec'] < floor:
+            regressions.append(f"{name}: {actual['items_per_sec']} items/s < {floor:.1f} "
+                               f"(基线 {expected['items_per_sec']})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--provinces', type=int, default=1)
+    parser.add_argument('--cities', type=int, default=2, help='每个省份的城市数')
+    parser.add_argument('--regions', type=int, default=3, help='每个城市的区域数')
+    parser.add_argument('--sub-regions', type=int, default=3, help='每个区域的子区域数')
+    parser.add_argument('--pages', type=int, default=3, help='每个子区域的列表页数')
+    parser.add_argument('--latency', type=float, default=0.01)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='随机返回500的比例')
+    parser.add_argument('--max-inflight', type=int, default=0, help='在途请求超过该值时返回429')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--export-format', default='csv', choices=sorted(fang.EXPORT_WRITERS))
+    parser.add_argument('--json', action='store_true', help='以JSON输出结果')
+    parser.add_argument('--baseline', help='基线结果文件（--json的输出）')
+    parser.add_argument('--tolerance', type=float, default=0.3)
+    parser.add_argument('--profile', default=None, help='性能分析输出目录')
+    parser.add_argument('--profile-phases', default=None, help='逗号分隔的分析阶段')
+    args = parser.parse_args()
+
+    fang.metrics = fang.Metrics(enabled=True)
+    fang.site_scheme = 'http:'
+    if args.profile:
+        fang.profiler = fang.Profiler(os.path.abspath(args.profile),
+                                      phases=args.profile_phases.split(',') if args.profile_phases else None)
+    error_rates = {500: args.error_rate} if args.error_rate else None
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir, resolve_fixture_hosts(), \
+            FixtureSite(latency=args.latency, list_pages=args.pages, max_inflight=args.max_inflight,
+                        error_rates=error_rates, provinces=args.provinces, cities_per_province=args.cities,
+                        regions=args.regions, sub_regions=args.sub_regions) as site:
+        os.chdir(tmp_dir)
+        try:
+            fang.esf_cities_url = f"{site.base_url}/newsecond/esfcities.aspx"
+            fang.cookies_path = os.path.join(tmp_dir, 'fang_cookies.json')
+            fang.http_cache = fang.HttpCache(cache_dir=os.path.join(tmp_dir, 'http_cache'))
+            fang.db = fang.SQLiteDB(os.path.join(tmp_dir, 'bench.db'))
+            with contextlib.redirect_stdout(io.StringIO()):
+                fang.create_table()
+                phases = run(args)
+            fang.db.close()
+        finally:
+            os.chdir(cwd)
+    results = {
+        'config': {key: value for key, value in vars(args).items()
+                   if key not in ('json', 'baseline', 'tolerance', 'profile', 'profile_phases')},
+        'phases': phases,
+        'server': {str(status): count for status, count in sorted(site.status_counts.items())},
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        for name, phase in phases.items():
+            print(f"{name:<9} items={phase['items']:<6} {phase['seconds']:7.2f}s {phase['items_per_sec']:9.1f} items/s "
+                  f"requests={phase['requests']:<6} p50={phase['latency_p50']} p99={phase['latency_p99']} "
+                  f"rss={phase['peak_rss_mb']}MB")
+        print(f"server={results['server']} peak_rss={results['peak_rss_mb']}MB")
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"性能退化 {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+流式导出的内存与耗时基准，每种格式在独立子进程中运行以统计峰值内存
+用法: python benchmarks/bench_export.py --xiaoqu 1000000 --formats csv,xlsx,parquet,legacy
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fang
+from bench_query_plan import populate
+
+
+def legacy_export(sql, file_path):
+    """
+    改造前的导出方式：全量查询 -> DataFrame -> to_excel，仅用于对比
+    """
+    import pandas as pd
+    pd.DataFrame(fang.db.query(sql)).to_excel(file_path + '.xlsx', index=False)
+
+
+def child(db_path, fmt, out_dir):
+    fang.db = fang.SQLiteDB(db_path)
+    # 导出全部小区
+    sql = fang.EXPORT_SELECT_SQL
+    file_path = os.path.join(out_dir, f'export_{fmt}')
+    start = time.perf_counter()
+    if fmt == 'legacy':
+        legacy_export(sql, file_path)
+    else:
+        fang.export_query(sql, file_path, fmt=fmt)
+    elapsed = time.perf_counter() - start
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{fmt:<10} {elapsed:8.1f}s peak_rss={peak_mb:8.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--xiaoqu', type=int, default=1000000)
+    parser.add_argument('--formats', default='csv,xlsx,parquet')
+    parser.add_argument('--child', nargs=3, metavar=('DB', 'FORMAT', 'OUT_DIR'))
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+        return
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'bench.db')
+        fang.db = fang.SQLiteDB(db_path)
+        fang.create_table()
+        populate(fang.db, args.xiaoqu, 0.5)
+        fang.db.close()
+        print(f"exporting {args.xiaoqu} rows")
+        for fmt in args.formats.split(','):
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--child', db_path, fmt, tmp_dir], check=True)
+
+
+if __name__ == '__main__':
+    main()
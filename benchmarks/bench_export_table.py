@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+导出表基准：在已完成全部迁移（含v1索引）的合成数据库上，对比改造前的四表关联导出查询与导出表ftx_export_xiaoqu的
+索引范围读取（省份/城市/区域），统计触发器给详情写入带来的开销，并校验导出表与关联查询结果一致；
+最后在小数据库上随机upsert/删除省份、区域、小区、详情（与采集相同的ON CONFLICT DO UPDATE写法），校验触发器维护的导出表
+用法: python benchmarks/bench_export_table.py --xiaoqu 1000000 --writes 20000 --random-ops 5000
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fang
+from bench_query_plan import legacy_export_sql, populate
+
+CONDITIONS = [
+    ('province', ('省份3', None, None)),
+    ('city', ('省份3', '城市3_4', None)),
+    ('region', ('省份3', '城市3_4', '区域2')),
+]
+
+
+def timed(database, sql, params=(), repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = database.query(sql, params)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return sorted(map(tuple, (row.values() for row in rows))), best
+
+
+def write_details(database, count, offset):
+    """
+    模拟详情采集的批量写入（与SQLiteDB.flush相同，一个事务内executemany的upsert）
+    """
+    start = time.perf_counter()
+    with database.conn:
+        database.conn.executemany(
+            "INSERT INTO ftx_xiaoqu_detail (xiaoqu_id, fwzs, ldzs, xqdz) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(xiaoqu_id) DO UPDATE SET fwzs = excluded.fwzs, ldzs = excluded.ldzs, xqdz = excluded.xqdz",
+            ((str(i), f"{i % 700}户", f"{i % 30}栋", f"新路{i}号") for i in range(offset, offset + count)))
+    return time.perf_counter() - start
+
+
+def random_changes(database, ops, seed):
+    """
+    在少量城市、区域、小区上随机upsert/删除基础数据和详情，通过buffer_upsert/buffer_delete/save_xiaoqu_detail批量写入
+    每个城市只属于一个省份（导出表按(city_id, xiaoqu_id)唯一），城市名、区域名、小区名等随机变化
+    :return: verify_export_table的不一致行数
+    """
+    rng = random.Random(seed)
+    fang.db = database
+    with contextlib.redirect_stdout(io.StringIO()):
+        fang.create_table()
+    cities = [f"c{i}" for i in range(4)]
+    regions = [(f"r{i}", f"s{j}") for i in range(3) for j in range(2)]
+    for _ in range(ops):
+        city_id = rng.choice(cities)
+        region_id, sub_region_id = rng.choice(regions)
+        xiaoqu_id = str(rng.randrange(60))
+        action = rng.randrange(8)
+        if action == 0:
+            database.buffer_upsert('ftx_base_province', {
+                'province_name': f"省份{cities.index(city_id) % 2}", 'city_id': city_id,
+                'city_name': f"城市{city_id}_{rng.randrange(3)}", 'city_url': ''},
+                conflict=fang.UNIQUE_KEYS['ftx_base_province'])
+        elif action == 1:
+            database.buffer_upsert('ftx_base_areas', {
+                'city_id': city_id, 'region_id': region_id, 'region_name': f"区域{region_id}_{rng.randrange(3)}",
+                'sub_region_id': sub_region_id, 'sub_region_name': f"子区域{sub_region_id}_{rng.randrange(3)}"},
+                conflict=fang.UNIQUE_KEYS['ftx_base_areas'])
+        elif action in (2, 3):
+            database.buffer_upsert('ftx_base_xiaoqu', {
+                'city_id': city_id, 'region_id': region_id, 'sub_region_id': sub_region_id, 'xiaoqu_id': xiaoqu_id,
+                'xiaoqu_name': f"小区{xiaoqu_id}_{rng.randrange(3)}", 'xiaoqu_url': ''},
+                conflict=fang.UNIQUE_KEYS['ftx_base_xiaoqu'])
+        elif action in (4, 5):
+            fang.save_xiaoqu_detail(xiaoqu_id, {'房屋总数': f"{rng.randrange(5)}户", '楼栋总数': '1栋', '小区地址': '路'})
+        elif action == 6:
+            table, condition = rng.choice([
+                ('ftx_base_province', {'city_id': city_id}),
+                ('ftx_base_areas', {'city_id': city_id, 'region_id': region_id, 'sub_region_id': sub_region_id}),
+                ('ftx_base_xiaoqu', {'city_id': city_id, 'xiaoqu_id': xiaoqu_id}),
+                ('ftx_xiaoqu_detail', {'xiaoqu_id': xiaoqu_id}),
+            ])
+            database.buffer_delete(table, condition)
+        else:
+            database.flush()
+    database.flush()
+    with contextlib.redirect_stdout(io.StringIO()):
+        return fang.verify_export_table()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--xiaoqu', type=int, default=1000000)
+    parser.add_argument('--writes', type=int, default=20000, help='测量触发器开销时写入的详情行数')
+    parser.add_argument('--random-ops', type=int, default=5000, help='随机upsert/删除校验的操作数')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fang.db = fang.SQLiteDB(os.path.join(tmp_dir, 'bench.db'))
+        with contextlib.redirect_stdout(io.StringIO()):
+            fang.create_table()
+        start = time.perf_counter()
+        populate(fang.db, args.xiaoqu, 0.5)
+        print(f"populated {args.xiaoqu} xiaoqu (export table maintained by triggers) "
+              f"in {time.perf_counter() - start:.1f}s")
+        for name, condition in CONDITIONS:
+            legacy_rows, legacy = timed(fang.db, legacy_export_sql(*condition))
+            table_rows, table = timed(fang.db, *fang.build_export_sql(*condition))
+            print(f"export ({name:<8}) rows={len(table_rows):<7} join={legacy * 1000:9.1f} ms  "
+                  f"table={table * 1000:8.1f} ms  speedup={legacy / table:6.1f}x  same_rows={legacy_rows == table_rows}")
+        # 详情已存在的行走upsert的更新分支，其余为新增
+        offset = args.xiaoqu - args.writes // 2
+        with_triggers = write_details(fang.db, args.writes, offset)
+        triggers = [row['name'] for row in fang.db.query(
+            "SELECT name FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'trg_export_%'")]
+        with fang.db.conn:
+            for name in triggers:
+                fang.db.conn.execute(f"DROP TRIGGER {name}")
+        without_triggers = write_details(fang.db, args.writes, offset - args.writes)
+        print(f"detail writes={args.writes}  with triggers={args.writes / with_triggers:8.0f} rows/s  "
+              f"without={args.writes / without_triggers:8.0f} rows/s  "
+              f"overhead={with_triggers / without_triggers - 1:+.1%}")
+        # 去掉触发器后写入的详情未同步到导出表，export-verify应发现这些行，export-rebuild后恢复一致
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            drifted = fang.verify_export_table()
+            verify = time.perf_counter() - start
+            start = time.perf_counter()
+            fang.rebuild_export_table()
+            rebuild = time.perf_counter() - start
+            mismatches = fang.verify_export_table()
+        print(f"export-verify {verify:.1f}s mismatches={drifted}  export-rebuild {rebuild:.1f}s  "
+              f"mismatches after rebuild={mismatches}")
+        fang.db.close()
+        database = fang.SQLiteDB(os.path.join(tmp_dir, 'random.db'))
+        start = time.perf_counter()
+        mismatches = random_changes(database, args.random_ops, args.seed)
+        print(f"random upsert/delete ops={args.random_ops} seed={args.seed} {time.perf_counter() - start:.1f}s "
+              f"export-verify mismatches={mismatches}")
+        database.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+"""
+验证HTTP缓存对重复采集的效果：冷启动、缓存有效期内、缓存过期后条件请求三轮对比
+用法: python benchmarks/bench_http_cache.py --count 200 --latency 0.02
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from fixture_site import FixtureSite
+
+import fang
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.02)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir, FixtureSite(latency=args.latency) as site:
+        fang.db = fang.SQLiteDB(os.path.join(tmp_dir, 'bench.db'))
+        fang.create_table()
+        xiaoqu_list = [{
+            'xiaoqu_id': str(1000 + i),
+            'xiaoqu_url': f"{site.base_url}/loupan/{1000 + i}.htm"
+        } for i in range(args.count)]
+        rounds = (('cold', 3600), ('within ttl', 3600), ('expired ttl', -1))
+        for name, ttl in rounds:
+            fang.http_cache = fang.HttpCache(cache_dir=os.path.join(tmp_dir, 'http_cache'),
+                                             ttls=[(r'/housedetail\.htm$', ttl)])
+            site.status_counts.clear()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                fang.process_list(xiaoqu_list, workers=args.workers)
+            elapsed = time.perf_counter() - start
+            print(f"{name:<12} {elapsed:7.2f}s server={dict(site.status_counts)} cache={fang.http_cache.stats()}")
+        assert fang.db.count('ftx_xiaoqu_detail') == args.count
+        fang.db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+基于benchmarks/fixtures下保存的页面统计单页解析耗时
+用法: python benchmarks/bench_parse.py --repeat 2000
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lxml import etree
+
+import fang
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), encoding='utf-8') as f:
+        return f.read()
+
+
+def legacy_parse_xiaoqu_detail(response_text):
+    """
+    改造前get_xiaoqu_detail中的逐条xpath解析，仅用于对比
+    """
+    final_result = []
+    tree = etree.HTML(response_text)
+    label_list = tree.xpath('//*[@id="baseinfo"]/div/ul/li')
+    for label in label_list:
+        label_key = label.xpath('./span/text()')
+        label_value = ''
+        if len(label.xpath('./div')) > 0 and label.xpath('./div')[0] is not None:
+            if len(label.xpath('./div/p')) and label.xpath('./div/p')[0] is not None:
+                label_value = label.xpath('./div/p/b/text()')
+        if len(label.xpath('./p')) > 0 and label.xpath('./p')[0] is not None:
+            if len(label.xpath('./p/span')) > 0 and label.xpath('./p/span')[0] is not None:
+                label_value = label.xpath('./p/span/text()')
+            else:
+                label_value = label.xpath('./p/text()')
+        label_key = "".join(label_key[0].split()) if label_key else ''
+        if isinstance(label_value, list):
+            label_value = "".join(label_value[0].split()) if label_value else ''
+        final_result.append({"label": label_key, "value": label_value})
+    return final_result
+
+
+def legacy_lookup(response_text):
+    detail = legacy_parse_xiaoqu_detail(response_text)
+    return [fang.get_specific_value(detail, label) for label in ('房屋总数', '楼栋总数', '小区地址')]
+
+
+def compiled_lookup(response_text):
+    detail = fang.parse_xiaoqu_detail(response_text)
+    return [fang.get_specific_value(detail, label) for label in ('房屋总数', '楼栋总数', '小区地址')]
+
+
+def report(name, func, text, repeat):
+    elapsed = min(timeit.repeat(lambda: func(text), number=repeat, repeat=3))
+    print(f"{name:<28} {elapsed / repeat * 1e6:10.1f} us/page {repeat / elapsed:10.1f} pages/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    detail_text = read_fixture('housedetail.htm')
+    legacy = {item['label']: item['value'] for item in legacy_parse_xiaoqu_detail(detail_text)}
+    assert legacy == fang.parse_xiaoqu_detail(detail_text), "解析结果与改造前不一致"
+    report('housedetail legacy', legacy_lookup, detail_text, args.repeat)
+    report('housedetail compiled', compiled_lookup, detail_text, args.repeat)
+
+    list_text = read_fixture('housing_list.htm')
+    report('housing list', fang.get_base_xiaoqu_list, list_text, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+详情采集流水线基准：对比 线程池请求+请求线程内解析+当前线程写入 与 请求线程 -> 解析进程池 -> 写入线程 的流水线
+模拟站点的详情页附加--padding个无关节点块，使解析耗时接近真实页面
+用法: python benchmarks/bench_pipeline.py --count 2000 --padding 400 --latency 0.01 --processes 4
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from fixture_site import FixtureSite
+
+import fang
+
+
+def prepare(db_path, base_url, count):
+    fang.db = fang.SQLiteDB(db_path)
+    fang.create_table()
+    fang.db.execute("INSERT INTO ftx_base_province (province_name, city_id, city_name, city_url) "
+                    "VALUES ('省份', 'c1', '城市', '//c1.esf.fang.com')")
+    fang.db.execute("INSERT INTO ftx_base_areas (city_id, region_id, region_name, sub_region_id, sub_region_name) "
+                    "VALUES ('c1', 'r1', '区域', 's1', '子区域')")
+    for i in range(count):
+        fang.db.buffer_insert('ftx_base_xiaoqu', {
+            'city_id': 'c1', 'region_id': 'r1', 'sub_region_id': 's1', 'xiaoqu_id': str(1000 + i),
+            'xiaoqu_name': f'小区{i}', 'xiaoqu_url': f'{base_url}/loupan/{1000 + i}.htm'})
+    fang.db.flush()
+
+
+def run(name, tmp_dir, base_url, args, parse_processes):
+    fang.DETAIL_PARSE_PROCESSES = parse_processes
+    fang.fetch_controller = fang.AdaptiveController()
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        prepare(os.path.join(tmp_dir, f'{name}.db'), base_url, args.count)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        fang.spider_by_condition('省份', workers=args.workers)
+    elapsed = time.perf_counter() - start
+    rows = fang.db.count('ftx_xiaoqu_detail')
+    fang.db.close()
+    print(f"{name:<10} {elapsed:6.2f}s {rows / elapsed:8.1f} items/s rows={rows}")
+    # 流水线各阶段的利用率
+    for line in output.getvalue().splitlines():
+        if '利用率' in line:
+            print(f"{'':<10}{line}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=2000)
+    parser.add_argument('--padding', type=int, default=400, help='详情页附加的无关节点块数')
+    parser.add_argument('--latency', type=float, default=0.01)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--processes', type=int, default=None, help='解析进程数，默认CPU核数')
+    args = parser.parse_args()
+    fang.http_cache = fang.HttpCache(enabled=False)
+    fang.page_archive = fang.PageArchive(enabled=False)
+    with tempfile.TemporaryDirectory() as tmp_dir, \
+            FixtureSite(latency=args.latency, detail_padding=args.padding) as site:
+        run('threads', tmp_dir, site.base_url, args, parse_processes=0)
+        # 指定进程数时始终使用流水线（DETAIL_PARSE_PROCESSES为None时单核机器不使用）
+        run('pipeline', tmp_dir, site.base_url, args, parse_processes=args.processes or os.cpu_count())
+
+
+if __name__ == '__main__':
+    main()
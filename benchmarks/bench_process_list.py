@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+对比process_list串行与并发采集小区详情的吞吐量
+用法: python benchmarks/bench_process_list.py --count 200 --latency 0.05 --workers 16 --per-host 16
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from fixture_site import FixtureSite
+
+import fang
+
+
+def run(xiaoqu_list, workers, per_host):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fang.db = fang.SQLiteDB(os.path.join(tmp_dir, 'bench.db'))
+        fang.create_table()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            fang.process_list(xiaoqu_list, workers=workers, per_host_limit=per_host)
+        elapsed = time.perf_counter() - start
+        rows = fang.db.count('ftx_xiaoqu_detail')
+        fang.db.close()
+    return elapsed, rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--per-host', type=int, default=16)
+    args = parser.parse_args()
+    # 只对比网络请求的吞吐量，关闭HTTP缓存
+    fang.http_cache = fang.HttpCache(enabled=False)
+    fang.page_archive = fang.PageArchive(enabled=False)
+
+    with FixtureSite(latency=args.latency) as site:
+        xiaoqu_list = [{
+            'xiaoqu_id': str(1000 + i),
+            'xiaoqu_url': f"{site.base_url}/loupan/{1000 + i}.htm"
+        } for i in range(args.count)]
+        for name, workers in (('serial', 1), (f'concurrent({args.workers})', args.workers)):
+            elapsed, rows = run(xiaoqu_list, workers, args.per_host)
+            print(f"{name:<16} rows={rows:<6} {elapsed:8.2f}s {rows / elapsed:10.1f} pages/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+在合成的百万级小区数据库上对比v1迁移（唯一键+索引）及v5导出表前后的查询计划与耗时
+迁移前的导出使用改造前的四表关联查询（legacy_export_sql），迁移后从导出表ftx_export_xiaoqu读取
+用法: python benchmarks/bench_query_plan.py --xiaoqu 1000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fang
+
+PROVINCES = 30
+CITIES_PER_PROVINCE = 10
+REGIONS_PER_CITY = 8
+SUB_REGIONS_PER_REGION = 6
+
+
+def populate(database, xiaoqu_count, detail_ratio):
+    provinces, areas = [], []
+    for p in range(PROVINCES):
+        for c in range(CITIES_PER_PROVINCE):
+            city_id = f"c{p}_{c}"
+            provinces.append((f"省份{p}", city_id, f"城市{p}_{c}", f"//{city_id}.esf.fang.com"))
+            for r in range(REGIONS_PER_CITY):
+                for sr in range(SUB_REGIONS_PER_REGION):
+                    areas.append((city_id, f"/housing/{r}/", f"区域{r}", f"/housing/{r}_{sr}/", f"子区域{r}_{sr}"))
+    database.conn.executemany("INSERT INTO ftx_base_province (province_name, city_id, city_name, city_url) "
+                              "VALUES (?, ?, ?, ?)", provinces)
+    database.conn.executemany("INSERT INTO ftx_base_areas (city_id, region_id, region_name, sub_region_id, "
+                              "sub_region_name) VALUES (?, ?, ?, ?, ?)", areas)
+
+    def xiaoqu_rows():
+        for i in range(xiaoqu_count):
+            area = areas[i % len(areas)]
+            yield area[0], area[1], area[3], str(i), f"小区{i}", f"https://x.esf.fang.com/loupan/{i}.htm"
+
+    database.conn.executemany("INSERT INTO ftx_base_xiaoqu (city_id, region_id, sub_region_id, xiaoqu_id, "
+                              "xiaoqu_name, xiaoqu_url) VALUES (?, ?, ?, ?, ?, ?)", xiaoqu_rows())
+    step = max(1, int(1 / detail_ratio))
+    database.conn.executemany("INSERT INTO ftx_xiaoqu_detail (xiaoqu_id, fwzs, ldzs, xqdz) VALUES (?, ?, ?, ?)",
+                              ((str(i), f"{i % 900}户", f"{i % 40}栋", f"模拟路{i}号")
+                               for i in range(0, xiaoqu_count, step)))
+    database.conn.commit()
+
+
+def legacy_export_sql(province_name, city, area):
+    """
+    改造前to_excel使用的导出查询：每次导出关联小区、区域、城市、详情四张表，条件直接拼接在SQL中，仅用于对比
+    """
+    lj_base_areas_sql = "ftx_base_areas"
+    if city:
+        lj_base_province_sql = (f"(select * from ftx_base_province where province_name='{province_name}' "
+                                f"and city_name='{city}' )")
+        if area:
+            lj_base_areas_sql = f"(select * from ftx_base_areas t where region_name='{area}')"
+    else:
+        lj_base_province_sql = f"(select * from ftx_base_province where province_name='{province_name}' )"
+    return f'''
+    select lbp.province_name as `省份`, lbp.city_name as `城市`, lba.city_id as `城市ID`, lba.region_id as `区域ID`
+         , lba.region_name as `区域名称`, lba.sub_region_id as `子区域ID`, lba.sub_region_name as `子区域名称`
+         , "`" || t.xiaoqu_id as `小区ID`, t.xiaoqu_name as `小区名称`, t.xiaoqu_url as `小区URL`
+         , lxd.xqdz as `小区地址`, lxd.fwzs as `房屋总数`, lxd.ldzs as `楼栋总数`
+    from ftx_base_xiaoqu t
+    left join {lj_base_areas_sql} lba on t.city_id = lba.city_id and t.region_id = lba.region_id
+                                     and t.sub_region_id = lba.sub_region_id
+    left join {lj_base_province_sql} lbp on lba.city_id = lbp.city_id
+    left join ftx_xiaoqu_detail lxd on t.xiaoqu_id = lxd.xiaoqu_id
+    where lbp.province_name = '{province_name}'
+    '''
+
+
+def measure(database, name, sql, params=()):
+    plan = database.query(f"EXPLAIN QUERY PLAN {sql}", params)
+    start = time.perf_counter()
+    rows = len(database.query(sql, params))
+    elapsed = time.perf_counter() - start
+    print(f"  {name:<28} rows={rows:<8} {elapsed * 1000:10.1f} ms")
+    for step in plan:
+        print(f"      {step['detail']}")
+
+
+def run_queries(database, label, export_sql):
+    print(label)
+    measure(database, 'pending (province/city)', *fang.build_pending_xiaoqu_sql('省份3', '城市3_4'))
+    measure(database, 'pending (city/region)', *fang.build_pending_xiaoqu_sql('省份3', '城市3_4', '区域2'))
+    measure(database, 'refresh (province, budget)',
+            *fang.build_detail_target_sql('省份3', refresh=True, budget=1000, max_age_days=0))
+    if export_sql is legacy_export_sql:
+        measure(database, 'export (province)', legacy_export_sql('省份3', None, None))
+        measure(database, 'export (city)', legacy_export_sql('省份3', '城市3_4', None))
+    else:
+        measure(database, 'export (province)', *export_sql('省份3', None, None))
+        measure(database, 'export (city)', *export_sql('省份3', '城市3_4', None))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--xiaoqu', type=int, default=1000000)
+    parser.add_argument('--detail-ratio', type=float, default=0.5)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fang.db = fang.SQLiteDB(os.path.join(tmp_dir, 'bench.db'))
+        fang.create_table(migrate=False)
+        # 迁移前的对照只缺少v1的唯一键和索引及v5的导出表，v2-v4新增的列和表在填充数据前先加上
+        with fang.db.conn:
+            for statements in fang.SCHEMA_MIGRATIONS[1:4]:
+                for sql in statements:
+                    fang.db.conn.execute(sql)
+        start = time.perf_counter()
+        populate(fang.db, args.xiaoqu, args.detail_ratio)
+        print(f"populated {args.xiaoqu} xiaoqu in {time.perf_counter() - start:.1f}s")
+        run_queries(fang.db, 'before migration (no keys/indexes, joined export)', legacy_export_sql)
+        start = time.perf_counter()
+        with fang.db.conn:
+            for statements in [fang.SCHEMA_MIGRATIONS[0], *fang.SCHEMA_MIGRATIONS[4:]]:
+                for sql in statements:
+                    fang.db.conn.execute(sql)
+        print(f"migration took {time.perf_counter() - start:.1f}s")
+        run_queries(fang.db, 'after migration (export table)', fang.build_export_sql)
+        fang.db.close()
+
+
+if __name__ == '__main__':
+    main()
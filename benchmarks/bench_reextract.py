@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+页面归档基准：在模拟站点上采集详情页并写入归档，再次采集验证未变化的页面不重复归档，
+然后关闭站点，清空ftx_xiaoqu_detail后用不同解析进程数从归档重建，输出 pages/s 并校验重建结果与采集结果一致
+用法: python benchmarks/bench_reextract.py --count 2000 --padding 400 --processes 1,4
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from fixture_site import FixtureSite
+
+import fang
+
+
+def prepare(db_path, base_url, count):
+    fang.db = fang.SQLiteDB(db_path)
+    fang.create_table()
+    fang.db.execute("INSERT INTO ftx_base_province (province_name, city_id, city_name, city_url) "
+                    "VALUES ('省份', 'c1', '城市', '//c1.esf.fang.com')")
+    fang.db.execute("INSERT INTO ftx_base_areas (city_id, region_id, region_name, sub_region_id, sub_region_name) "
+                    "VALUES ('c1', 'r1', '区域', 's1', '子区域')")
+    for i in range(count):
+        fang.db.buffer_insert('ftx_base_xiaoqu', {
+            'city_id': 'c1', 'region_id': 'r1', 'sub_region_id': 's1', 'xiaoqu_id': str(1000 + i),
+            'xiaoqu_name': f'小区{i}', 'xiaoqu_url': f'{base_url}/loupan/{1000 + i}.htm'})
+    fang.db.flush()
+
+
+def detail_rows():
+    return fang.db.query("SELECT xiaoqu_id, fwzs, ldzs, xqdz, content_hash FROM ftx_xiaoqu_detail ORDER BY xiaoqu_id")
+
+
+def archive_size(archive_dir):
+    return sum(os.path.getsize(os.path.join(archive_dir, name)) for name in os.listdir(archive_dir))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=2000)
+    parser.add_argument('--padding', type=int, default=400, help='详情页附加的无关节点块数')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--processes', default=f'1,{os.cpu_count()}', help='逗号分隔的解析进程数')
+    args = parser.parse_args()
+    fang.http_cache = fang.HttpCache(enabled=False)
+    fang.metrics = fang.Metrics(enabled=True)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        archive_dir = os.path.join(tmp_dir, 'page_archive')
+        fang.page_archive = fang.PageArchive(archive_dir=archive_dir)
+        with FixtureSite(detail_padding=args.padding) as site, contextlib.redirect_stdout(io.StringIO()):
+            prepare(os.path.join(tmp_dir, 'bench.db'), site.base_url, args.count)
+            fang.spider_by_condition('省份', workers=args.workers)
+            first = fang.metrics.snapshot()['counters']
+            fang.db.execute("UPDATE ftx_xiaoqu_detail SET fetched_at = 0")
+            fang.spider_by_condition('省份', workers=args.workers, refresh=True)
+        counters = fang.metrics.snapshot()['counters']
+        fang.page_archive.close()
+        size = archive_size(archive_dir)
+        raw = sum(len(fang.PageArchive.read_record(os.path.join(archive_dir, row['segment']), row['offset'],
+                                                   row['length'])[1].encode('utf-8'))
+                  for row in fang.db.query("SELECT segment, offset, length FROM ftx_page_archive"))
+        print(f"archived pages={first['archive_pages']} size={size / 1024 / 1024:.1f}MB "
+              f"(html {raw / 1024 / 1024:.1f}MB, {size / raw:.1%}) "
+              f"re-crawl archived={counters['archive_pages'] - first['archive_pages']} new pages")
+        expected = detail_rows()
+        # 站点已关闭，重建过程不发送任何请求
+        for processes in (int(n) for n in args.processes.split(',')):
+            fang.db.execute("DELETE FROM ftx_xiaoqu_detail")
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                pages = fang.reextract_archive(processes=processes)
+            elapsed = time.perf_counter() - start
+            match = detail_rows() == expected
+            print(f"reextract processes={processes:<3} pages={pages:<6} {elapsed:6.2f}s {pages / elapsed:8.1f} pages/s "
+                  f"matches_crawl={match}")
+        fang.db.close()
+
+
+if __name__ == '__main__':
+    main()
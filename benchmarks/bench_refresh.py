@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+详情刷新基准：模拟每月一次的数据刷新，其中一部分小区（易变小区）每月都有变化
+对比 清空后全量重采 与 刷新模式（全部过期 / 限定采集预算）的请求数、实际写入的变化行数及捕获到的变化比例
+用法: python benchmarks/bench_refresh.py --count 1000 --volatile 0.1 --budget 0.2
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from fixture_site import FixtureSite
+
+import fang
+
+MONTH = 31 * 86400
+
+
+def prepare(db_path, base_url, count):
+    fang.db = fang.SQLiteDB(db_path)
+    fang.create_table()
+    fang.db.execute("INSERT INTO ftx_base_province (province_name, city_id, city_name, city_url) "
+                    "VALUES ('省份', 'c1', '城市', '//c1.esf.fang.com')")
+    fang.db.execute("INSERT INTO ftx_base_areas (city_id, region_id, region_name, sub_region_id, sub_region_name) "
+                    "VALUES ('c1', 'r1', '区域', 's1', '子区域')")
+    for i in range(count):
+        fang.db.buffer_insert('ftx_base_xiaoqu', {
+            'city_id': 'c1', 'region_id': 'r1', 'sub_region_id': 's1', 'xiaoqu_id': str(1000 + i),
+            'xiaoqu_name': f'小区{i}', 'xiaoqu_url': f'{base_url}/loupan/{1000 + i}.htm'})
+    fang.db.flush()
+
+
+def next_month(site, volatile_ids):
+    """
+    所有详情的采集时间提前一个月，并修改易变小区的详情
+    """
+    fang.db.execute("UPDATE ftx_xiaoqu_detail SET fetched_at = fetched_at - ?", (MONTH,))
+    for xiaoqu_id in volatile_ids:
+        site.detail_revisions[xiaoqu_id] = site.detail_revisions.get(xiaoqu_id, 0) + 1
+
+
+def run(name, crawl):
+    fang.metrics = fang.Metrics(enabled=True)
+    fang.fetch_controller = fang.AdaptiveController()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        crawl()
+    elapsed = time.perf_counter() - start
+    counters = fang.metrics.snapshot()['counters']
+    result = {'requests': fang.fetch_controller.counters['success'],
+              'changed': counters.get('detail_changed', 0), 'unchanged': counters.get('detail_unchanged', 0)}
+    print(f"{name:<26} {elapsed:6.2f}s requests={result['requests']:<6} "
+          f"changed_rows={result['changed']:<6} unchanged(touch only)={result['unchanged']}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=1000)
+    parser.add_argument('--volatile', type=float, default=0.1, help='每月都会变化的小区比例')
+    parser.add_argument('--budget', type=float, default=0.2, help='刷新预算，占小区总数的比例')
+    parser.add_argument('--months', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=8)
+    args = parser.parse_args()
+    fang.http_cache = fang.HttpCache(enabled=False)
+    fang.page_archive = fang.PageArchive(enabled=False)
+    fang.DETAIL_HISTORY_ENABLED = True
+    budget = int(args.count * args.budget)
+    with tempfile.TemporaryDirectory() as tmp_dir, FixtureSite() as site:
+        prepare(os.path.join(tmp_dir, 'bench.db'), site.base_url, args.count)
+        # 易变小区分散在列表中
+        step = max(1, int(1 / args.volatile))
+        volatile_ids = [str(1000 + i) for i in range(0, args.count, step)]
+        run('initial crawl', lambda: fang.spider_by_condition('省份', workers=args.workers))
+
+        next_month(site, volatile_ids)
+        fang.db.execute("DELETE FROM ftx_xiaoqu_detail")
+        run('wipe + full recrawl', lambda: fang.spider_by_condition('省份', workers=args.workers))
+
+        next_month(site, volatile_ids)
+        run('refresh, no budget', lambda: fang.spider_by_condition('省份', workers=args.workers, refresh=True))
+
+        for month in range(args.months):
+            next_month(site, volatile_ids)
+            result = run(f'refresh, budget={budget} (m{month + 1})',
+                         lambda: fang.spider_by_condition('省份', workers=args.workers, refresh=True, budget=budget))
+            print(f"{'':<26} captured {result['changed']}/{len(volatile_ids)} changes with "
+                  f"{result['requests'] / args.count:.0%} of a full crawl")
+        history = fang.db.query("SELECT count(*) AS n FROM ftx_xiaoqu_detail_history")[0]['n']
+        print(f"history rows={history}")
+        fang.db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+请求开销基准：对比旧方式（每次请求重新读取解析cookies文件、拼接Cookie头、requests.get不复用连接）
+与http_session（连接池 + 内存cookie jar）的单请求耗时
+新连接的建立耗时由--connect-latency模拟（本机连接几乎没有握手开销）
+用法: python benchmarks/bench_session.py --count 500 --cookies 40 --connect-latency 0.02
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import requests
+
+from fixture_site import FixtureSite
+
+import fang
+
+
+def write_cookies(path, count, host):
+    cookies = [{'name': f'cookie{i}', 'value': 'v' * 32, 'domain': host if i % 2 else '.' + host, 'path': '/',
+                'expires': time.time() + 3600 if i % 3 else -1, 'httpOnly': False, 'secure': False,
+                'sameSite': 'Lax'} for i in range(count)]
+    with open(path, 'w') as f:
+        json.dump({'cookies': cookies, 'origins': []}, f)
+
+
+def legacy_get(url, cookies_path):
+    headers = {
+        **fang.default_headers,
+        'Cookie': fang.HttpUtils.get_header_cookies(cookies_path)
+    }
+    return requests.get(url, headers=headers, timeout=30)
+
+
+def run(name, get, urls):
+    start = time.perf_counter()
+    for url in urls:
+        response = get(url)
+        assert response.status_code == 200 and 'baseinfo' in response.text
+    elapsed = time.perf_counter() - start
+    print(f"{name:<22} {elapsed:6.2f}s {elapsed / len(urls) * 1000:7.3f} ms/request")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=500)
+    parser.add_argument('--cookies', type=int, default=40)
+    parser.add_argument('--connect-latency', type=float, default=0.02)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp_dir, FixtureSite(connect_latency=args.connect_latency) as site:
+        cookies_path = os.path.join(tmp_dir, 'fang_cookies.json')
+        write_cookies(cookies_path, args.cookies, '127.0.0.1')
+        urls = [f"{site.base_url}/loupan/{1000 + i}/housedetail.htm" for i in range(args.count)]
+        legacy = run('legacy (per request)', lambda url: legacy_get(url, cookies_path), urls)
+        session = fang.HttpSession(cookie_path=cookies_path)
+        pooled = run('pooled session', session.get, urls)
+        header = session.cookie_store.header(urls[0])
+        print(f"cookies sent={header.count('=')} speedup={legacy / pooled:.2f}x")
+        # 修改cookies文件后下一次请求即使用新cookies
+        time.sleep(0.01)
+        write_cookies(cookies_path, 1, '127.0.0.1')
+        session.get(urls[0])
+        print(f"after reload cookies sent={session.cookie_store.header(urls[0]).count('=')}")
+        session.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+分库基准：N个进程各自采集一个省份，用save_xiaoqu_detail缓冲写入详情（含导出表触发器），
+对比所有进程写入同一个数据库文件与每个省份写入各自分片的总写入速度（rows/s），
+然后ATTACH所有分片统计待采集数，并合并导出全部分片校验行数
+用法: python benchmarks/bench_shards.py --processes 1,2,4,8 --rows 20000 --batch-size 50
+"""
+import argparse
+import contextlib
+import io
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fang
+
+
+def province_name(index):
+    return f"省份{index}"
+
+
+def prepare(database, province, rows):
+    """
+    建表并写入一个省份的城市、区域、小区基础数据
+    """
+    fang.db = database
+    with contextlib.redirect_stdout(io.StringIO()):
+        fang.create_table()
+    city_id = f"{province}_c"
+    database.execute("INSERT INTO ftx_base_province (province_name, city_id, city_name, city_url) "
+                     "VALUES (?, ?, ?, '')", (province, city_id, f"{province}城市"))
+    database.execute("INSERT INTO ftx_base_areas (city_id, region_id, region_name, sub_region_id, sub_region_name) "
+                     "VALUES (?, 'r1', '区域', 's1', '子区域')", (city_id,))
+    with database.conn:
+        database.conn.executemany(
+            "INSERT INTO ftx_base_xiaoqu (city_id, region_id, sub_region_id, xiaoqu_id, xiaoqu_name, xiaoqu_url) "
+            "VALUES (?, 'r1', 's1', ?, ?, '')",
+            ((city_id, f"{province}_{i}", f"小区{i}") for i in range(rows)))
+
+
+def write_details(db_path, province, rows, batch_size, journal_mode):
+    """
+    子进程：写入一个省份的全部小区详情
+    :return: (开始时间, 结束时间)
+    """
+    fang.db = fang.SQLiteDB(db_path, batch_size=batch_size, journal_mode=journal_mode)
+    fang.db.conn.execute("PRAGMA busy_timeout = 60000")
+    start = time.time()
+    for i in range(rows):
+        fang.save_xiaoqu_detail(f"{province}_{i}", {'房屋总数': f"{i % 900}户", '楼栋总数': f"{i % 40}栋",
+                                                    '小区地址': f"模拟路{i}号"})
+    fang.db.close()
+    return start, time.time()
+
+
+def run(name, tmp_dir, processes, rows, batch_size, journal_mode, sharded):
+    shards = fang.ShardedDB(os.path.join(tmp_dir, f"{name}_{processes}"), 'province',
+                            journal_mode=journal_mode)
+    single = fang.SQLiteDB(os.path.join(tmp_dir, f"{name}_{processes}.db"), journal_mode=journal_mode)
+    targets = []
+    for index in range(processes):
+        province = province_name(index)
+        database = shards.shard(province) if sharded else single
+        prepare(database, province, rows)
+        targets.append((database.db_file, province))
+    shards.close()
+    single.close()
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context) as pool:
+        spans = list(pool.map(write_details, *zip(*targets), [rows] * processes, [batch_size] * processes,
+                              [journal_mode] * processes))
+    elapsed = max(end for _, end in spans) - min(start for start, _ in spans)
+    total = rows * processes
+    print(f"{name:<8} journal={journal_mode or 'DELETE':<6} processes={processes:<3} rows={total:<8} "
+          f"{elapsed:7.2f}s {total / elapsed:10.0f} rows/s")
+    return shards
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--processes', default='1,2,4,8', help='逗号分隔的并发进程数（每个进程一个省份）')
+    parser.add_argument('--rows', type=int, default=20000, help='每个省份的小区数')
+    parser.add_argument('--batch-size', type=int, default=50, help='缓冲写入的批量大小，越小写锁争用越频繁')
+    parser.add_argument('--journal-mode', default=None, help='如WAL，默认sqlite的DELETE模式')
+    args = parser.parse_args()
+    fang.page_archive = fang.PageArchive(enabled=False)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        shards = None
+        for processes in (int(n) for n in args.processes.split(',')):
+            run('single', tmp_dir, processes, args.rows, args.batch_size, args.journal_mode, sharded=False)
+            shards = run('sharded', tmp_dir, processes, args.rows, args.batch_size, args.journal_mode, sharded=True)
+        # 最后一组分片上的跨分片查询
+        start = time.perf_counter()
+        summary = shards.union_query(fang.SHARD_SUMMARY_SQL)
+        elapsed = time.perf_counter() - start
+        print(f"summary via ATTACH: shards={len(summary)} details={sum(row['details'] for row in summary)} "
+              f"pending={sum(row['pending_xiaoqu'] for row in summary)} {elapsed * 1000:.1f} ms")
+        start = time.perf_counter()
+        file_path = os.path.join(tmp_dir, 'export_all')
+        fang.export_query(fang.EXPORT_SELECT_SQL, file_path, fmt='csv', source=shards)
+        with open(f"{file_path}.csv", encoding='utf-8-sig') as f:
+            exported = sum(1 for _ in f) - 1
+        print(f"merged export: rows={exported} {time.perf_counter() - start:.2f}s")
+        shards.close()
+
+
+if __name__ == '__main__':
+    main()
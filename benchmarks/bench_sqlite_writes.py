@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+对比逐条提交与缓冲批量提交写入ftx_xiaoqu_detail的速度（rows/sec）
+用法: python benchmarks/bench_sqlite_writes.py --rows 5000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fang
+
+
+def make_rows(count):
+    return [{'xiaoqu_id': str(1000 + i), 'fwzs': f'{i}户', 'ldzs': f'{i % 40}栋', 'xqdz': f'模拟路{i}号'}
+            for i in range(count)]
+
+
+def write_per_row(db, rows):
+    for row in rows:
+        db.delete(table='ftx_xiaoqu_detail', condition={'xiaoqu_id': row['xiaoqu_id']})
+        db.insert(table='ftx_xiaoqu_detail', data=row)
+
+
+def write_buffered(db, rows):
+    for row in rows:
+        db.buffer_delete(table='ftx_xiaoqu_detail', condition={'xiaoqu_id': row['xiaoqu_id']})
+        db.buffer_insert(table='ftx_xiaoqu_detail', data=row)
+    db.flush()
+
+
+def write_upsert(db, rows):
+    for row in rows:
+        db.buffer_upsert(table='ftx_xiaoqu_detail', data=row, conflict=fang.UNIQUE_KEYS['ftx_xiaoqu_detail'])
+    db.flush()
+
+
+def run(name, writer, rows, **db_kwargs):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fang.db = fang.SQLiteDB(os.path.join(tmp_dir, 'bench.db'), **db_kwargs)
+        fang.create_table()
+        start = time.perf_counter()
+        writer(fang.db, rows)
+        elapsed = time.perf_counter() - start
+        assert fang.db.count('ftx_xiaoqu_detail') == len(rows)
+        fang.db.close()
+    print(f"{name:<28} {len(rows):>7} rows {elapsed:8.2f}s {len(rows) / elapsed:12.1f} rows/s")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--batch-size', type=int, default=fang.DB_BATCH_SIZE)
+    args = parser.parse_args()
+    rows = make_rows(args.rows)
+    run('per-row commit', write_per_row, rows)
+    run('buffered', write_buffered, rows, batch_size=args.batch_size)
+    run('buffered + WAL/NORMAL', write_buffered, rows, batch_size=args.batch_size,
+        journal_mode='WAL', synchronous='NORMAL')
+    run('buffered upsert', write_upsert, rows, batch_size=args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+启动耗时基准：在独立进程中多次测量 import fang 和 python fang.py --help 的耗时，
+并检查导入后没有加载重量级依赖、没有创建数据库文件
+用法:
+  python benchmarks/bench_startup.py --runs 10
+  python benchmarks/bench_startup.py --max-import-ms 400   # 超过阈值或加载了重量级依赖时退出码为1
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 只在对应功能中按需导入的依赖
+HEAVY_MODULES = ('playwright', 'pandas', 'numpy', 'openpyxl', 'pyarrow')
+
+PROBE = f"""
+import json, os, sys, time
+start = time.perf_counter()
+sys.path.insert(0, {ROOT!r})
+import fang
+elapsed = time.perf_counter() - start
+print(json.dumps({{'import_ms': elapsed * 1000,
+                  'heavy': [m for m in {HEAVY_MODULES!r} if m in sys.modules],
+                  'db_created': os.path.exists('fang.db')}}))
+"""
+
+
+def measure(command, cwd):
+    start = time.perf_counter()
+    output = subprocess.run(command, cwd=cwd, check=True, capture_output=True, text=True).stdout
+    return (time.perf_counter() - start) * 1000, output
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--max-import-ms', type=float, default=None, help='import fang中位耗时上限（毫秒）')
+    args = parser.parse_args()
+    import_ms, process_ms, help_ms = [], [], []
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for _ in range(args.runs):
+            wall, output = measure([sys.executable, '-c', PROBE], tmp_dir)
+            probe = json.loads(output)
+            import_ms.append(probe['import_ms'])
+            process_ms.append(wall)
+            if probe['heavy']:
+                failures.append(f"import fang加载了重量级依赖: {probe['heavy']}")
+            if probe['db_created']:
+                failures.append("import fang创建了fang.db")
+            wall, _ = measure([sys.executable, os.path.join(ROOT, 'fang.py'), '--help'], tmp_dir)
+            help_ms.append(wall)
+    import_median = statistics.median(import_ms)
+    print(f"import fang            median={import_median:7.1f}ms min={min(import_ms):7.1f}ms")
+    print(f"python -c 'import fang' median={statistics.median(process_ms):7.1f}ms (含解释器启动)")
+    print(f"python fang.py --help  median={statistics.median(help_ms):7.1f}ms")
+    if args.max_import_ms is not None and import_median > args.max_import_ms:
+        failures.append(f"import fang耗时 {import_median:.1f}ms 超过 {args.max_import_ms}ms")
+    for failure in sorted(set(failures)):
+        print(failure, file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+预编译语句缓存基准：详情保存的热点循环（逐个小区 delete + insert，缓冲后批量提交），对比
+值直接拼接在SQL中（每条语句文本不同，每次都要重新编译）与参数化语句在不同DB_STATEMENT_CACHE_SIZE下的每条语句耗时
+用法: python benchmarks/bench_statement_cache.py --rows 20000 --cache-sizes 0,16,256
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fang
+
+
+def make_rows(count):
+    return [{'xiaoqu_id': str(1000 + i), 'fwzs': f'{i}户', 'ldzs': f'{i % 40}栋', 'xqdz': f"模拟路{i}号'"}
+            for i in range(count)]
+
+
+def write_interpolated(db, rows):
+    """
+    改造前的写法：条件和值拼接在SQL文本中（值中的引号需要转义）
+    """
+    for row in rows:
+        db.buffer_execute(f"DELETE FROM ftx_xiaoqu_detail WHERE xiaoqu_id = '{row['xiaoqu_id']}'")
+        values = ', '.join("'" + value.replace("'", "''") + "'" for value in row.values())
+        db.buffer_execute(f"INSERT INTO ftx_xiaoqu_detail ({', '.join(row)}) VALUES ({values})")
+    db.flush()
+
+
+def write_parameterized(db, rows):
+    for row in rows:
+        db.buffer_delete(table='ftx_xiaoqu_detail', condition={'xiaoqu_id': row['xiaoqu_id']})
+        db.buffer_insert(table='ftx_xiaoqu_detail', data=row)
+    db.flush()
+
+
+def run(name, writer, rows, batch_size, statement_cache_size):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        fang.db = fang.SQLiteDB(os.path.join(tmp_dir, 'bench.db'), batch_size=batch_size,
+                                statement_cache_size=statement_cache_size)
+        with contextlib.redirect_stdout(io.StringIO()):
+            fang.create_table()
+        # 先写入一遍，测量时delete命中已有的行
+        writer(fang.db, rows)
+        start = time.perf_counter()
+        writer(fang.db, rows)
+        elapsed = time.perf_counter() - start
+        assert fang.db.count('ftx_xiaoqu_detail') == len(rows)
+        fang.db.close()
+    statements = len(rows) * 2
+    print(f"{name:<28} cache={statement_cache_size:<5} {statements:>7} statements {elapsed:7.2f}s "
+          f"{elapsed / statements * 1e6:8.2f} us/statement")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--batch-size', type=int, default=fang.DB_BATCH_SIZE)
+    parser.add_argument('--cache-sizes', default=f'0,16,{fang.DB_STATEMENT_CACHE_SIZE}',
+                        help='逗号分隔的预编译语句缓存大小')
+    args = parser.parse_args()
+    rows = make_rows(args.rows)
+    cache_sizes = [int(n) for n in args.cache_sizes.split(',')]
+    run('interpolated', write_interpolated, rows, args.batch_size, max(cache_sizes))
+    for cache_size in cache_sizes:
+        run('parameterized', write_parameterized, rows, args.batch_size, cache_size)
+
+
+if __name__ == '__main__':
+    main()
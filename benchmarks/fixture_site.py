@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+"""
+本地房天下模拟站点，供benchmarks下的脚本离线压测使用
+"""
+import contextlib
+import gzip
+import hashlib
+import os
+import random
+import re
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urljoin
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+DETAIL_TEMPLATE = """<html><head><meta charset="utf-8"><title>{xiaoqu_id}</title></head><body>
+<div id="baseinfo"><div><ul>
+<li><span>小区地址</span><p>模拟路{xiaoqu_id}号</p></li>
+<li><span>房屋总数</span><p>{fwzs}户</p></li>
+<li><span>楼栋总数</span><p>{ldzs}栋</p></li>
+<li><span>建筑类型</span><div><p><b>板楼</b></p></div></li>
+<li><span>物业公司</span><p><span>模拟物业</span></p></li>
+</ul></div></div>
+{padding}
+</body></html>"""
+
+# 模拟真实详情页中大量与解析无关的节点（导航、推荐列表、脚本等）
+DETAIL_PADDING_TEMPLATE = """<div class="recommend"><ul><li><a href="/loupan/{n}.htm" title="推荐小区{n}">推荐小区{n}</a>\
+<span class="price">{n}元/平米</span><p>模拟描述文字模拟描述文字{n}</p></li></ul></div>"""
+
+
+# page_assets开启时插入页面<head>的资源：样式、脚本、字体、第三方统计脚本（tracker.fixture.test）
+ASSET_TAGS = """<link rel="stylesheet" href="/static/site.css"><link rel="stylesheet" href="/static/font.css">
+<script src="/static/app.js"></script><script src="//tracker.fixture.test:{port}/t.js"></script>"""
+# 资源路径 -> (Content-Type, 大小或内容)
+ASSETS = {
+    '/static/site.css': ('text/css', 60 * 1024),
+    '/static/font.css': ('text/css', b"@font-face{font-family:f;src:url(/static/font.woff2)}body{font-family:f}"),
+    '/static/app.js': ('application/javascript', 180 * 1024),
+    '/static/font.woff2': ('font/woff2', 90 * 1024),
+    '/t.js': ('application/javascript', 40 * 1024),
+    'image': ('image/jpeg', 25 * 1024),
+}
+
+
+LIST_ITEM_TEMPLATE = """    <div class="list rel">
+        <dl class="plotListwrap clearfix">
+            <dt><a href="/loupan/{xiaoqu_id}.htm"><img src="/img/{xiaoqu_id}.jpg"/></a></dt>
+            <dd>
+                <p><a class="plotTit" href="/loupan/{xiaoqu_id}.htm" target="_blank">模拟小区{xiaoqu_id}</a></p>
+                <p>模拟路{xiaoqu_id}号</p>
+            </dd>
+        </dl>
+    </div>"""
+
+CAPTCHA_PAGE = """<html><head><meta charset="utf-8"><title>安全验证</title></head>
+<body><div class="verify">请完成滑动验证后继续访问</div></body></html>"""
+
+
+# 模拟城市使用 c{n}.esf.fixture.test 形式的域名，由resolve_fixture_hosts解析到本机，站点按Host区分城市
+FIXTURE_DOMAIN = 'esf.fixture.test'
+
+
+def render_cities(port, provinces, cities_per_province):
+    items = []
+    for p in range(1, provinces + 1):
+        links = "".join(f'<a href="//c{(p - 1) * cities_per_province + c}.{FIXTURE_DOMAIN}:{port}">'
+                        f'模拟城市{(p - 1) * cities_per_province + c}</a>'
+                        for c in range(1, cities_per_province + 1))
+        items.append(f'<li><strong>模拟省{p}</strong>{links}</li>')
+    return f"""<html><head><meta charset="utf-8"><title>城市列表</title></head><body>
+<div id="c02"><ul>
+{chr(10).join(items)}
+</ul></div>
+</body></html>"""
+
+
+def sub_region_id(city_no, region_no, sub_no):
+    # 固定宽度，保证不同子区域生成的小区id不重复
+    return f"{1000000 + city_no * 10000 + region_no * 100 + sub_no}"
+
+
+def render_city(regions):
+    links = "".join(f'<a href="/housing/r{r}/">模拟区域{r}</a>' for r in range(1, regions + 1))
+    return f"""<html><head><meta charset="utf-8"><title>区域</title></head><body>
+<div class="qxName"><a href="/housing/">不限</a>{links}</div>
+</body></html>"""
+
+
+def render_region(city_no, region_no, sub_regions):
+    links = "".join(f'<a href="/housing/{sub_region_id(city_no, region_no, s)}/">模拟商圈{s}</a>'
+                    for s in range(1, sub_regions + 1))
+    return f"""<html><head><meta charset="utf-8"><title>商圈</title></head><body>
+<div id="shangQuancontain"><a href="/housing/r{region_no}/">不限</a>{links}</div>
+</body></html>"""
+
+
+def list_xiaoqu_id(sub_region_id, page_no, index, overlap=0):
+    # 每页前overlap个小区在各城市中区域序号相同的所有子区域间共享（sub_region_id生成的id中城市、子区域位置为00）
+    prefix = f"100{sub_region_id[3:5]}00" if index < overlap else sub_region_id
+    return f"{prefix}{page_no:03d}{index:02d}"
+
+
+def render_list(sub_region_id, page_no, total_pages, page_size=20, overlap=0):
+    items = "\n".join(LIST_ITEM_TEMPLATE.format(xiaoqu_id=list_xiaoqu_id(sub_region_id, page_no, i, overlap))
+                      for i in range(page_size))
+    links = "\n".join(f'        <a href="/housing/{sub_region_id}_0_0_0_0_{n}_0_0_0/">{n}</a>' if n != page_no
+                      else f'        <a class="pageNow">{n}</a>'
+                      for n in range(max(1, page_no - 4), min(total_pages, page_no + 5) + 1))
+    next_link = f'<a href="/housing/{sub_region_id}_0_0_0_0_{page_no + 1}_0_0_0/">下一页</a>' \
+        if page_no < total_pages else ''
+    return f"""<html><head><meta charset="utf-8"><title>小区列表</title></head><body>
+<div class="houseList">
+{items}
+    <div class="fanye gray6">
+{links}
+        {next_link}
+        <span class="txt">共{total_pages}页</span>
+    </div>
+</div>
+</body></html>"""
+
+
+def render_detail(xiaoqu_id, revision=0, padding=0):
+    number = int(xiaoqu_id) if xiaoqu_id.isdigit() else len(xiaoqu_id)
+    return DETAIL_TEMPLATE.format(xiaoqu_id=xiaoqu_id, fwzs=100 + number % 900 + revision, ldzs=1 + number % 40,
+                                  padding="\n".join(DETAIL_PADDING_TEMPLATE.format(n=n) for n in range(padding)))
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    # 支持keep-alive；响应头和正文分两次写出，关闭Nagle避免长连接上的延迟确认等待
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    latency = 0.0
+    # 请求头Accept-Encoding包含gzip时压缩响应
+    compress = True
+    # 每个新连接的建立耗时（秒），模拟TCP/TLS握手
+    connect_latency = 0.0
+    detail_pattern = re.compile(r'^/loupan/(\w+)/housedetail\.htm$')
+    list_pattern = re.compile(r'^/housing/(\d+)(?:_0_0_0_0_(\d+)_0_0_0)?/$')
+    region_pattern = re.compile(r'^/housing/r(\d+)/$')
+    city_host_pattern = re.compile(r'^c(\d+)\.')
+    list_pages = 5
+    # 每页与同区域其它子区域重复的小区数
+    list_overlap = 0
+    # 详情页中附加的无关节点块数
+    detail_padding = 0
+    # 页面中引用样式、脚本、字体、图片及第三方统计脚本
+    page_assets = False
+    # 城市列表及区域结构
+    provinces = 1
+    cities_per_province = 1
+    regions = 2
+    sub_regions = 2
+    # 返回验证码页的路径集合
+    captcha_paths = set()
+    # 小区id -> 详情版本号，修改后详情页房屋总数随之变化
+    detail_revisions = {}
+    # 同时在途请求超过该值时返回429，0表示不限制
+    max_inflight = 0
+    # 按比例随机返回的错误状态码，如 {500: 0.05}
+    error_rates = {}
+    inflight = [0]
+    last_modified = 'Mon, 13 Nov 2023 08:00:00 GMT'
+    # 按状态码统计请求数，由FixtureSite创建时替换为独立的dict
+    status_counts = {}
+    # 按响应类型（document/css/javascript/...）统计发送的字节数
+    bytes_sent = {}
+    counts_lock = threading.Lock()
+
+    def setup(self):
+        if self.connect_latency:
+            time.sleep(self.connect_latency)
+        super().setup()
+
+    def log_message(self, format, *args):
+        pass
+
+    def count(self, status):
+        with self.counts_lock:
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+
+    def send_body(self, body, status=200, content_type='text/html; charset=utf-8'):
+        data = body if isinstance(body, bytes) else body.encode('utf-8')
+        if self.page_assets and content_type.startswith('text/html'):
+            data = data.replace(b'</head>', ASSET_TAGS.format(port=self.server.server_address[1]).encode() +
+                                b'</head>', 1)
+        etag = '"%s"' % hashlib.md5(data).hexdigest()
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            self.count(304)
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.count(status)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        if self.compress and 'gzip' in self.headers.get('Accept-Encoding', '') and not content_type.startswith(
+                ('image/', 'font/')):
+            data = gzip.compress(data, compresslevel=5)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(data)))
+        if status == 200:
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', self.last_modified)
+        self.end_headers()
+        self.wfile.write(data)
+        kind = 'document' if content_type.startswith('text/html') else content_type.split('/')[-1]
+        with self.counts_lock:
+            self.bytes_sent[kind] = self.bytes_sent.get(kind, 0) + len(data)
+
+    def do_GET(self):
+        with self.counts_lock:
+            self.inflight[0] += 1
+            inflight = self.inflight[0]
+        try:
+            self.handle_get(inflight)
+        finally:
+            with self.counts_lock:
+                self.inflight[0] -= 1
+
+    def handle_get(self, inflight):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.max_inflight and inflight > self.max_inflight:
+            self.send_body('too many requests', status=429)
+            return
+        roll = random.random()
+        for status, rate in self.error_rates.items():
+            if roll < rate:
+                self.send_body('injected error', status=status)
+                return
+            roll -= rate
+        path = self.path.split('?')[0]
+        asset = ASSETS.get(path) or (ASSETS['image'] if path.startswith('/img/') else None)
+        if asset:
+            content_type, body = asset
+            # 内容随机，压缩后大小与原始大小接近
+            self.send_body(body if isinstance(body, bytes) else random.Random(path).randbytes(body),
+                           content_type=content_type)
+            return
+        if path in self.captcha_paths:
+            self.send_body(CAPTCHA_PAGE)
+            return
+        match = self.detail_pattern.match(path)
+        list_match = self.list_pattern.match(path)
+        region_match = self.region_pattern.match(path)
+        city_match = self.city_host_pattern.match(self.headers.get('Host', ''))
+        if path == '/newsecond/esfcities.aspx':
+            self.send_body(render_cities(self.server.server_address[1], self.provinces, self.cities_per_province))
+        elif path == '/housing/' and city_match:
+            self.send_body(render_city(self.regions))
+        elif region_match and city_match:
+            self.send_body(render_region(int(city_match.group(1)), int(region_match.group(1)), self.sub_regions))
+        elif match:
+            self.send_body(render_detail(match.group(1), self.detail_revisions.get(match.group(1), 0),
+                                         self.detail_padding))
+        elif list_match:
+            page_no = int(list_match.group(2) or 1)
+            self.send_body(render_list(list_match.group(1), page_no, self.list_pages, overlap=self.list_overlap))
+        else:
+            self.send_body('not found', status=404)
+
+
+class FixtureSite:
+    """
+    在后台线程中启动模拟站点
+    :param latency: 每个请求的模拟网络延迟（秒）
+    """
+
+    def __init__(self, latency=0.0, host='127.0.0.1', port=0, list_pages=5, max_inflight=0, error_rates=None,
+                 provinces=1, cities_per_province=1, regions=2, sub_regions=2, connect_latency=0.0, list_overlap=0,
+                 detail_padding=0, page_assets=False):
+        self.status_counts = {}
+        self.bytes_sent = {}
+        self.captcha_paths = set()
+        self.detail_revisions = {}
+        handler = type('Handler', (FixtureHandler,), {'latency': latency, 'status_counts': self.status_counts,
+                                                      'counts_lock': threading.Lock(), 'list_pages': list_pages,
+                                                      'captcha_paths': self.captcha_paths,
+                                                      'detail_revisions': self.detail_revisions,
+                                                      'max_inflight': max_inflight,
+                                                      'error_rates': error_rates or {}, 'inflight': [0],
+                                                      'provinces': provinces,
+                                                      'cities_per_province': cities_per_province,
+                                                      'regions': regions, 'sub_regions': sub_regions,
+                                                      'connect_latency': connect_latency,
+                                                      'list_overlap': list_overlap,
+                                                      'detail_padding': detail_padding,
+                                                      'page_assets': page_assets, 'bytes_sent': self.bytes_sent})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@contextlib.contextmanager
+def resolve_fixture_hosts():
+    """
+    将 *.esf.fixture.test 解析到本机，其余域名照常解析
+    """
+    original = socket.getaddrinfo
+
+    def getaddrinfo(host, *args, **kwargs):
+        if isinstance(host, str) and host.endswith(FIXTURE_DOMAIN):
+            host = '127.0.0.1'
+        return original(host, *args, **kwargs)
+
+    socket.getaddrinfo = getaddrinfo
+    try:
+        yield
+    finally:
+        socket.getaddrinfo = original
+
+
+class _NextPageLocator:
+    def __init__(self, page):
+        self.page = page
+
+    def _href(self):
+        match = re.search(r'<a href="([^"]+)">下一页</a>', self.page.html)
+        return match.group(1) if match else None
+
+    def is_visible(self):
+        return self.page.html is not None and self._href() is not None
+
+    def click(self):
+        self.page.goto(urljoin(self.page.url, self._href()))
+
+
+class HttpPage:
+    """
+    以HTTP请求模拟playwright的Page，供db_init等依赖浏览器页面的函数离线运行
+    只实现fang.py用到的 goto/content/url/locator('text=下一页')/wait_for_load_state
+    """
+
+    def __init__(self, retries=3):
+        self.session = requests.Session()
+        self.session.trust_env = False
+        self.retries = retries
+        self.url = None
+        self.html = None
+        self.latencies = []
+
+    def goto(self, url, wait_until=None):
+        for attempt in range(self.retries + 1):
+            start = time.perf_counter()
+            response = self.session.get(url, timeout=30)
+            self.latencies.append(time.perf_counter() - start)
+            # 浏览器遇到错误页时由人工刷新，这里直接重试
+            if response.status_code < 500 and response.status_code != 429:
+                break
+            time.sleep(0.05 * (attempt + 1))
+        self.url = url
+        self.html = response.text
+
+    def content(self):
+        return self.html
+
+    def locator(self, selector):
+        if selector != 'text=下一页':
+            raise NotImplementedError(selector)
+        return _NextPageLocator(self)
+
+    def wait_for_load_state(self, state=None):
+        pass
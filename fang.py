@@ -1,57 +1,612 @@
 # -*- coding: utf-8 -*-
+import contextlib
+import functools
+import gzip
+import hashlib
 import json
+import math
+import multiprocessing
 import os
+import queue
+import random
+import re
 import sqlite3
 import sys
 import textwrap
+import threading
 import time
-from datetime import datetime
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from urllib.parse import quote, urljoin, urlparse
 
-import pandas as pd
 import requests
 from lxml import etree
-from playwright.sync_api import sync_playwright
 
 cookies_path = "./fang_cookies.json"
 housing_url = 'https://gz.esf.fang.com/housing/'
+esf_cities_url = 'https://esf.fang.com/newsecond/esfcities.aspx'
+# 城市地址（形如//yl.esf.fang.com）补全时使用的协议
+site_scheme = 'https:'
 default_headers = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/58.0.3029.110 Safari/537.3'
 }
 DEBUG = False
+# 小区详情页采集并发线程数，1表示串行采集；None表示与自适应并发上限（ADAPTIVE_MAX_CONCURRENCY）相同，
+# 实际在途请求数由fetch_controller按站点响应调整
+DETAIL_WORKERS = None
+# 同一host下同时在途的最大请求数，None表示不单独限制，由fetch_controller控制
+DETAIL_PER_HOST_LIMIT = None
+# 详情采集流水线：请求线程 -> 解析进程池 -> 单个数据库写入线程
+# 解析进程数，0表示不使用流水线（请求线程中解析，当前线程写入）；
+# None表示自动：多核时使用CPU核数个解析进程，单核时解析进程只会与请求线程争抢CPU，不使用流水线
+DETAIL_PARSE_PROCESSES = None
+# 阶段之间队列的容量，队列满时上游阶段等待（背压），内存中最多保留约两倍容量的页面
+DETAIL_PIPELINE_QUEUE_SIZE = 64
+# 缓冲写入：累计多少条语句或距上次提交多少秒后批量提交一次
+DB_BATCH_SIZE = 500
+DB_FLUSH_INTERVAL = 2.0
+# 可选的sqlite pragma，如 journal_mode='WAL'、synchronous='NORMAL'，None表示使用sqlite默认值
+DB_JOURNAL_MODE = None
+DB_SYNCHRONOUS = None
+# 分库：None表示所有数据写入一个数据库文件；'province'/'city'表示每个省份（或省份-城市）一个数据库文件，存放在DB_SHARD_DIR
+DB_SHARD_BY = None
+DB_SHARD_DIR = './fang_shards'
+# 每个连接缓存的预编译语句数（sqlite3.connect的cached_statements），参数化查询的SQL文本相同，命中缓存时不再重新编译
+DB_STATEMENT_CACHE_SIZE = 256
+# HTTP响应磁盘缓存，过期后使用ETag/Last-Modified条件请求重新校验
+HTTP_CACHE_ENABLED = True
+HTTP_CACHE_DIR = './http_cache'
+# 按URL正则匹配的缓存有效期（秒），按顺序取第一个匹配项，未匹配使用HTTP_CACHE_DEFAULT_TTL
+HTTP_CACHE_TTLS = [
+    (r'/newsecond/esfcities\.aspx', 7 * 24 * 3600),
+    (r'/housedetail\.htm$', 24 * 3600),
+    (r'/housing/', 3600),
+]
+HTTP_CACHE_DEFAULT_TTL = 0
+# 缓存总大小上限（字节，响应内容压缩后）及条目最长保留时间（秒），超过后删除最旧的条目
+HTTP_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+HTTP_CACHE_MAX_AGE = 30 * 24 * 3600
+# 详情页原始html归档：按WARC格式压缩后追加写入PAGE_ARCHIVE_DIR下的分段文件，位置登记在ftx_page_archive表中，
+# 需要新增字段时用 python fang.py reextract 离线重新解析，无需重新请求；同一页面内容未变化时不重复归档
+PAGE_ARCHIVE_ENABLED = True
+PAGE_ARCHIVE_DIR = './page_archive'
+# 单个分段文件的大小上限（字节），超过后写入新的分段
+PAGE_ARCHIVE_SEGMENT_SIZE = 256 * 1024 * 1024
+# 自适应并发控制（AIMD）：成功时逐步降低请求间隔、增加并发，遇到限流/5xx/超时时并发减半，并发最小时间隔加倍
+ADAPTIVE_INITIAL_CONCURRENCY = 4
+ADAPTIVE_MIN_CONCURRENCY = 1
+ADAPTIVE_MAX_CONCURRENCY = 16
+ADAPTIVE_MIN_DELAY = 0.0
+ADAPTIVE_MAX_DELAY = 10.0
+# 单次请求超时（秒）及限流/5xx/超时后的最大重试次数、重试基础等待时间（秒）
+HTTP_TIMEOUT = 30
+HTTP_MAX_RETRIES = 3
+HTTP_RETRY_BACKOFF = 1.0
+# 长连接池：缓存连接的host数、每个host保持的连接数（应不小于并发上限）
+HTTP_POOL_CONNECTIONS = 10
+HTTP_POOL_MAXSIZE = ADAPTIVE_MAX_CONCURRENCY
+# 小区列表翻页方式：http 读取总页数后直接并发请求各分页，遇到验证码回退浏览器；browser 在浏览器中逐页点击"下一页"
+LIST_FETCH_MODE = 'http'
+LIST_FETCH_WORKERS = 4
+# 页面中出现以下内容时视为验证码页
+CAPTCHA_MARKERS = ('滑动验证', '请完成验证', '安全验证', 'captcha')
+# 详情采集任务：租约时长（秒）、最大尝试次数（超过后进入dead状态）、失败重试的基础等待时间（秒）
+JOB_LEASE_SECONDS = 300
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_DELAY = 30
+# 分阶段性能指标（浏览器导航、HTTP请求、页面解析、数据库写入、导出），关闭时几乎无额外开销
+METRICS_ENABLED = False
+# 周期性输出指标的文件，.prom结尾输出Prometheus文本格式，否则输出JSON；None表示不输出
+METRICS_DUMP_PATH = None
+METRICS_DUMP_INTERVAL = 30
+# 性能分析：设置输出目录后，按阶段记录cProfile统计和tracemalloc内存分配，每次运行输出到该目录下的独立子目录
+PROFILE_DIR = None
+# 分析的阶段，可选 main、db_init、spider_by_condition、process_list、to_excel；同一时刻只分析一个阶段，嵌套调用的阶段计入外层
+PROFILE_PHASES = ('db_init', 'spider_by_condition', 'to_excel')
+# 每个阶段输出的内存分配最多的代码行数、tracemalloc记录的调用栈深度
+PROFILE_TOP_ALLOCATIONS = 30
+PROFILE_TRACEMALLOC_FRAMES = 1
+# 浏览器启动参数
+BROWSER_LAUNCH_OPTIONS = {
+    'headless': False,
+    'slow_mo': 1000,
+    'args': ['--start-maximized']
+}
+# 精简浏览器模式：完成滑动验证并保存cookies后，改用BROWSER_LEAN_LAUNCH_OPTIONS（无界面、无slow_mo）启动的浏览器采集，
+# 只放行BROWSER_ALLOWED_DOMAINS下的页面文档请求，拦截图片、字体、样式、脚本及第三方域名请求，导航只等待DOMContentLoaded
+BROWSER_LEAN_MODE = False
+BROWSER_LEAN_LAUNCH_OPTIONS = {
+    'headless': True
+}
+BROWSER_ALLOWED_DOMAINS = ('fang.com',)
+# 区域信息初始化时并行使用的浏览器数量，每个浏览器共享保存的cookies，1表示只使用主浏览器页面
+BROWSER_POOL_SIZE = 1
+# 导出时每次从数据库游标读取的行数
+EXPORT_CHUNK_SIZE = 5000
+# 刷新模式：采集时间早于该天数的详情视为过期，按过期时长×(1+变化次数)排序后重新采集
+DETAIL_REFRESH_MAX_AGE_DAYS = 30
+# 刷新模式每次最多采集的小区数，None表示不限制
+DETAIL_REFRESH_BUDGET = None
+# 详情内容变化时在ftx_xiaoqu_detail_history中保留历史版本
+DETAIL_HISTORY_ENABLED = False
+# 小区去重：默认使用内存集合；设置容量后改用布隆过滤器（省内存，判定重复时到数据库确认）
+DEDUP_BLOOM_CAPACITY = None
+DEDUP_BLOOM_ERROR_RATE = 0.001
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+class _StageTimer:
+    __slots__ = ('metrics', 'stage', 'start')
+
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start, error=exc_type is not None)
+        return False
+
+
+class Metrics:
+    """
+    分阶段计数器及耗时直方图
+    用法: with metrics.timer('http_fetch'): ...   metrics.incr('http_cache_hit')
+    """
+    buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    _null_timer = _NullTimer()
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self._reporter = None
+
+    def timer(self, stage):
+        if not self.enabled:
+            return self._null_timer
+        return _StageTimer(self, stage)
+
+    def incr(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, stage, seconds, error=False):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = {'count': 0, 'sum': 0.0, 'max': 0.0, 'errors': 0,
+                                                      'buckets': [0] * (len(self.buckets) + 1)}
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+            histogram['max'] = max(histogram['max'], seconds)
+            if error:
+                histogram['errors'] += 1
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram['buckets'][index] += 1
+                    break
+            else:
+                histogram['buckets'][-1] += 1
+
+    def _quantile(self, histogram, q):
+        target = histogram['count'] * q
+        seen = 0
+        for index, count in enumerate(histogram['buckets']):
+            seen += count
+            if seen >= target and count:
+                return self.buckets[index] if index < len(self.buckets) else histogram['max']
+        return None
+
+    def snapshot(self):
+        with self._lock:
+            stages = {}
+            for stage, histogram in self.histograms.items():
+                stages[stage] = {
+                    'count': histogram['count'],
+                    'errors': histogram['errors'],
+                    'total_seconds': round(histogram['sum'], 3),
+                    'avg_seconds': round(histogram['sum'] / histogram['count'], 4) if histogram['count'] else 0,
+                    'max_seconds': round(histogram['max'], 4),
+                    'p50_le': self._quantile(histogram, 0.5),
+                    'p99_le': self._quantile(histogram, 0.99),
+                }
+            return {'uptime_seconds': round(time.time() - self.started, 1), 'stages': stages,
+                    'counters': dict(self.counters)}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+
+    def to_prometheus(self):
+        lines = []
+        with self._lock:
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"# TYPE fang_{name}_total counter")
+                lines.append(f"fang_{name}_total {value}")
+            lines.append("# TYPE fang_stage_seconds histogram")
+            for stage, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, histogram['buckets']):
+                    cumulative += count
+                    lines.append(f'fang_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'fang_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram["count"]}')
+                lines.append(f'fang_stage_seconds_sum{{stage="{stage}"}} {histogram["sum"]:.6f}')
+                lines.append(f'fang_stage_seconds_count{{stage="{stage}"}} {histogram["count"]}')
+            lines.append("# TYPE fang_stage_errors_total counter")
+            for stage, histogram in sorted(self.histograms.items()):
+                lines.append(f'fang_stage_errors_total{{stage="{stage}"}} {histogram["errors"]}')
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path):
+        content = self.to_prometheus() if path.endswith('.prom') else self.to_json()
+        temp_path = path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(temp_path, path)
+
+    def start_reporter(self, path=None, interval=None):
+        """
+        后台线程按间隔输出指标文件
+        """
+        path = path or METRICS_DUMP_PATH
+        if not self.enabled or not path or self._reporter:
+            return
+        stop = threading.Event()
+
+        def run():
+            while not stop.wait(interval or METRICS_DUMP_INTERVAL):
+                self.dump(path)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self._reporter = (stop, thread, path)
+
+    def stop_reporter(self):
+        if self._reporter:
+            stop, thread, path = self._reporter
+            stop.set()
+            thread.join()
+            self.dump(path)
+            self._reporter = None
+
+    def print_summary(self):
+        if not self.enabled:
+            return
+        snapshot = self.snapshot()
+        Print.green(f"性能指标汇总（运行{snapshot['uptime_seconds']}s）:")
+        for stage, stats in sorted(snapshot['stages'].items(), key=lambda item: -item[1]['total_seconds']):
+            Print.print2(f"{stage:<20} 次数={stats['count']:<8} 总耗时={stats['total_seconds']:<10} "
+                         f"平均={stats['avg_seconds']:<8} p50<={stats['p50_le']} p99<={stats['p99_le']} "
+                         f"错误={stats['errors']}")
+        for name, value in sorted(snapshot['counters'].items()):
+            Print.print2(f"{name:<20} {value}")
+
+
+metrics = Metrics(enabled=METRICS_ENABLED)
+
+
+def collapsed_stacks(stats, min_fraction=0.0001, max_depth=100):
+    """
+    将cProfile的调用关系展开为折叠调用栈（flamegraph.pl/speedscope/inferno的输入格式）
+    cProfile只记录调用者-被调用者之间的耗时，函数在各调用路径上的耗时按调用边的累计耗时比例分摊
+    :param stats: pstats.Stats
+    :return: {"root;...;func": 自身耗时（微秒）}
+    """
+    callees = {}
+    for func, (_, _, _, _, callers) in stats.stats.items():
+        for caller, caller_stats in callers.items():
+            callees.setdefault(caller, []).append((func, caller_stats[3]))
+    roots = [(func, values[3]) for func, values in stats.stats.items() if not values[4]]
+    min_seconds = sum(seconds for _, seconds in roots) * min_fraction
+    result = {}
+
+    def label(func):
+        filename, line, name = func
+        if filename == '~':
+            return name.replace(';', ',')
+        return f"{name} ({os.path.basename(filename)}:{line})".replace(';', ',')
+
+    def walk(func, seconds, stack):
+        _, _, self_seconds, cumulative, _ = stats.stats[func]
+        if seconds < min_seconds or not cumulative:
+            return
+        path = stack + [label(func)]
+        ratio = min(1.0, seconds / cumulative)
+        key = ';'.join(path)
+        result[key] = result.get(key, 0) + self_seconds * ratio * 1e6
+        if len(path) >= max_depth:
+            return
+        for callee, edge_seconds in callees.get(func, ()):
+            if label(callee) not in path:
+                walk(callee, edge_seconds * ratio, path)
+
+    for root, seconds in roots:
+        walk(root, seconds, [])
+    return result
+
+
+class Profiler:
+    """
+    按阶段记录cProfile统计及tracemalloc内存分配，未设置输出目录或阶段不在phases中时没有额外开销
+    每个阶段在运行目录中输出：
+      <阶段>.prof        pstats格式，可用snakeviz、flameprof等查看
+      <阶段>.folded      折叠调用栈（微秒），可用flamegraph.pl、speedscope、inferno生成火焰图
+      <阶段>.memory.txt  内存分配最多的代码行及峰值内存
+      summary.json       各阶段耗时、峰值内存、累计耗时最多的函数
+    阶段运行期间新启动的线程同样记录；进程池中的解析进程不在记录范围内
+    """
+
+    def __init__(self, output_dir=None, phases=None, top=None, frames=None):
+        self.output_dir = output_dir
+        self.phases = set(PROFILE_PHASES if phases is None else phases)
+        self.top = top or PROFILE_TOP_ALLOCATIONS
+        self.frames = frames or PROFILE_TRACEMALLOC_FRAMES
+        self.run_dir = None
+        self.summary = {}
+        self._active = None
+        self._lock = threading.Lock()
+        self._thread_profiles = []
+
+    def phase(self, name):
+        if self.output_dir is None or name not in self.phases or self._active:
+            return contextlib.nullcontext()
+        return self._profile(name)
+
+    def _phase_key(self, name):
+        count = sum(1 for key in self.summary if key == name or key.startswith(f"{name}-"))
+        return name if not count else f"{name}-{count + 1}"
+
+    def _start_thread_profile(self, *_):
+        import cProfile
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # 不支持多个线程分别记录时只记录阶段所在的线程
+            sys.setprofile(None)
+            return
+        with self._lock:
+            self._thread_profiles.append(profile)
+
+    @contextlib.contextmanager
+    def _profile(self, name):
+        import cProfile
+        import tracemalloc
+        with self._lock:
+            self._active = key = self._phase_key(name)
+            self._thread_profiles = []
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(self.frames)
+        tracemalloc.reset_peak()
+        profile = cProfile.Profile()
+        threading.setprofile(self._start_thread_profile)
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            elapsed = time.perf_counter() - start
+            threading.setprofile(None)
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            if started_tracing:
+                tracemalloc.stop()
+            self._write(key, elapsed, profile, snapshot, peak)
+            self._active = None
+
+    def _write(self, key, elapsed, profile, snapshot, peak):
+        import pstats
+        if self.run_dir is None:
+            self.run_dir = os.path.join(self.output_dir, datetime.now().strftime('%Y%m%d_%H%M%S'))
+            os.makedirs(self.run_dir, exist_ok=True)
+        path = os.path.join(self.run_dir, key)
+        stats = pstats.Stats(profile)
+        for thread_profile in self._thread_profiles:
+            stats.add(thread_profile)
+        stats.dump_stats(f"{path}.prof")
+        with open(f"{path}.folded", 'w', encoding='utf-8') as f:
+            for stack, microseconds in sorted(collapsed_stacks(stats).items()):
+                if microseconds >= 1:
+                    f.write(f"{stack} {int(microseconds)}\n")
+        allocations = snapshot.statistics('lineno')[:self.top]
+        with open(f"{path}.memory.txt", 'w', encoding='utf-8') as f:
+            f.write(f"peak={peak / 1024 / 1024:.2f}MB\n")
+            for allocation in allocations:
+                f.write(f"{allocation}\n")
+        top_functions = sorted(stats.stats.items(), key=lambda item: -item[1][3])[:10]
+        self.summary[key] = {
+            'seconds': round(elapsed, 3),
+            'peak_memory_mb': round(peak / 1024 / 1024, 2),
+            'threads': 1 + len(self._thread_profiles),
+            'top_cumulative': [{'function': pstats.func_std_string(func), 'calls': values[1],
+                                'cumulative_seconds': round(values[3], 4)} for func, values in top_functions],
+        }
+        with open(os.path.join(self.run_dir, 'summary.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.summary, f, ensure_ascii=False, indent=2)
+        Print.print2(f"[{key}] 性能分析已保存: {path}.prof/.folded/.memory.txt 耗时{elapsed:.2f}s "
+                     f"峰值内存{peak / 1024 / 1024:.2f}MB")
+
+
+profiler = Profiler(PROFILE_DIR)
+
+
+def profile_phase(name):
+    """
+    将函数的一次调用作为一个性能分析阶段
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with profiler.phase(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
 
 
 class SQLiteDB:
-    def __init__(self, db_file='fang.db'):
-        self.conn = sqlite3.connect(db_file, check_same_thread=False)
-        self.cursor = self.conn.cursor()
+    """
+    连接在第一次使用时才建立，导入模块或只做解析时不会创建数据库文件
+    """
+
+    def __init__(self, db_file='fang.db', batch_size=None, flush_interval=None, journal_mode=None, synchronous=None,
+                 statement_cache_size=None):
+        self.db_file = db_file
+        self.statement_cache_size = DB_STATEMENT_CACHE_SIZE if statement_cache_size is None else statement_cache_size
+        self._conn = None
+        self._cursor = None
+        self._connect_lock = threading.Lock()
+        self._pragmas = (journal_mode or DB_JOURNAL_MODE, synchronous or DB_SYNCHRONOUS)
+        self.batch_size = DB_BATCH_SIZE if batch_size is None else batch_size
+        self.flush_interval = DB_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self._pending = []
+        self._pending_lock = threading.RLock()
+        self._last_flush = time.monotonic()
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            with self._connect_lock:
+                if self._conn is None:
+                    self._conn = sqlite3.connect(self.db_file, check_same_thread=False,
+                                                 cached_statements=self.statement_cache_size)
+                    self.set_pragmas(*self._pragmas)
+        return self._conn
+
+    @property
+    def cursor(self):
+        return self.check_cursor()
+
+    def set_pragmas(self, journal_mode=None, synchronous=None):
+        """
+        设置sqlite写入相关pragma
+        :param journal_mode: 如WAL、DELETE
+        :param synchronous: 如OFF、NORMAL、FULL
+        :return:
+        """
+        if journal_mode:
+            self.conn.execute(f"PRAGMA journal_mode={journal_mode}")
+        if synchronous:
+            self.conn.execute(f"PRAGMA synchronous={synchronous}")
 
     def check_cursor(self):
-        if self.cursor is None:
-            self.cursor = self.conn.cursor()
-        return self.cursor
+        if self._cursor is None:
+            self._cursor = self.conn.cursor()
+        return self._cursor
 
     def close(self):
-        if self.conn:
-            self.cursor.close()
-            self.conn.close()
+        self.flush()
+        if self._conn:
+            if self._cursor is not None:
+                self._cursor.close()
+            self._conn.close()
+            self._conn = None
+            self._cursor = None
 
     def execute(self, sql, params=()):
-        self.check_cursor()
-        self.cursor.execute(sql, params)
-        self.conn.commit()
+        self.flush()
+        with metrics.timer('db_write'):
+            self.check_cursor()
+            self.cursor.execute(sql, params)
+            self.conn.commit()
 
-    def query(self, sql):
-        self.check_cursor()
-        self.cursor.execute(sql)
-        rows = self.cursor.fetchall()
+    def buffer_execute(self, sql, params=()):
+        """
+        缓冲写入，语句暂存在内存中，达到batch_size或flush_interval后在一个事务中批量提交
+        :param sql:
+        :param params:
+        :return:
+        """
+        with self._pending_lock:
+            self._pending.append((sql, params))
+            if len(self._pending) >= self.batch_size or \
+                    time.monotonic() - self._last_flush >= self.flush_interval:
+                self.flush()
 
-        columns = [column[0] for column in self.cursor.description]
+    def flush(self):
+        """
+        提交缓冲区中的所有语句，相邻的相同语句合并为一次executemany
+        :return:
+        """
+        with self._pending_lock:
+            self._last_flush = time.monotonic()
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, []
+            groups = []
+            for sql, params in pending:
+                if groups and groups[-1][0] == sql:
+                    groups[-1][1].append(params)
+                else:
+                    groups.append((sql, [params]))
+            with metrics.timer('db_write'), self.conn:
+                for sql, params_list in groups:
+                    self.conn.executemany(sql, params_list)
+            metrics.incr('db_rows_written', len(pending))
 
-        result = []
-        for row in rows:
-            result.append(dict(zip(columns, row)))
+    @staticmethod
+    def where(condition, params=()):
+        """
+        生成WHERE条件
+        :param condition: 字典时生成 字段 = ? AND ...（值为None时生成 字段 IS NULL），字符串时原样使用，其中的值用?占位
+        :param params: condition为字符串时的占位符参数
+        :return: (条件sql, 参数元组)，condition为空时条件sql为空字符串
+        """
+        if not isinstance(condition, dict):
+            return condition or '', tuple(params)
+        clauses, values = [], []
+        for column, value in condition.items():
+            if value is None:
+                clauses.append(f"{column} IS NULL")
+            else:
+                clauses.append(f"{column} = ?")
+                values.append(value)
+        return ' AND '.join(clauses), tuple(values)
 
-        return result
+    def query(self, sql, params=()):
+        self.flush()
+        cursor = self.conn.execute(sql, params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def iter_query(self, sql, params=(), chunk_size=None):
+        """
+        分批读取查询结果，避免一次性加载到内存
+        :return: 生成 (列名列表, 行元组列表)
+        """
+        self.flush()
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(sql, params)
+            columns = [column[0] for column in cursor.description]
+            while True:
+                rows = cursor.fetchmany(chunk_size or EXPORT_CHUNK_SIZE)
+                if not rows:
+                    break
+                yield columns, rows
+        finally:
+            cursor.close()
 
     def commit(self):
         self.conn.commit()
@@ -74,43 +629,211 @@ class SQLiteDB:
         keys = data[0].keys()
         placeholders = ','.join(':' + key for key in keys)
         insert_statement = f'INSERT INTO {table} ({",".join(keys)}) VALUES ({placeholders})'
-        self.check_cursor()
-        for item in data:
-            self.cursor.execute(insert_statement, item)
-        self.conn.commit()
+        self.flush()
+        with metrics.timer('db_write'), self.conn:
+            self.conn.executemany(insert_statement, data)
+
+    def buffer_insert(self, table, data):
+        fields = ', '.join(data.keys())
+        placeholders = ', '.join('?' * len(data))
+        self.buffer_execute(f'INSERT INTO {table} ({fields}) VALUES ({placeholders})', tuple(data.values()))
+
+    def buffer_upsert(self, table, data, conflict=None):
+        self.buffer_execute(self.upsert_sql(table, data, conflict), tuple(data.values()))
+
+    def buffer_delete(self, table, condition, params=()):
+        condition, params = self.where(condition, params)
+        self.buffer_execute(f'DELETE FROM {table} WHERE {condition}', params)
 
-    def upsert(self, table, data):
+    @staticmethod
+    def upsert_sql(table, data, conflict=None):
+        """
+        生成upsert语句
+        :param conflict: 唯一键字段，传入时生成INSERT ... ON CONFLICT DO UPDATE，否则生成INSERT OR REPLACE
+        :return:
+        """
         placeholders = ", ".join(["?"] * len(data))
         columns = ", ".join(data.keys())
-        values = tuple(data.values())
-        sql = f"INSERT OR REPLACE INTO {table} ({columns}) VALUES ({placeholders})"
-        self.execute(sql, values)
-
-    def update(self, table, data, condition):
+        if not conflict:
+            return f"INSERT OR REPLACE INTO {table} ({columns}) VALUES ({placeholders})"
+        updates = [f"{k}=excluded.{k}" for k in data.keys() if k not in conflict]
+        updates.append("update_time=datetime(CURRENT_TIMESTAMP, 'localtime')")
+        return f"INSERT INTO {table} ({columns}) VALUES ({placeholders}) " \
+               f"ON CONFLICT ({', '.join(conflict)}) DO UPDATE SET {', '.join(updates)}"
+
+    def upsert(self, table, data, conflict=None):
+        self.execute(self.upsert_sql(table, data, conflict), tuple(data.values()))
+
+    def update(self, table, data, condition, params=()):
+        condition, params = self.where(condition, params)
         set_fields = ', '.join([f'{k}=?' for k in data.keys()])
         sql = f'UPDATE {table} SET {set_fields} WHERE {condition}'
-        self.execute(sql, tuple(data.values()))
+        self.execute(sql, tuple(data.values()) + params)
 
-    def delete(self, table, condition):
-        self.check_cursor()
-        sql = f'DELETE FROM {table} WHERE {condition}'
-        self.execute(sql)
+    def delete(self, table, condition, params=()):
+        condition, params = self.where(condition, params)
+        self.execute(f'DELETE FROM {table} WHERE {condition}', params)
 
-    def count(self, table):
-        self.check_cursor()
-        self.cursor.execute(f"SELECT count(*) FROM {table};")
-        return self.cursor.fetchall()[0][0]
+    def count(self, table, condition=None, params=()):
+        condition, params = self.where(condition, params)
+        sql = f"SELECT count(*) AS cnt FROM {table}"
+        if condition:
+            sql += f" WHERE {condition}"
+        return self.query(sql, params)[0]['cnt']
 
-    def select(self, table, condition=''):
+    def select(self, table, condition=None, params=()):
+        """
+        :param condition: 条件字典如 {'province_name': '广西'}，或带?占位符的条件字符串及params
+        """
+        condition, params = self.where(condition, params)
         sql = f'SELECT * FROM {table}'
         if condition:
-            sql += f' WHERE {condition} ;'
-        return self.query(sql)
+            sql += f' WHERE {condition}'
+        return self.query(sql, params)
+
+    def columns(self, sql, params=()):
+        return [column[0] for column in self.conn.execute(sql, params).description]
+
+    def vacuum(self, into=None):
+        """
+        :param into: 传入文件路径时生成整理后的副本（VACUUM INTO），不修改当前数据库
+        """
+        self.flush()
+        if into:
+            self.conn.execute("VACUUM INTO ?", (into,))
+        else:
+            self.conn.execute("VACUUM")
 
 
 db = SQLiteDB()
 
 
+class ShardedDB:
+    """
+    分库：每个省份（或省份-城市）一个完整的数据库文件，包含全部表和迁移，可单独VACUUM、复制或删除
+    采集、初始化、任务等命令只连接所属的分片，不同省份的进程不再争用同一个写锁；
+    跨分片的导出逐个分片读取后合并，统计类查询ATTACH到一个连接上执行
+    """
+
+    def __init__(self, shard_dir=None, shard_by=None, **db_kwargs):
+        self.shard_dir = shard_dir or DB_SHARD_DIR
+        self.shard_by = shard_by or DB_SHARD_BY or 'province'
+        if self.shard_by not in ('province', 'city'):
+            raise ValueError(f"不支持的分库方式: {self.shard_by}")
+        self.db_kwargs = db_kwargs
+        self._databases = {}
+        self._lock = threading.Lock()
+
+    def shard_key(self, province, city=None):
+        if not province:
+            raise ValueError("分库模式下需要指定省份")
+        parts = [province]
+        if self.shard_by == 'city':
+            if not city:
+                raise ValueError("按城市分库时需要指定城市")
+            parts.append(city)
+        return re.sub(r'[\\/:*?"<>|\s]+', '_', '-'.join(parts))
+
+    def shard_path(self, key):
+        return os.path.join(self.shard_dir, f"{key}.db")
+
+    def keys(self):
+        if not os.path.isdir(self.shard_dir):
+            return []
+        return sorted(name[:-3] for name in os.listdir(self.shard_dir) if name.endswith('.db'))
+
+    def open(self, key):
+        with self._lock:
+            database = self._databases.get(key)
+            if database is None:
+                os.makedirs(self.shard_dir, exist_ok=True)
+                database = self._databases[key] = SQLiteDB(self.shard_path(key), **self.db_kwargs)
+            return database
+
+    def shard(self, province, city=None):
+        """
+        省份（按城市分库时为省份-城市）所属的分片，文件不存在时创建
+        """
+        return self.open(self.shard_key(province, city))
+
+    def databases(self):
+        return [self.open(key) for key in self.keys()]
+
+    def iter_query(self, sql, params=(), chunk_size=None):
+        """
+        在每个分片上执行查询并按分片顺序合并结果（UNION ALL）
+        """
+        for database in self.databases():
+            yield from database.iter_query(sql, params, chunk_size=chunk_size)
+
+    def query(self, sql, params=()):
+        return [row for database in self.databases() for row in database.query(sql, params)]
+
+    def columns(self, sql, params=()):
+        databases = self.databases()
+        if not databases:
+            raise Exception(f"{self.shard_dir}下没有分片数据库")
+        return databases[0].columns(sql, params)
+
+    @contextlib.contextmanager
+    def attach(self, keys):
+        """
+        只读ATTACH多个分片到一个内存连接
+        :return: (连接, {分片名: 别名})
+        """
+        conn = sqlite3.connect(':memory:', uri=True)
+        try:
+            aliases = {}
+            for index, key in enumerate(keys):
+                self.open(key).flush()
+                alias = aliases[key] = f"shard{index}"
+                uri = 'file:' + quote(os.path.abspath(self.shard_path(key))) + '?mode=ro'
+                conn.execute(f"ATTACH DATABASE ? AS {alias}", (uri,))
+            yield conn, aliases
+        finally:
+            conn.close()
+
+    def union_query(self, template, keys=None):
+        """
+        ATTACH分片后执行各分片 template.format(alias=别名) 的UNION ALL，template中的一个?绑定分片名
+        单个连接可ATTACH的数据库数有限（sqlite默认10），分片较多时分组执行后合并
+        """
+        keys = self.keys() if keys is None else list(keys)
+        probe = sqlite3.connect(':memory:')
+        limit = probe.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED) if hasattr(probe, 'getlimit') else 10
+        probe.close()
+        result = []
+        for start in range(0, len(keys), limit):
+            group = keys[start:start + limit]
+            with self.attach(group) as (conn, aliases):
+                sql = ' UNION ALL '.join(template.format(alias=aliases[key]) for key in group)
+                cursor = conn.execute(sql, group)
+                columns = [column[0] for column in cursor.description]
+                result.extend(dict(zip(columns, row)) for row in cursor.fetchall())
+        return result
+
+    def vacuum(self, keys=None, into_dir=None):
+        """
+        :param into_dir: 传入目录时把整理后的分片复制到该目录，原分片不变
+        :return: [(分片名, 整理前字节数, 整理后字节数)]
+        """
+        result = []
+        if into_dir:
+            os.makedirs(into_dir, exist_ok=True)
+        for key in self.keys() if keys is None else keys:
+            before = os.path.getsize(self.shard_path(key))
+            target = os.path.join(into_dir, f"{key}.db") if into_dir else None
+            self.open(key).vacuum(into=target)
+            result.append((key, before, os.path.getsize(target or self.shard_path(key))))
+        return result
+
+    def close(self):
+        with self._lock:
+            databases, self._databases = list(self._databases.values()), {}
+        for database in databases:
+            database.close()
+
+
 class Print:
     @staticmethod
     def red(text):
@@ -154,7 +877,7 @@ class Cookies:
         except Exception as e:
             print(e)
             Print.red("Failed to load cookies file")
-            Print.red(e.args[0])
+            Print.red(str(e.args[0]))
 
     def convert_to_http_header(self, cookies=None, filter_dict=None):
         if cookies:
@@ -172,23 +895,649 @@ class Cookies:
         return header_string
 
 
+class CookieStore:
+    """
+    将playwright storage_state导出的cookies文件加载到内存，按域名/路径/过期时间匹配生成Cookie请求头
+    同一host、协议的匹配结果会缓存，文件修改时间变化或其中有cookie过期时重新计算
+    """
+
+    def __init__(self, cookie_path):
+        self.cookie_path = cookie_path
+        self.cookies = []
+        # 首次调用reload时总会加载
+        self.mtime = -1
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _mtime(self):
+        try:
+            return os.stat(self.cookie_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def reload(self):
+        """
+        :return: 文件有变化并已重新加载时返回True
+        """
+        mtime = self._mtime()
+        if mtime == self.mtime:
+            return False
+        with self._lock:
+            if mtime == self.mtime:
+                return False
+            cookies = []
+            if mtime is not None:
+                state = Cookies(self.cookie_path).cookies or {}
+                for item in state.get('cookies', []):
+                    if 'name' in item and 'value' in item:
+                        cookies.append(self.to_cookie(item))
+            self.cookies = cookies
+            self._cache = {}
+            self.mtime = mtime
+        return True
+
+    @staticmethod
+    def to_cookie(item):
+        domain = (item.get('domain') or '').lower()
+        # playwright中会话cookie的expires为-1；domain不以.开头的是host-only cookie
+        expires = item.get('expires')
+        return {
+            'name': item['name'],
+            'value': item['value'],
+            'domain': domain.lstrip('.'),
+            'host_only': not domain.startswith('.'),
+            'path': item.get('path') or '/',
+            'secure': bool(item.get('secure')),
+            'expires': expires if expires and expires > 0 else None,
+        }
+
+    @staticmethod
+    def domain_match(cookie, host):
+        if cookie['host_only']:
+            return host == cookie['domain']
+        return host == cookie['domain'] or host.endswith('.' + cookie['domain'])
+
+    @staticmethod
+    def path_match(cookie_path, path):
+        if path == cookie_path or cookie_path == '/':
+            return True
+        return path.startswith(cookie_path) and (cookie_path.endswith('/') or path[len(cookie_path)] == '/')
+
+    def _match_host(self, host, secure, now):
+        matched = [cookie for cookie in self.cookies
+                   if self.domain_match(cookie, host) and (secure or not cookie['secure'])
+                   and (cookie['expires'] is None or cookie['expires'] > now)]
+        # 路径更长的cookie排在前面
+        matched.sort(key=lambda cookie: -len(cookie['path']))
+        valid_until = min((cookie['expires'] for cookie in matched if cookie['expires']), default=float('inf'))
+        if all(cookie['path'] == '/' for cookie in matched):
+            return valid_until, "; ".join(f"{cookie['name']}={cookie['value']}" for cookie in matched), None
+        return valid_until, None, matched
+
+    def header(self, url):
+        """
+        :return: 该url应携带的Cookie请求头，没有匹配的cookie时返回空字符串
+        """
+        parsed = urlparse(url)
+        host = (parsed.hostname or '').lower()
+        secure = parsed.scheme == 'https'
+        now = time.time()
+        entry = self._cache.get((host, secure))
+        if entry is None or entry[0] <= now:
+            entry = self._match_host(host, secure, now)
+            self._cache[(host, secure)] = entry
+        _, header, matched = entry
+        if header is not None:
+            return header
+        path = parsed.path or '/'
+        return "; ".join(f"{cookie['name']}={cookie['value']}" for cookie in matched
+                         if self.path_match(cookie['path'], path))
+
+
+class HttpSession:
+    """
+    长连接会话，复用连接池；Cookie请求头由CookieStore生成，文件更新后下次请求自动使用新cookies
+    响应的gzip/deflate由requests自动解压，安装brotli后同时支持br
+    代理（含NO_PROXY）、REQUESTS_CA_BUNDLE及.netrc等环境配置仍由requests按请求读取
+    """
+
+    def __init__(self, cookie_path=None, pool_connections=HTTP_POOL_CONNECTIONS, pool_maxsize=HTTP_POOL_MAXSIZE):
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers.update(default_headers)
+        self.cookie_store = None
+        if cookie_path:
+            self.use_cookies(cookie_path)
+
+    def use_cookies(self, cookie_path):
+        if self.cookie_store is None or self.cookie_store.cookie_path != cookie_path:
+            self.cookie_store = CookieStore(cookie_path)
+
+    def _with_cookies(self, url, headers):
+        if self.cookie_store is None:
+            return headers
+        self.cookie_store.reload()
+        cookie = self.cookie_store.header(url)
+        if not cookie:
+            return headers
+        return {'Cookie': cookie, **(headers or {})}
+
+    def get(self, url, params=None, headers=None, timeout=None):
+        return self.session.get(url, params=params, headers=self._with_cookies(url, headers), timeout=timeout)
+
+    def post(self, url, *args, headers=None, **kwargs):
+        return self.session.post(url, *args, headers=self._with_cookies(url, headers), **kwargs)
+
+    def close(self):
+        self.session.close()
+
+
+http_session = HttpSession(cookie_path=cookies_path)
+
+
+class FetchError(Exception):
+    """
+    请求被限流、服务端错误或超时且重试后仍失败，区别于页面确实不存在
+    """
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class AdaptiveController:
+    """
+    AIMD自适应并发控制器，包装实际的HTTP请求
+    - 统计成功、429、5xx、超时、其它异常的次数及请求耗时
+    - 每成功一个并发窗口的请求，先缩短请求间隔，间隔为最小值后并发上限+1
+    - 遇到429/5xx/超时时并发上限减半，并发已为最小值时请求间隔加倍
+    - 限流/5xx/超时按带抖动的指数退避重试，优先使用Retry-After
+    """
+    throttle_statuses = (429, 503)
+
+    def __init__(self, initial=ADAPTIVE_INITIAL_CONCURRENCY, min_limit=ADAPTIVE_MIN_CONCURRENCY,
+                 max_limit=ADAPTIVE_MAX_CONCURRENCY, min_delay=ADAPTIVE_MIN_DELAY, max_delay=ADAPTIVE_MAX_DELAY,
+                 max_retries=HTTP_MAX_RETRIES, backoff=HTTP_RETRY_BACKOFF, timeout=HTTP_TIMEOUT):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.delay = min_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.in_flight = 0
+        self.successes = 0
+        self.last_start = 0.0
+        self.last_decrease = 0.0
+        self.counters = {'success': 0, 'throttled': 0, 'server_error': 0, 'timeout': 0, 'error': 0, 'retry': 0}
+        self.latencies = deque(maxlen=1000)
+        self.decisions = deque(maxlen=100)
+        self._condition = threading.Condition()
+
+    def _acquire(self):
+        with self._condition:
+            while self.in_flight >= max(1, int(self.limit)):
+                self._condition.wait()
+            self.in_flight += 1
+            # 按当前请求间隔错开各请求的开始时间
+            start_at = max(time.monotonic(), self.last_start + self.delay)
+            self.last_start = start_at
+        wait = start_at - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+    def _release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def _decide(self, action, reason):
+        self.decisions.append({'time': time.time(), 'action': action, 'reason': reason,
+                               'limit': round(self.limit, 2), 'delay': round(self.delay, 3)})
+        if action == 'decrease' or DEBUG:
+            Print.print2(f"并发控制: {action} ({reason}) 并发上限={self.limit:.1f} 请求间隔={self.delay:.2f}s")
+
+    def _on_success(self, latency):
+        with self._condition:
+            self.counters['success'] += 1
+            self.latencies.append(latency)
+            self.successes += 1
+            if self.successes >= self.limit:
+                self.successes = 0
+                # 先缩短请求间隔，间隔降到最小后再增加并发
+                if self.delay > self.min_delay:
+                    self.delay = max(self.min_delay, self.delay / 2 if self.delay > 0.01 else 0.0)
+                    self._decide('increase', 'success window, shorter delay')
+                elif self.limit < self.max_limit:
+                    self.limit = min(self.max_limit, self.limit + 1)
+                    self._decide('increase', 'success window, higher concurrency')
+                self._condition.notify_all()
+
+    def _on_pushback(self, kind, reason, latency=None):
+        with self._condition:
+            self.counters[kind] += 1
+            if latency is not None:
+                self.latencies.append(latency)
+            self.successes = 0
+            now = time.monotonic()
+            # 同一批在途请求的连续失败只减一次
+            if now - self.last_decrease >= max(self.delay, self.average_latency(), 0.5):
+                self.last_decrease = now
+                # 先减半并发，并发已降到最小时再加大请求间隔
+                if self.limit > self.min_limit:
+                    self.limit = max(self.min_limit, self.limit / 2)
+                else:
+                    self.delay = min(self.max_delay, max(self.delay * 2, 0.1))
+                self._decide('decrease', reason)
+
+    def average_latency(self):
+        return sum(self.latencies) / len(self.latencies) if self.latencies else 0.0
+
+    def retry_wait(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.max_delay * 6)
+        return self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+
+    def fetch(self, url, params=None, headers=None, timeout=None, method=None):
+        """
+        受控请求，限流/5xx/超时自动重试
+        :return: 最后一次请求的响应（可能是429/5xx），超时或连接异常重试后仍失败时抛出异常
+        """
+        method = method or http_session.get
+        attempt = 0
+        while True:
+            self._acquire()
+            start = time.monotonic()
+            response, error = None, None
+            try:
+                with metrics.timer('http_fetch'):
+                    response = method(url=url, params=params, headers=headers, timeout=timeout or self.timeout)
+                metrics.incr(f'http_status_{response.status_code}')
+            except requests.exceptions.Timeout as e:
+                error = e
+                self._on_pushback('timeout', f'timeout {url}')
+            except requests.exceptions.ConnectionError as e:
+                error = e
+                self._on_pushback('error', f'connection error {url}')
+            finally:
+                self._release()
+            latency = time.monotonic() - start
+            if response is not None:
+                if response.status_code in self.throttle_statuses:
+                    self._on_pushback('throttled', f'HTTP {response.status_code}', latency)
+                elif response.status_code >= 500:
+                    self._on_pushback('server_error', f'HTTP {response.status_code}', latency)
+                else:
+                    self._on_success(latency)
+                    return response
+            if attempt >= self.max_retries:
+                if error is not None:
+                    raise error
+                return response
+            with self._condition:
+                self.counters['retry'] += 1
+            time.sleep(self.retry_wait(attempt, response))
+            attempt += 1
+
+    def snapshot(self):
+        with self._condition:
+            latencies = sorted(self.latencies)
+
+            def percentile(p):
+                return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))], 3) if latencies else None
+
+            return {
+                'limit': round(self.limit, 2),
+                'delay': round(self.delay, 3),
+                'in_flight': self.in_flight,
+                **self.counters,
+                'latency_p50': percentile(0.5),
+                'latency_p99': percentile(0.99),
+                'last_decision': self.decisions[-1] if self.decisions else None
+            }
+
+
+fetch_controller = AdaptiveController()
+
+
+class HttpCache:
+    """
+    HTTP GET响应磁盘缓存
+    有效期内直接返回缓存，过期后携带If-None-Match/If-Modified-Since重新校验，304时沿用缓存内容
+    有效期为0且没有ETag/Last-Modified的响应不缓存；响应内容gzip压缩存储，总大小超过max_bytes或超过max_age的条目被删除
+    """
+
+    def __init__(self, cache_dir=HTTP_CACHE_DIR, ttls=None, default_ttl=HTTP_CACHE_DEFAULT_TTL, enabled=True,
+                 max_bytes=HTTP_CACHE_MAX_BYTES, max_age=HTTP_CACHE_MAX_AGE):
+        self.cache_dir = cache_dir
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in (HTTP_CACHE_TTLS if ttls is None else ttls)]
+        self.default_ttl = default_ttl
+        self.enabled = enabled
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        # 缓存目录的当前大小，首次写入时统计；正在清理时其他线程不再重复清理
+        self._size = None
+        self._pruning = False
+        self.counters = {'hit': 0, 'miss': 0, 'revalidated': 0, 'store': 0, 'pruned': 0}
+
+    def _incr(self, name):
+        with self._lock:
+            self.counters[name] += 1
+        metrics.incr(f'http_cache_{name}')
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters)
+
+    def get_ttl(self, url):
+        for pattern, ttl in self.ttls:
+            if pattern.search(url):
+                return ttl
+        return self.default_ttl
+
+    def _path(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _load(self, path):
+        try:
+            with open(path + '.json', 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(path + '.body', 'rb') as f:
+                return meta, gzip.decompress(f.read())
+        except (OSError, ValueError, EOFError):
+            return None, None
+
+    def _write(self, path, suffix, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}{suffix}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path + suffix)
+
+    def _store(self, path, response, ttl):
+        if ttl <= 0 and not (response.headers.get('ETag') or response.headers.get('Last-Modified')):
+            # 既不会在有效期内命中，也无法条件请求重新校验
+            return
+        meta = {
+            'url': response.url,
+            'stored_at': time.time(),
+            'encoding': response.encoding,
+            'headers': {k: v for k, v in response.headers.items()
+                        if k.lower() in ('content-type', 'etag', 'last-modified')}
+        }
+        body = gzip.compress(response.content)
+        self._write(path, '.body', body)
+        self._write(path, '.json', json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+        self._incr('store')
+        with self._lock:
+            if self._size is not None:
+                self._size += len(body)
+            prune = not self._pruning and (self._size is None or self._size > self.max_bytes)
+            self._pruning = self._pruning or prune
+        if prune:
+            try:
+                self.prune()
+            finally:
+                with self._lock:
+                    self._pruning = False
+
+    def prune(self):
+        """
+        删除超过max_age的条目，剩余总大小超过max_bytes时按存储时间从旧到新删除
+        :return: 删除的条目数
+        """
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith('.json'):
+                    continue
+                path = os.path.join(root, name[:-len('.json')])
+                try:
+                    stored_at = os.path.getmtime(path + '.json')
+                    size = os.path.getsize(path + '.body')
+                except OSError:
+                    continue
+                entries.append((stored_at, size, path))
+        now = time.time()
+        total = removed = 0
+        for stored_at, size, path in sorted(entries, reverse=True):
+            if now - stored_at > self.max_age or total + size > self.max_bytes:
+                self._remove(path)
+                removed += 1
+            else:
+                total += size
+        with self._lock:
+            self._size = total
+            self.counters['pruned'] += removed
+        metrics.incr('http_cache_pruned', removed)
+        return removed
+
+    def _touch(self, path, meta):
+        meta['stored_at'] = time.time()
+        self._write(path, '.json', json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+
+    @staticmethod
+    def _to_response(url, meta, body):
+        response = requests.models.Response()
+        response.status_code = 200
+        response.url = meta.get('url') or url
+        response.encoding = meta.get('encoding')
+        response.headers = requests.structures.CaseInsensitiveDict(meta.get('headers', {}))
+        response._content = body
+        return response
+
+    def invalidate(self, url):
+        self._remove(self._path(url))
+
+    @staticmethod
+    def _remove(path):
+        for suffix in ('.json', '.body'):
+            try:
+                os.remove(path + suffix)
+            except OSError:
+                pass
+
+    def get(self, url, params=None, headers=None, timeout=None, fetch=None):
+        """
+        带缓存的GET请求，异常及非200响应原样抛出/返回，不做缓存
+        :param fetch: 实际发送请求的函数，默认fetch_controller.fetch
+        :return:
+        """
+        fetch = fetch or fetch_controller.fetch
+        if not self.enabled:
+            return fetch(url=url, params=params, headers=headers, timeout=timeout)
+        full_url = requests.models.PreparedRequest()
+        full_url.prepare_url(url, params)
+        full_url = full_url.url
+        path = self._path(full_url)
+        meta, body = self._load(path)
+        if meta is not None:
+            if time.time() - meta['stored_at'] < self.get_ttl(full_url):
+                self._incr('hit')
+                return self._to_response(full_url, meta, body)
+            validators = {}
+            if meta['headers'].get('ETag'):
+                validators['If-None-Match'] = meta['headers']['ETag']
+            if meta['headers'].get('Last-Modified'):
+                validators['If-Modified-Since'] = meta['headers']['Last-Modified']
+            if validators:
+                response = fetch(url=full_url, headers={**(headers or {}), **validators}, timeout=timeout)
+                if response.status_code == 304:
+                    self._incr('revalidated')
+                    self._touch(path, meta)
+                    return self._to_response(full_url, meta, body)
+                self._incr('miss')
+                if response.status_code == 200:
+                    self._store(path, response, self.get_ttl(full_url))
+                return response
+        self._incr('miss')
+        response = fetch(url=full_url, headers=headers, timeout=timeout)
+        if response.status_code == 200:
+            self._store(path, response, self.get_ttl(full_url))
+        return response
+
+
+http_cache = HttpCache(enabled=HTTP_CACHE_ENABLED)
+
+
+class PageArchive:
+    """
+    只追加的压缩页面归档，每个页面是一条WARC resource记录，单独压缩为一个gzip成员（与.warc.gz相同，可用warcio等工具读取）
+    每个进程写入自己的分段文件，记录所在的分段、偏移、压缩后长度登记在ftx_page_archive表中，可按位置直接读取单个页面
+    请求线程只写分段文件，索引行暂存在内存中，由保存详情的写入线程调用write_index写入数据库
+    """
+    # 内存中保留的最近归档哈希条数，远大于写入缓冲区的批量大小，覆盖还未提交到数据库的索引行
+    recent_hashes = 10000
+
+    def __init__(self, archive_dir=PAGE_ARCHIVE_DIR, segment_size=PAGE_ARCHIVE_SEGMENT_SIZE, enabled=True):
+        self.archive_dir = archive_dir
+        self.segment_size = segment_size
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._file = None
+        self._segment = None
+        self._sequence = 0
+        # 尚未交给写入线程的索引行
+        self._pending = []
+        # url -> 最近归档内容的哈希，只保留最近的recent_hashes条，更早的按索引查询ftx_page_archive
+        self._recent = OrderedDict()
+
+    @staticmethod
+    def build_record(url, body, fetched_at):
+        import uuid
+        headers = [
+            'WARC/1.0',
+            'WARC-Type: resource',
+            f'WARC-Record-ID: <urn:uuid:{uuid.uuid4()}>',
+            f'WARC-Date: {datetime.fromtimestamp(fetched_at, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")}',
+            f'WARC-Target-URI: {url}',
+            'Content-Type: text/html; charset=utf-8',
+            f'Content-Length: {len(body)}',
+        ]
+        return ('\r\n'.join(headers) + '\r\n\r\n').encode('utf-8') + body + b'\r\n\r\n'
+
+    @staticmethod
+    def read_record(path, offset, length, handle=None):
+        """
+        :param handle: 已打开的分段文件，顺序读取同一分段时复用
+        :return: (WARC头, 页面html)
+        """
+        f = handle or open(path, 'rb')
+        try:
+            f.seek(offset)
+            data = gzip.decompress(f.read(length))
+        finally:
+            if handle is None:
+                f.close()
+        header, _, body = data.partition(b'\r\n\r\n')
+        headers = dict(line.split(': ', 1) for line in header.decode('utf-8').split('\r\n')[1:])
+        return headers, body[:int(headers['Content-Length'])].decode('utf-8')
+
+    @staticmethod
+    def _stored_hash(url):
+        """
+        按索引查询ftx_page_archive中url最近一次归档内容的哈希
+        直接在连接上查询，不像db.query那样先提交缓冲区，请求线程不会因此执行数据库提交
+        """
+        row = db.conn.execute("SELECT content_hash FROM ftx_page_archive WHERE url = ? ORDER BY id DESC LIMIT 1",
+                              (url,)).fetchone()
+        return row[0] if row else None
+
+    def _segment_file(self, size):
+        if self._file is None or self._file.tell() + size > self.segment_size:
+            self._close_segment()
+            os.makedirs(self.archive_dir, exist_ok=True)
+            self._sequence += 1
+            self._segment = f"pages-{datetime.now().strftime('%Y%m%d%H%M%S')}-{os.getpid()}-{self._sequence:04d}.warc.gz"
+            self._file = open(os.path.join(self.archive_dir, self._segment), 'ab')
+        return self._file
+
+    def append(self, url, content, xiaoqu_id=None):
+        """
+        归档一个页面，与该URL上次归档的内容相同时跳过
+        :return: 是否写入
+        """
+        if not self.enabled:
+            return False
+        body = content.encode('utf-8')
+        content_hash = hashlib.sha1(body).hexdigest()
+        # 查询数据库时不持有锁，其他请求线程可以同时写入分段文件
+        with self._lock:
+            last_hash = self._recent.get(url)
+        if last_hash is None:
+            last_hash = self._stored_hash(url)
+        if last_hash == content_hash:
+            return False
+        fetched_at = time.time()
+        record = gzip.compress(self.build_record(url, body, fetched_at))
+        with self._lock:
+            if self._recent.get(url) == content_hash:
+                # 其他线程刚归档了相同的内容
+                return False
+            self._recent[url] = content_hash
+            self._recent.move_to_end(url)
+            while len(self._recent) > max(self.recent_hashes, db.batch_size * 2):
+                self._recent.popitem(last=False)
+            f = self._segment_file(len(record))
+            offset = f.tell()
+            f.write(record)
+            f.flush()
+            self._pending.append((url, xiaoqu_id, self._segment, offset, len(record), content_hash, fetched_at))
+        metrics.incr('archive_pages')
+        metrics.incr('archive_bytes', len(record))
+        return True
+
+    def write_index(self):
+        """
+        把暂存的索引行加入db的写入缓冲区，在写入线程中调用
+        """
+        with self._lock:
+            rows, self._pending = self._pending, []
+        for row in rows:
+            db.buffer_execute("INSERT INTO ftx_page_archive (url, xiaoqu_id, segment, offset, length, content_hash, "
+                              "fetched_at) VALUES (?, ?, ?, ?, ?, ?, ?)", row)
+
+    def _close_segment(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def close(self):
+        self.write_index()
+        with self._lock:
+            self._close_segment()
+
+
+page_archive = PageArchive(enabled=PAGE_ARCHIVE_ENABLED)
+
+
 class HttpUtils:
 
     @staticmethod
     def get(url, params=None, headers=None, timeout=None):
         try:
-            response = requests.get(url=url, params=params, headers=headers, timeout=timeout)
+            response = http_cache.get(url=url, params=params, headers=headers, timeout=timeout)
             response.raise_for_status()
             return response
         except requests.exceptions.RequestException as e:
+            metrics.incr('http_get_errors')
             Print.print2(f'Error in GET request: {e}')
         except Exception as e:
             Print.print2(f'Error in GET request: {e}')
 
     @staticmethod
-    def post(url, *args, **kwargs):
+    def post(url, data=None, json=None, params=None, headers=None, timeout=None, **kwargs):
         try:
-            response = requests.post(url, *args, **kwargs)
+            response = fetch_controller.fetch(url=url, params=params, headers=headers, timeout=timeout,
+                                              method=functools.partial(http_session.post, data=data, json=json,
+                                                                       **kwargs))
             response.raise_for_status()
             return response
         except requests.exceptions.RequestException as e:
@@ -204,39 +1553,656 @@ class HttpUtils:
         :return:
         """
         cookie = Cookies(cookies_path)
+        if not cookie.cookies:
+            return ''
         cookies = cookie.cookies['cookies']
         return cookie.convert_to_http_header(cookies=cookies)
 
     @staticmethod
     def get_by_cookies(url, params, cookies_path):
         """
-        发送get请求（必须携带cookies_path）
+        发送get请求（必须携带cookies_path），cookies由http_session按域名匹配附加
         :param url:
         :param params:
         :param cookies_path:
         :return:
         """
-        headers = {
-            'Cookie': HttpUtils.get_header_cookies(cookies_path)
-        }
-        response = HttpUtils.get(url, headers=headers, params=params)
+        http_session.use_cookies(cookies_path)
+        response = HttpUtils.get(url, params=params)
+        return response
+
+    @staticmethod
+    def post_by_cookies(url, cookies_path, params=None, payload=None):
+        """
+        发送post请求（必须携带cookies_path）
+        :param url:
+        :param cookies_path:
+        :param params:
+        :param payload:
+        :return:
+        """
+        http_session.use_cookies(cookies_path)
+        response = HttpUtils.post(url=url, params=params, json=payload)
         return response
 
-    @staticmethod
-    def post_by_cookies(url, cookies_path, params=None, payload=None):
+
+class HostLimiter:
+    """
+    按host限制同时在途请求数，避免并发采集时对单个站点压力过大
+    per_host为None时不限制
+    """
+
+    def __init__(self, per_host=DETAIL_PER_HOST_LIMIT):
+        self.per_host = None if per_host is None else max(1, int(per_host))
+        self._lock = threading.Lock()
+        self._semaphores = {}
+
+    def _get_semaphore(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.per_host)
+                self._semaphores[host] = semaphore
+        return semaphore
+
+    def call(self, url, func, *args, **kwargs):
+        if self.per_host is None:
+            return func(*args, **kwargs)
+        semaphore = self._get_semaphore(url)
+        with semaphore:
+            return func(*args, **kwargs)
+
+
+class PipelineStage:
+    """
+    流水线中的一个阶段，统计处理条数、工作耗时和向下游队列放入时的等待耗时（下游处理不过来时的背压）
+    利用率 = 工作耗时 / (运行时长 × 并行数)
+    """
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.busy = 0.0
+        self.blocked = 0.0
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def working(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            metrics.observe(f"pipeline_{self.name}", elapsed)
+            with self._lock:
+                self.busy += elapsed
+                self.items += 1
+
+    def put(self, target_queue, item):
+        start = time.perf_counter()
+        target_queue.put(item)
+        with self._lock:
+            self.blocked += time.perf_counter() - start
+
+    def report(self, elapsed):
+        return {
+            'stage': self.name,
+            'workers': self.workers,
+            'items': self.items,
+            'busy_seconds': round(self.busy, 3),
+            'blocked_seconds': round(self.blocked, 3),
+            'utilisation': round(self.busy / (elapsed * self.workers), 3) if elapsed else None,
+        }
+
+
+class XPathExtractor:
+    """
+    预编译xpath的通用解析器
+    row_path选出行节点，fields为 字段名->相对xpath（可传入多个候选xpath，取第一个有结果的）
+    """
+
+    def __init__(self, row_path, fields, normalize=False):
+        self.row_xpath = etree.XPath(row_path, smart_strings=False)
+        self.field_xpaths = {}
+        for name, paths in fields.items():
+            if isinstance(paths, str):
+                paths = (paths,)
+            self.field_xpaths[name] = [etree.XPath(path, smart_strings=False) for path in paths]
+        self.normalize = normalize
+
+    def rows(self, node):
+        return self.row_xpath(node)
+
+    def extract(self, row):
+        result = {}
+        for name, xpaths in self.field_xpaths.items():
+            value = None
+            for xpath in xpaths:
+                found = xpath(row)
+                if found:
+                    value = str(found[0])
+                    break
+            if self.normalize and value is not None:
+                value = "".join(value.split())
+            result[name] = value
+        return result
+
+    def extract_all(self, node):
+        return [self.extract(row) for row in self.rows(node)]
+
+
+province_extractor = XPathExtractor('//*[@id="c02"]/ul/li', {"province_name": './strong/text()'})
+city_extractor = XPathExtractor('./a', {"city_name": './text()', "city_url": './@href'})
+xiaoqu_list_extractor = XPathExtractor('//*[@class="houseList"]/div', {
+    "xiaoqu_name": './dl/dd/p[1]/a[1]/text()',
+    "xiaoqu_url": './dl/dd/p[1]/a[1]/@href'
+})
+pager_extractor = XPathExtractor('//*[contains(@class, "fanye")]//a', {"text": './text()', "url": './@href'},
+                                 normalize=True)
+pager_total_xpath = etree.XPath('string(//*[contains(@class, "fanye")])', smart_strings=False)
+region_extractor = XPathExtractor('//*[@class="qxName"]/a', {"name": './text()', "url": './@href'})
+sub_region_extractor = XPathExtractor('//*[@id="shangQuancontain"]/a', {"name": './text()', "url": './@href'})
+# 小区详情页标签，值的取值优先级与原逐条判断一致：p/span > p > div/p/b
+xiaoqu_detail_extractor = XPathExtractor('//*[@id="baseinfo"]/div/ul/li', {
+    "label": './span/text()',
+    "value": ('./p/span/text()', './p/text()', './div/p/b/text()')
+}, normalize=True)
+
+
+class BloomFilter:
+    """
+    固定大小的布隆过滤器，判定为已存在时有error_rate的误判概率
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        """
+        :return: 添加前是否（可能）已存在
+        """
+        present = True
+        for position in self._positions(key):
+            index, mask = position >> 3, 1 << (position & 7)
+            if not self.bits[index] & mask:
+                present = False
+                self.bits[index] |= mask
+        return present
+
+
+class XiaoquDedup:
+    """
+    按规范化的xiaoqu_id去重，保证同一次运行内每个小区只写入/采集一次
+    默认使用内存集合；设置bloom_capacity时改用布隆过滤器，判定重复时可由confirm回调精确确认
+    """
+
+    def __init__(self, bloom_capacity=None, error_rate=None, confirm=None):
+        bloom_capacity = DEDUP_BLOOM_CAPACITY if bloom_capacity is None else bloom_capacity
+        self.bloom = BloomFilter(bloom_capacity, error_rate or DEDUP_BLOOM_ERROR_RATE) if bloom_capacity else None
+        self.seen = set()
+        self.confirm = confirm
+        self.counters = {'new': 0, 'duplicate': 0, 'false_positive': 0}
+        self._lock = threading.Lock()
+
+    def _incr(self, name):
+        self.counters[name] += 1
+        metrics.incr(f'dedup_{name}')
+
+    def add(self, xiaoqu_id):
+        """
+        :return: True表示本次运行内首次出现
+        """
+        with self._lock:
+            if self.bloom is None:
+                duplicate = xiaoqu_id in self.seen
+                self.seen.add(xiaoqu_id)
+            else:
+                duplicate = self.bloom.add(xiaoqu_id)
+            if duplicate and self.bloom is not None and self.confirm is not None and not self.confirm(xiaoqu_id):
+                duplicate = False
+                self._incr('false_positive')
+            self._incr('duplicate' if duplicate else 'new')
+        return not duplicate
+
+
+class CrawlFrontier:
+    """
+    db_init的持久化任务队列，记录城市、子区域、分页任务的状态，中断后重新运行可从未完成的分页继续
+    xiaoqu去重同一小区在多个子区域/分页中出现时只写入一次
+    """
+    table = 'ftx_crawl_frontier'
+
+    def __init__(self, database):
+        self.db = database
+        self.xiaoqu = XiaoquDedup(confirm=self.xiaoqu_exists)
+
+    def xiaoqu_exists(self, xiaoqu_id):
+        # 不提交写缓冲，以免拆开同一分页的事务；缓冲中尚未提交的小区视为不存在，最多重复写入一次
+        return self.db.conn.execute("SELECT 1 FROM ftx_base_xiaoqu WHERE xiaoqu_id = ? LIMIT 1",
+                                    (xiaoqu_id,)).fetchone() is not None
+
+    @staticmethod
+    def city_key(city_id):
+        return f"city:{city_id}"
+
+    @staticmethod
+    def sub_region_key(city_id, region_id, sub_region_id):
+        return f"sub_region:{city_id}:{region_id}:{sub_region_id}"
+
+    @staticmethod
+    def page_key(city_id, region_id, sub_region_id, page_no):
+        return f"page:{city_id}:{region_id}:{sub_region_id}:{page_no}"
+
+    def get(self, task_key):
+        rows = self.db.query(f"SELECT * FROM {self.table} WHERE task_key = ?", (task_key,))
+        return rows[0] if rows else None
+
+    def add(self, task_key, task_type, **fields):
+        data = {'task_key': task_key, 'task_type': task_type, **fields}
+        columns = ', '.join(data.keys())
+        placeholders = ', '.join('?' * len(data))
+        self.db.buffer_execute(f"INSERT OR IGNORE INTO {self.table} ({columns}) VALUES ({placeholders})",
+                               tuple(data.values()))
+
+    def mark(self, task_key, state, **fields):
+        data = {'state': state, **fields}
+        set_fields = ', '.join(f'{k}=?' for k in data.keys())
+        self.db.buffer_execute(f"UPDATE {self.table} SET {set_fields}, "
+                               f"update_time=datetime(CURRENT_TIMESTAMP, 'localtime') WHERE task_key = ?",
+                               tuple(data.values()) + (task_key,))
+
+    def is_done(self, task_key):
+        task = self.get(task_key)
+        return task is not None and task['state'] == 'done'
+
+    def reset_if_finished(self, province_name, city_ids):
+        """
+        范围内没有未完成的任务时清空任务记录，开始新一轮初始化；否则保留记录续跑
+        :return: True表示续跑上一次未完成的初始化
+        """
+        if not city_ids:
+            return False
+        placeholders = ', '.join('?' * len(city_ids))
+        params = (province_name, *city_ids)
+        unfinished = self.db.query(
+            f"SELECT count(*) AS cnt FROM {self.table} "
+            f"WHERE province_name = ? AND city_id IN ({placeholders}) AND state != 'done'", params)[0]['cnt']
+        if unfinished:
+            return True
+        self.db.execute(f"DELETE FROM {self.table} WHERE province_name = ? AND city_id IN ({placeholders})", params)
+        return False
+
+
+class ExcelExportWriter:
+    """
+    openpyxl只写模式流式写入xlsx，超过单表行数上限时自动新建sheet
+    """
+    extension = 'xlsx'
+    max_rows = 1048576
+
+    def __init__(self, file_path, columns):
+        from openpyxl import Workbook
+        self.file_path = file_path
+        self.columns = columns
+        self.workbook = Workbook(write_only=True)
+        self.sheet = None
+        self.sheet_rows = 0
+        self._new_sheet()
+
+    def _new_sheet(self):
+        index = len(self.workbook.worksheets)
+        self.sheet = self.workbook.create_sheet(title='Sheet1' if index == 0 else f'Sheet{index + 1}')
+        self.sheet.append(self.columns)
+        self.sheet_rows = 1
+
+    def write_rows(self, rows):
+        for row in rows:
+            if self.sheet_rows >= self.max_rows:
+                self._new_sheet()
+            self.sheet.append(row)
+            self.sheet_rows += 1
+
+    def close(self):
+        self.workbook.save(self.file_path)
+
+
+class CsvExportWriter:
+    extension = 'csv'
+
+    def __init__(self, file_path, columns):
+        import csv
+        # utf-8-sig方便Excel直接打开中文
+        self.file = open(file_path, 'w', newline='', encoding='utf-8-sig')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write_rows(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetExportWriter:
+    """
+    需要安装pyarrow，按块写入row group
+    """
+    extension = 'parquet'
+
+    def __init__(self, file_path, columns):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise Exception("导出parquet需要先安装pyarrow: pip install pyarrow")
+        self.pa = pa
+        self.columns = columns
+        self.schema = pa.schema([(column, pa.string()) for column in columns])
+        self.writer = pq.ParquetWriter(file_path, self.schema)
+
+    def write_rows(self, rows):
+        data = [[None if row[i] is None else str(row[i]) for row in rows] for i in range(len(self.columns))]
+        self.writer.write_table(self.pa.Table.from_arrays(
+            [self.pa.array(values, type=self.pa.string()) for values in data], schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+EXPORT_WRITERS = {
+    'xlsx': ExcelExportWriter,
+    'csv': CsvExportWriter,
+    'parquet': ParquetExportWriter,
+}
+
+
+@contextlib.contextmanager
+def open_browser_page(storage_state=None, launch_options=None, lean=None):
+    """
+    在当前线程中启动独立的playwright浏览器并打开一个页面
+    :param storage_state: playwright保存的cookies文件
+    :param launch_options: 浏览器启动参数，默认BROWSER_LAUNCH_OPTIONS，精简模式默认BROWSER_LEAN_LAUNCH_OPTIONS
+    :param lean: 是否使用精简模式（拦截页面文档以外的请求），默认BROWSER_LEAN_MODE
+    """
+    from playwright.sync_api import sync_playwright
+    lean = BROWSER_LEAN_MODE if lean is None else lean
+    with sync_playwright() as playwright:
+        browser = playwright.chromium.launch(**(launch_options or
+                                                (BROWSER_LEAN_LAUNCH_OPTIONS if lean else BROWSER_LAUNCH_OPTIONS)))
+        context = browser.new_context(
+            no_viewport=not lean,
+            storage_state=storage_state if storage_state and FileUtil.file_exists(storage_state) else None
+        )
+        if lean:
+            context.route('**/*', route_lean_request)
+        context.on('response', count_browser_response)
+        page = context.new_page()
+        page.set_default_timeout(200000)
+        try:
+            yield page
+        finally:
+            context.close()
+            browser.close()
+
+
+def is_allowed_browser_host(url):
+    host = urlparse(url).hostname or ''
+    return any(host == domain or host.endswith('.' + domain) for domain in BROWSER_ALLOWED_DOMAINS)
+
+
+def route_lean_request(route):
+    """
+    精简模式的请求拦截：只放行允许域名下的页面文档，其余请求（图片、样式、脚本、第三方统计等）直接中止
+    """
+    request = route.request
+    if request.resource_type == 'document' and is_allowed_browser_host(request.url):
+        route.continue_()
+    else:
+        metrics.incr('browser_blocked_requests')
+        route.abort()
+
+
+def count_browser_response(response):
+    # 按响应头Content-Length统计浏览器下载的字节数（分块传输的响应不计入）
+    metrics.incr('browser_responses')
+    metrics.incr('browser_response_bytes', int(response.headers.get('content-length') or 0))
+
+
+def browser_wait_state():
+    return 'domcontentloaded' if BROWSER_LEAN_MODE else 'load'
+
+
+class BrowserPool:
+    """
+    浏览器页面池，每个工作线程持有一个独立的浏览器页面（playwright同步API不能跨线程使用）
+    提交的任务以 func(page, *args) 的形式在空闲页面上执行
+    """
+
+    def __init__(self, size=BROWSER_POOL_SIZE, storage_state=cookies_path, page_factory=None):
+        self.size = max(1, int(size))
+        self.storage_state = storage_state
+        self.page_factory = page_factory or open_browser_page
+        self.tasks = queue.Queue()
+        self.threads = []
+        self.stats = [{'pages': 0, 'tasks': 0, 'busy': 0.0} for _ in range(self.size)]
+        # 存活的工作线程数及最近一次浏览器失败的异常，由_lock保护
+        self._lock = threading.Lock()
+        self._alive = 0
+        self._error = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def start(self):
+        with self._lock:
+            self._alive += self.size
+        for index in range(self.size):
+            thread = threading.Thread(target=self._run_worker, args=(index,), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def close(self):
+        for _ in self.threads:
+            self.tasks.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+    def _run_worker(self, index):
+        stats = self.stats[index]
+
+        def on_load(*_):
+            stats['pages'] += 1
+
+        error = None
+        try:
+            with self.page_factory(storage_state=self.storage_state) as page:
+                page.on('load', on_load)
+                while True:
+                    task = self.tasks.get()
+                    if task is None:
+                        break
+                    future, func, args = task
+                    if not future.set_running_or_notify_cancel():
+                        continue
+                    start = time.monotonic()
+                    try:
+                        future.set_result(func(page, *args))
+                    except BaseException as e:
+                        future.set_exception(e)
+                    finally:
+                        stats['tasks'] += 1
+                        stats['busy'] += time.monotonic() - start
+        except BaseException as e:
+            Print.red(f"浏览器{index}启动或运行失败: {e}")
+            error = e
+        finally:
+            self._worker_exit(error)
+
+    def _worker_exit(self, error):
+        """
+        浏览器不可用时，排队中的任务由其它浏览器继续处理；最后一个工作线程退出时排队中的任务以异常结束
+        """
+        with self._lock:
+            self._alive -= 1
+            if error is not None:
+                self._error = error
+            if self._alive > 0:
+                return
+            while True:
+                try:
+                    task = self.tasks.get_nowait()
+                except queue.Empty:
+                    break
+                if task is not None:
+                    task[0].set_exception(self._closed_error())
+
+    def _closed_error(self):
+        return self._error or RuntimeError("浏览器页面池已关闭")
+
+    def submit(self, func, *args):
+        future = Future()
+        with self._lock:
+            # 所有浏览器都已退出时立即失败，不再排队等待
+            if self.threads and self._alive == 0:
+                future.set_exception(self._closed_error())
+            else:
+                self.tasks.put((future, func, args))
+        return future
+
+    def map(self, func, items):
+        return list(self.imap(func, items))
+
+    def imap(self, func, items):
+        """
+        提交所有任务，按提交顺序逐个返回已完成的结果，不等待全部任务结束
+        """
+        futures = [self.submit(func, item) for item in items]
+        for future in futures:
+            yield future.result()
+
+    def report(self):
+        for index, stats in enumerate(self.stats):
+            minutes = stats['busy'] / 60
+            rate = stats['pages'] / minutes if minutes else 0
+            Print.print2(f"浏览器{index}: 任务{stats['tasks']}个 页面{stats['pages']}个 {rate:.1f} pages/min")
+
+
+class DetailJobQueue:
+    """
+    基于sqlite的小区详情采集任务队列，多个进程（或共享数据库文件的多台机器）通过租约领取任务
+    任务状态：pending待领取 -> running已领取 -> done完成 / dead多次失败
+    租约过期（领取任务的进程异常退出）的running任务会被重新领取
+    """
+    table = 'ftx_detail_job'
+
+    def __init__(self, database, lease_seconds=JOB_LEASE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS,
+                 retry_delay=JOB_RETRY_DELAY):
+        self.db = database
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+
+    def enqueue(self, xiaoqu_list):
+        """
+        登记待采集小区，已完成的任务重新置为待领取，处理中及dead状态的任务保持不变
+        :return: 登记的任务数
+        """
+        for xiaoqu in xiaoqu_list:
+            self.db.buffer_execute(
+                f"INSERT INTO {self.table} (xiaoqu_id, detail_url) VALUES (?, ?) "
+                f"ON CONFLICT (xiaoqu_id) DO UPDATE SET status='pending', attempts=0, available_at=0, "
+                f"detail_url=excluded.detail_url, update_time=datetime(CURRENT_TIMESTAMP, 'localtime') "
+                f"WHERE status='done'",
+                (xiaoqu['xiaoqu_id'], get_xiaoqu_detail_url(xiaoqu)))
+        self.db.flush()
+        return len(xiaoqu_list)
+
+    def _transaction(self):
+        """
+        BEGIN IMMEDIATE 提前获取写锁，保证多个进程领取任务时不会重复
+        """
+        self.db.flush()
+        self.db.conn.execute("BEGIN IMMEDIATE")
+
+    def claim(self, owner, limit=10):
+        """
+        原子领取任务
+        :param owner: 领取者标识
+        :return: 任务列表
+        """
+        now = time.time()
+        self._transaction()
+        try:
+            # 租约过期且已达到最大尝试次数的任务直接进入dead状态
+            self.db.conn.execute(
+                f"UPDATE {self.table} SET status='dead', last_error='lease expired', lease_owner=NULL "
+                f"WHERE status='running' AND lease_expires < ? AND attempts >= ?", (now, self.max_attempts))
+            cursor = self.db.conn.execute(
+                f"SELECT id, xiaoqu_id, detail_url, attempts FROM {self.table} "
+                f"WHERE (status='pending' AND available_at <= ?) OR (status='running' AND lease_expires < ?) "
+                f"ORDER BY id LIMIT ?", (now, now, limit))
+            columns = [column[0] for column in cursor.description]
+            jobs = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            self.db.conn.executemany(
+                f"UPDATE {self.table} SET status='running', attempts=attempts+1, lease_owner=?, lease_expires=?, "
+                f"update_time=datetime(CURRENT_TIMESTAMP, 'localtime') WHERE id=?",
+                [(owner, now + self.lease_seconds, job['id']) for job in jobs])
+            self.db.conn.commit()
+        except BaseException:
+            self.db.conn.rollback()
+            raise
+        for job in jobs:
+            job['attempts'] += 1
+        return jobs
+
+    def complete(self, job, owner):
+        self.db.buffer_execute(
+            f"UPDATE {self.table} SET status='done', lease_owner=NULL, lease_expires=NULL, last_error=NULL, "
+            f"update_time=datetime(CURRENT_TIMESTAMP, 'localtime') WHERE id=? AND lease_owner=?", (job['id'], owner))
+
+    def fail(self, job, owner, error):
+        """
+        任务失败：未达到最大尝试次数时按指数退避重新排队，否则进入dead状态
+        """
+        if job['attempts'] >= self.max_attempts:
+            status, available_at = 'dead', 0
+        else:
+            status, available_at = 'pending', time.time() + self.retry_delay * 2 ** (job['attempts'] - 1)
+        self.db.buffer_execute(
+            f"UPDATE {self.table} SET status=?, available_at=?, last_error=?, lease_owner=NULL, lease_expires=NULL, "
+            f"update_time=datetime(CURRENT_TIMESTAMP, 'localtime') WHERE id=? AND lease_owner=?",
+            (status, available_at, str(error)[:1000], job['id'], owner))
+
+    def requeue_dead(self):
+        self.db.execute(f"UPDATE {self.table} SET status='pending', attempts=0, available_at=0 WHERE status='dead'")
+
+    def counts(self):
+        rows = self.db.query(f"SELECT status, count(*) AS cnt FROM {self.table} GROUP BY status")
+        return {row['status']: row['cnt'] for row in rows}
+
+    def next_available(self):
         """
-        发送post请求（必须携带cookies_path）
-        :param url:
-        :param cookies_path:
-        :param params:
-        :param payload:
-        :return:
+        :return: 最近一个可领取任务的时间（待重试任务或租约到期任务），没有时返回None
         """
-        headers = {
-            'Cookie': HttpUtils.get_header_cookies(cookies_path)
-        }
-        response = HttpUtils.post(url=url, headers=headers, params=params, json=payload)
-        return response
+        row = self.db.query(
+            f"SELECT min(CASE WHEN status='pending' THEN available_at ELSE lease_expires END) AS next_time "
+            f"FROM {self.table} WHERE status='pending' OR status='running'")
+        return row[0]['next_time'] if row else None
 
 
 class FileUtil:
@@ -254,7 +2220,7 @@ def extract_city_id(url):
         return None
 
 
-def create_table():
+def create_table(migrate=True):
     init_sql = """
     CREATE TABLE IF NOT EXISTS `ftx_base_province`
     (
@@ -294,6 +2260,39 @@ def create_table():
         `update_time`   DATETIME DEFAULT (datetime(CURRENT_TIMESTAMP, 'localtime'))
     );
 
+    CREATE TABLE IF NOT EXISTS `ftx_crawl_frontier`
+    (
+        `id`            INTEGER PRIMARY KEY AUTOINCREMENT,
+        `task_key`      varchar(255) UNIQUE,
+        `task_type`     varchar(32),  -- city/sub_region/page
+        `province_name` varchar(255),
+        `city_id`       varchar(255),
+        `region_id`     varchar(255),
+        `sub_region_id` varchar(255),
+        `url`           varchar(1024),
+        `page_no`       INTEGER DEFAULT 0,
+        `state`         varchar(32) DEFAULT 'pending', -- pending/running/done
+        `create_time`   DATETIME DEFAULT (datetime(CURRENT_TIMESTAMP, 'localtime')),
+        `update_time`   DATETIME DEFAULT (datetime(CURRENT_TIMESTAMP, 'localtime'))
+    );
+
+    CREATE TABLE IF NOT EXISTS `ftx_detail_job`
+    (
+        `id`            INTEGER PRIMARY KEY AUTOINCREMENT,
+        `xiaoqu_id`     varchar(255) UNIQUE,
+        `detail_url`    varchar(1024),
+        `status`        varchar(32) DEFAULT 'pending', -- pending/running/done/dead
+        `attempts`      INTEGER DEFAULT 0,
+        `lease_owner`   varchar(255),
+        `lease_expires` REAL,
+        `available_at`  REAL DEFAULT 0,
+        `last_error`    TEXT,
+        `create_time`   DATETIME DEFAULT (datetime(CURRENT_TIMESTAMP, 'localtime')),
+        `update_time`   DATETIME DEFAULT (datetime(CURRENT_TIMESTAMP, 'localtime'))
+    );
+
+    CREATE INDEX IF NOT EXISTS idx_ftx_detail_job_status ON ftx_detail_job (status, available_at);
+
     CREATE TABLE IF NOT EXISTS `ftx_xiaoqu_detail`
     (
         `id`          INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -307,9 +2306,192 @@ def create_table():
     """
     for sql in init_sql.split(";"):
         db.execute(sql=sql)
+    if migrate:
+        migrate_schema()
+
+
+# 各表的自然唯一键，写入时按此键upsert
+UNIQUE_KEYS = {
+    'ftx_base_province': ('province_name', 'city_id'),
+    'ftx_base_areas': ('city_id', 'region_id', 'sub_region_id'),
+    'ftx_base_xiaoqu': ('city_id', 'xiaoqu_id'),
+    'ftx_xiaoqu_detail': ('xiaoqu_id',),
+}
 
+# 导出表ftx_export_xiaoqu：小区与区域、城市、详情关联后的扁平表，导出时按(省份, 城市, 区域名称)索引范围读取
+EXPORT_TABLE_COLUMNS = ('province_name', 'city_name', 'city_id', 'region_id', 'region_name', 'sub_region_id',
+                        'sub_region_name', 'xiaoqu_id', 'xiaoqu_name', 'xiaoqu_url', 'xqdz', 'fwzs', 'ldzs')
 
-def print_disclaimer():
+# 导出表的数据来源，触发器按条件重新计算受影响的行，重建及校验时使用全部数据
+EXPORT_SOURCE_SQL = """
+SELECT lbp.province_name, lbp.city_name, t.city_id, t.region_id, lba.region_name, t.sub_region_id,
+       lba.sub_region_name, t.xiaoqu_id, t.xiaoqu_name, t.xiaoqu_url, lxd.xqdz, lxd.fwzs, lxd.ldzs
+FROM ftx_base_xiaoqu t
+LEFT JOIN ftx_base_areas lba
+  ON t.city_id = lba.city_id AND t.region_id = lba.region_id AND t.sub_region_id = lba.sub_region_id
+LEFT JOIN ftx_base_province lbp ON lba.city_id = lbp.city_id
+LEFT JOIN ftx_xiaoqu_detail lxd ON t.xiaoqu_id = lxd.xiaoqu_id
+"""
+
+# 按EXPORT_SOURCE_SQL写入导出表，{condition}为ftx_base_xiaoqu（别名t）上的条件；数据源中同一小区重复时保留第一行
+EXPORT_INSERT_SQL = f"INSERT INTO ftx_export_xiaoqu ({', '.join(EXPORT_TABLE_COLUMNS)}) {EXPORT_SOURCE_SQL}" \
+                    "WHERE {condition} ON CONFLICT (city_id, xiaoqu_id) DO NOTHING"
+
+
+def export_refresh(row, *columns):
+    """
+    重新计算导出表中与row的columns字段相同的行：先删除再插入
+    不使用INSERT OR REPLACE：触发语句是INSERT ... ON CONFLICT DO UPDATE时，触发器内的OR REPLACE不生效，会违反唯一约束
+    :param row: NEW或OLD
+    :param columns: 导出表与ftx_base_xiaoqu共有的字段，如city_id
+    :return: 触发器中的语句列表
+    """
+    return [f"DELETE FROM ftx_export_xiaoqu WHERE {' AND '.join(f'{c} = {row}.{c}' for c in columns)}",
+            EXPORT_INSERT_SQL.format(condition=' AND '.join(f't.{c} = {row}.{c}' for c in columns))]
+
+
+def export_table_triggers():
+    """
+    基础数据或详情变化时同步更新导出表的触发器
+    小区、区域、城市变化时按条件重新计算受影响的行；详情变化（采集的热点路径）只更新详情字段
+    """
+    xiaoqu_key = ('city_id', 'xiaoqu_id')
+    area_key = ('city_id', 'region_id', 'sub_region_id')
+    triggers = {
+        'xiaoqu_insert': ("AFTER INSERT ON ftx_base_xiaoqu", export_refresh('NEW', *xiaoqu_key)),
+        'xiaoqu_update': ("AFTER UPDATE OF city_id, region_id, sub_region_id, xiaoqu_id, xiaoqu_name, xiaoqu_url "
+                          "ON ftx_base_xiaoqu",
+                          ["DELETE FROM ftx_export_xiaoqu WHERE city_id = OLD.city_id AND xiaoqu_id = OLD.xiaoqu_id",
+                           *export_refresh('NEW', *xiaoqu_key)]),
+        'xiaoqu_delete': ("AFTER DELETE ON ftx_base_xiaoqu",
+                          ["DELETE FROM ftx_export_xiaoqu WHERE city_id = OLD.city_id AND xiaoqu_id = OLD.xiaoqu_id"]),
+        'area_insert': ("AFTER INSERT ON ftx_base_areas", export_refresh('NEW', *area_key)),
+        'area_update': ("AFTER UPDATE OF city_id, region_id, region_name, sub_region_id, sub_region_name "
+                        "ON ftx_base_areas",
+                        [*export_refresh('OLD', *area_key), *export_refresh('NEW', *area_key)]),
+        'area_delete': ("AFTER DELETE ON ftx_base_areas", export_refresh('OLD', *area_key)),
+        'province_insert': ("AFTER INSERT ON ftx_base_province", export_refresh('NEW', 'city_id')),
+        'province_update': ("AFTER UPDATE OF province_name, city_id, city_name ON ftx_base_province "
+                            "WHEN OLD.province_name IS NOT NEW.province_name OR OLD.city_id IS NOT NEW.city_id "
+                            "OR OLD.city_name IS NOT NEW.city_name",
+                            [*export_refresh('OLD', 'city_id'), *export_refresh('NEW', 'city_id')]),
+        'province_delete': ("AFTER DELETE ON ftx_base_province", export_refresh('OLD', 'city_id')),
+        'detail_insert': ("AFTER INSERT ON ftx_xiaoqu_detail",
+                          ["UPDATE ftx_export_xiaoqu SET xqdz = NEW.xqdz, fwzs = NEW.fwzs, ldzs = NEW.ldzs "
+                           "WHERE xiaoqu_id = NEW.xiaoqu_id"]),
+        'detail_update': ("AFTER UPDATE OF xiaoqu_id, xqdz, fwzs, ldzs ON ftx_xiaoqu_detail "
+                          "WHEN OLD.xiaoqu_id IS NOT NEW.xiaoqu_id OR OLD.xqdz IS NOT NEW.xqdz "
+                          "OR OLD.fwzs IS NOT NEW.fwzs OR OLD.ldzs IS NOT NEW.ldzs",
+                          ["UPDATE ftx_export_xiaoqu SET xqdz = NULL, fwzs = NULL, ldzs = NULL "
+                           "WHERE xiaoqu_id = OLD.xiaoqu_id",
+                           "UPDATE ftx_export_xiaoqu SET xqdz = NEW.xqdz, fwzs = NEW.fwzs, ldzs = NEW.ldzs "
+                           "WHERE xiaoqu_id = NEW.xiaoqu_id"]),
+        'detail_delete': ("AFTER DELETE ON ftx_xiaoqu_detail",
+                          ["UPDATE ftx_export_xiaoqu SET xqdz = NULL, fwzs = NULL, ldzs = NULL "
+                           "WHERE xiaoqu_id = OLD.xiaoqu_id"]),
+    }
+    return [f"CREATE TRIGGER IF NOT EXISTS trg_export_{name} {event} BEGIN {'; '.join(statements)}; END"
+            for name, (event, statements) in triggers.items()]
+
+
+# 按版本顺序执行的表结构迁移，版本号记录在PRAGMA user_version中
+SCHEMA_MIGRATIONS = [
+    # 1: 去重后添加自然唯一键及关联查询使用的覆盖索引
+    [
+        *[f"DELETE FROM {table} WHERE id NOT IN (SELECT max(id) FROM {table} GROUP BY {', '.join(keys)})"
+          for table, keys in UNIQUE_KEYS.items()],
+        *[f"CREATE UNIQUE INDEX IF NOT EXISTS uk_{table} ON {table} ({', '.join(keys)})"
+          for table, keys in UNIQUE_KEYS.items()],
+        "CREATE INDEX IF NOT EXISTS idx_ftx_base_province_name ON ftx_base_province "
+        "(province_name, city_name, city_id)",
+        "CREATE INDEX IF NOT EXISTS idx_ftx_base_areas_region_name ON ftx_base_areas (region_name, city_id)",
+        "CREATE INDEX IF NOT EXISTS idx_ftx_base_xiaoqu_area ON ftx_base_xiaoqu "
+        "(city_id, region_id, sub_region_id, xiaoqu_id)",
+    ],
+    # 2: 详情内容哈希、采集时间、变化统计及历史版本表
+    [
+        "ALTER TABLE ftx_xiaoqu_detail ADD COLUMN content_hash varchar(64)",
+        "ALTER TABLE ftx_xiaoqu_detail ADD COLUMN fetched_at REAL",
+        "ALTER TABLE ftx_xiaoqu_detail ADD COLUMN changed_at REAL",
+        "ALTER TABLE ftx_xiaoqu_detail ADD COLUMN change_count INTEGER DEFAULT 0",
+        """CREATE TABLE IF NOT EXISTS `ftx_xiaoqu_detail_history`
+        (
+            `id`           INTEGER PRIMARY KEY AUTOINCREMENT,
+            `xiaoqu_id`    varchar(255),
+            `fwzs`         varchar(255),
+            `ldzs`         varchar(255),
+            `xqdz`         varchar(255),
+            `content_hash` varchar(64),
+            `fetched_at`   REAL,
+            `create_time`  DATETIME DEFAULT (datetime(CURRENT_TIMESTAMP, 'localtime'))
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_ftx_xiaoqu_detail_history ON ftx_xiaoqu_detail_history (xiaoqu_id, fetched_at)",
+    ],
+    # 3: 按xiaoqu_id确认去重
+    [
+        "CREATE INDEX IF NOT EXISTS idx_ftx_base_xiaoqu_id ON ftx_base_xiaoqu (xiaoqu_id)",
+    ],
+    # 4: 页面归档索引
+    [
+        """CREATE TABLE IF NOT EXISTS `ftx_page_archive`
+        (
+            `id`           INTEGER PRIMARY KEY AUTOINCREMENT,
+            `url`          varchar(255),
+            `xiaoqu_id`    varchar(255),
+            `segment`      varchar(255),
+            `offset`       INTEGER,
+            `length`       INTEGER,
+            `content_hash` varchar(64),
+            `fetched_at`   REAL
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_ftx_page_archive_xiaoqu ON ftx_page_archive (xiaoqu_id, id)",
+        # 按URL查找页面最近一次归档的内容哈希
+        "CREATE INDEX IF NOT EXISTS idx_ftx_page_archive_url ON ftx_page_archive (url, id)",
+    ],
+    # 5: 由触发器维护的扁平导出表
+    [
+        f"""CREATE TABLE IF NOT EXISTS `ftx_export_xiaoqu`
+        (
+            `id` INTEGER PRIMARY KEY AUTOINCREMENT,
+            {', '.join(f'`{column}` varchar(255)' for column in EXPORT_TABLE_COLUMNS)}
+        )""",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uk_ftx_export_xiaoqu ON ftx_export_xiaoqu (city_id, xiaoqu_id)",
+        "CREATE INDEX IF NOT EXISTS idx_ftx_export_xiaoqu_area ON ftx_export_xiaoqu "
+        "(province_name, city_name, region_name)",
+        "CREATE INDEX IF NOT EXISTS idx_ftx_export_xiaoqu_id ON ftx_export_xiaoqu (xiaoqu_id)",
+        # 触发器按city_id查找城市
+        "CREATE INDEX IF NOT EXISTS idx_ftx_base_province_city ON ftx_base_province (city_id)",
+        *export_table_triggers(),
+        EXPORT_INSERT_SQL.format(condition='true'),
+    ],
+]
+
+
+def migrate_schema():
+    """
+    执行未执行过的表结构迁移
+    :return:
+    """
+    version = db.query("PRAGMA user_version")[0]['user_version']
+    for index, statements in enumerate(SCHEMA_MIGRATIONS[version:], start=version + 1):
+        Print.print2(f"执行数据库迁移 v{index}...")
+        db.flush()
+        # 显式开启事务：sqlite3默认只在DML前隐式开启事务，ALTER TABLE等DDL会各自提交，失败时无法回滚
+        db.conn.execute("BEGIN")
+        try:
+            for sql in statements:
+                db.conn.execute(sql)
+            db.conn.execute(f"PRAGMA user_version = {index}")
+        except Exception:
+            db.conn.rollback()
+            raise
+        db.conn.commit()
+
+
+def print_disclaimer(accepted=False):
+    """
+    :param accepted: 已通过命令行参数同意，只打印声明不再等待输入
+    """
     message = """
     ######################################################################################################################
                                                    免责声明                                                               
@@ -317,6 +2499,8 @@ def print_disclaimer():
     ######################################################################################################################
     """
     print(textwrap.dedent(message))
+    if accepted:
+        return True
     while True:
         user_input = input("如果您同意本协议, 请输入Y继续: (y/n) ")
         if user_input.lower() == "y":
@@ -327,23 +2511,19 @@ def print_disclaimer():
 
 def get_base_province():
     final_result = []
-    url = 'https://esf.fang.com/newsecond/esfcities.aspx'
-    response = requests.get(url=url, headers=default_headers)
+    url = esf_cities_url
+    response = http_cache.get(url=url, headers=default_headers)
     if response.status_code == 200:
         tree = etree.HTML(response.text)
-        province_elements = tree.xpath('//*[@id="c02"]/ul/li')
-        for province in province_elements:
-            province_name = province.xpath('./strong/text()')
-            city_lists = province.xpath('./a')
-            for city in city_lists:
-                city_name = city.xpath('./text()')[0]
-                city_url = city.xpath('./@href')[0]
-                city_id = extract_city_id(city_url)
+        for province in province_extractor.rows(tree):
+            province_name = province_extractor.extract(province)['province_name']
+            for city in city_extractor.extract_all(province):
+                city_url = city['city_url']
                 insertdata = {
-                    "province_name": province_name[0],
-                    "city_id": str(city_id),
-                    "city_name": str(city_name),
-                    "city_url": str(city_url)[6:] if province_name[0] == '直辖市' else str(city_url)
+                    "province_name": province_name,
+                    "city_id": str(extract_city_id(city_url)),
+                    "city_name": city['city_name'],
+                    "city_url": city_url[6:] if province_name == '直辖市' else city_url
                 }
                 final_result.append(insertdata)
     else:
@@ -353,266 +2533,1068 @@ def get_base_province():
 
 
 def get_base_xiaoqu_list(response_text):
+    with metrics.timer('parse'):
+        return parse_base_xiaoqu_list(response_text)
+
+
+def canonical_xiaoqu_id(xiaoqu_url):
+    """
+    从小区链接（/loupan/123.htm、//yl.esf.fang.com/loupan/123.htm、.../loupan/123/housedetail.htm）中取出xiaoqu_id
+    """
+    match = re.search(r'/loupan/([^/.?#]+)', xiaoqu_url)
+    return match.group(1) if match else xiaoqu_url.split("/")[2][:-4]
+
+
+def parse_base_xiaoqu_list(response_text):
     final_result = []
     tree = etree.HTML(response_text)
-    xiaoqu_list = tree.xpath('//*[@class="houseList"]/div')
+    xiaoqu_list = xiaoqu_list_extractor.rows(tree)
     if len(xiaoqu_list) > 1:
         del xiaoqu_list[-1]
         for xiaoqu in xiaoqu_list:
-            xiaoqu_name = xiaoqu.xpath('./dl/dd/p[1]/a[1]/text()')[0]
-            xiaoqu_url = xiaoqu.xpath('./dl/dd/p[1]/a[1]/@href')[0]
+            item = xiaoqu_list_extractor.extract(xiaoqu)
+            xiaoqu_url = item['xiaoqu_url']
+            if not xiaoqu_url:
+                continue
             final_result.append({
-                "xiaoqu_id": str(xiaoqu_url).split("/")[2][:-4],
-                "xiaoqu_name": str(xiaoqu_name),
-                "xiaoqu_url": str(xiaoqu_url)
+                "xiaoqu_id": canonical_xiaoqu_id(xiaoqu_url),
+                "xiaoqu_name": item['xiaoqu_name'],
+                "xiaoqu_url": xiaoqu_url
             })
     return final_result
 
 
-def get_base_xiaoqu(page, url):
-    final_result = []
-    page.goto(url)
+def iter_base_xiaoqu_pages(page, url, page_no=1, skip_first=False):
+    """
+    逐页点击"下一页"遍历小区列表
+    :param url: 起始页地址
+    :param page_no: 起始页页码
+    :param skip_first: 起始页已处理过，只用于定位下一页
+    :return: 生成 (页码, 当前页地址, 当前页小区列表)
+    """
+    browser_goto(page, url)
     while True:
-        response_text = page.content()
-        temp_xiaoqu_list = get_base_xiaoqu_list(response_text)
-        final_result.extend(temp_xiaoqu_list)
+        if not skip_first:
+            yield page_no, page.url, get_base_xiaoqu_list(page.content())
+        skip_first = False
         next_button = page.locator('text=下一页')
         if not next_button.is_visible():
             break
-        next_button.click()
-        page.wait_for_load_state("load")
-    return final_result
+        with metrics.timer('browser_navigation'):
+            next_button.click()
+            page.wait_for_load_state(browser_wait_state())
+        page_no += 1
 
 
-def get_sub_region(page, url):
+def is_captcha_page(response_text, content_marker='houseList'):
+    """
+    :param content_marker: 正常页面包含的标记（列表页houseList，详情页baseinfo），包含时不视为验证码页面
+    """
+    if content_marker in response_text:
+        return False
+    return any(marker in response_text for marker in CAPTCHA_MARKERS)
+
+
+def parse_list_pagination(response_text):
+    """
+    解析小区列表页分页信息
+    :return: (总页数, {页码: 分页链接})
+    """
+    tree = etree.HTML(response_text)
+    if tree is None:
+        return 1, {}
+    match = re.search(r'共\s*(\d+)\s*页', pager_total_xpath(tree))
+    total_pages = int(match.group(1)) if match else 1
+    page_links = {}
+    for a in pager_extractor.extract_all(tree):
+        if a['text'] and a['text'].isdigit() and a['url']:
+            page_links[int(a['text'])] = a['url']
+    return total_pages, page_links
+
+
+def build_page_url_template(page_links):
+    """
+    根据分页链接推断页码在链接中的位置
+    :return: 可用 template.format(page_no) 生成分页链接的模板，无法推断时返回None
+    """
+    pages = sorted(page_no for page_no in page_links if page_no > 1)
+    if not pages:
+        return None
+    tokens = re.split(r'(\d+)', page_links[pages[0]])
+    positions = [i for i, token in enumerate(tokens) if token == str(pages[0])]
+    for other in pages[1:]:
+        other_tokens = re.split(r'(\d+)', page_links[other])
+        if len(other_tokens) == len(tokens):
+            positions = [i for i in positions if other_tokens[i] == str(other)]
+    if not positions:
+        return None
+    # 有多个候选位置时取最后一个（页码一般在链接末尾）
+    position = positions[-1]
+    return "".join(token.replace('{', '{{').replace('}', '}}') if i != position else '{}'
+                   for i, token in enumerate(tokens))
+
+
+def fetch_list_page(url):
+    response = HttpUtils.get_by_cookies(url, params=None, cookies_path=cookies_path)
+    if response is None:
+        return None
+    if is_captcha_page(response.text):
+        http_cache.invalidate(url)
+        return None
+    return response.text
+
+
+def iter_base_xiaoqu_pages_http(page, url, page_no=1, skip_first=False, workers=None):
+    """
+    通过HTTP直接请求小区列表分页：先读取起始页的总页数，再并发请求其余分页，按页码顺序返回
+    遇到验证码或请求失败时从该页起回退到浏览器逐页点击
+    :return: 生成 (页码, 当前页地址, 当前页小区列表)
+    """
+    response_text = fetch_list_page(url)
+    if response_text is None:
+        Print.print2(f"{url} 请求失败或出现验证码，回退到浏览器翻页")
+        yield from iter_base_xiaoqu_pages(page, url, page_no=page_no, skip_first=skip_first)
+        return
+    if not skip_first:
+        yield page_no, url, get_base_xiaoqu_list(response_text)
+    total_pages, page_links = parse_list_pagination(response_text)
+    if total_pages <= page_no:
+        return
+    template = build_page_url_template(page_links)
+    if template is None:
+        yield from iter_base_xiaoqu_pages(page, url, page_no=page_no, skip_first=True)
+        return
+    base_url = url.split('/housing')[0]
+    page_urls = [(number, urljoin(base_url + '/', template.format(number)))
+                 for number in range(page_no + 1, total_pages + 1)]
+    workers = workers or LIST_FETCH_WORKERS
+    limiter = HostLimiter(workers)
+    # 最多提前提交workers个分页，回退到浏览器时取消未开始的请求，不再继续向出现验证码的站点发请求
+    in_flight = deque()
+    fallback = None
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            for number, page_url in page_urls:
+                in_flight.append((number, page_url, executor.submit(limiter.call, page_url, fetch_list_page, page_url)))
+                if len(in_flight) < workers:
+                    continue
+                fallback = yield from _yield_list_page(*in_flight.popleft())
+                if fallback:
+                    break
+            while in_flight and not fallback:
+                fallback = yield from _yield_list_page(*in_flight.popleft())
+        finally:
+            for _, _, future in in_flight:
+                future.cancel()
+    if fallback:
+        yield from iter_base_xiaoqu_pages(page, fallback[1], page_no=fallback[0])
+
+
+def _yield_list_page(number, page_url, future):
+    """
+    :return: 请求失败或出现验证码时返回 (页码, 页面地址)，由调用方从该页起回退到浏览器翻页
+    """
+    text = future.result()
+    if text is None:
+        Print.print2(f"{page_url} 请求失败或出现验证码，回退到浏览器翻页")
+        return number, page_url
+    yield number, page_url, get_base_xiaoqu_list(text)
+
+
+def iter_list_pages(page, url, page_no=1, skip_first=False):
+    if LIST_FETCH_MODE == 'http':
+        return iter_base_xiaoqu_pages_http(page, url, page_no=page_no, skip_first=skip_first)
+    return iter_base_xiaoqu_pages(page, url, page_no=page_no, skip_first=skip_first)
+
+
+def parse_sub_region(response_text, url):
     final_result = []
-    page.goto(url)
-    response_text = page.content()
     tree = etree.HTML(response_text)
-    a_elements = tree.xpath('//*[@id="shangQuancontain"]/a')
-    for a in a_elements:
-        region_name = a.xpath('./text()')[0]
-        if region_name != '不限':
-            sub_region_name = a.xpath('./text()')[0]
-            sub_region_url = a.xpath('./@href')[0]
-            sub_region_id = sub_region_url
+    for a in sub_region_extractor.extract_all(tree):
+        if a['name'] != '不限':
+            sub_region_url = a['url']
             final_result.append({
-                "sub_region_id": sub_region_id,
-                "sub_region_name": sub_region_name,
+                "sub_region_id": sub_region_url,
+                "sub_region_name": a['name'],
                 "sub_region_url": url.split("housing")[0] + sub_region_url[1:]
             })
     return final_result
 
 
-def get_base_areas(page, url):
+def parse_base_areas(response_text, url):
     final_result = []
-    page.goto(url)
-    response_text = page.content()
     tree = etree.HTML(response_text)
-    a_elements = tree.xpath('//*[@class="qxName"]/a')
-    for a in a_elements:
-        region_name = a.xpath('./text()')[0]
-        if region_name != '不限':
-            region_url = a.xpath('./@href')[0]
-            region_id = region_url
-            region = {
-                "region_id": region_id,
-                "region_name": region_name,
+    for a in region_extractor.extract_all(tree):
+        if a['name'] != '不限':
+            region_url = a['url']
+            final_result.append({
+                "region_id": region_url,
+                "region_name": a['name'],
                 "region_url": url + region_url[9:]
-            }
-            sub_regions = get_sub_region(page=page, url=region['region_url'])
-            if sub_regions:
-                for sub_region in sub_regions:
-                    final_result.append({**region, **sub_region})
-            else:
-                region['sub_region_id'] = region['region_id']
-                region['sub_region_name'] = region['region_name']
-                region['sub_region_url'] = region['region_url']
-                final_result.append(region)
+            })
     return final_result
 
 
-def to_excel(province_name, city, area):
-    current_timestamp = time.time()
-    current_timestamp = int(current_timestamp)
-    file_path = f'{province_name}数据_{current_timestamp}.xlsx'
-    lj_base_areas_sql = f"ftx_base_areas"
+def browser_goto(page, url):
+    with metrics.timer('browser_navigation'):
+        page.goto(url, wait_until=browser_wait_state())
+
+
+def get_sub_region(page, url):
+    browser_goto(page, url)
+    return parse_sub_region(page.content(), url)
+
+
+def iter_base_areas(page, url, pool=None):
+    """
+    逐个区域生成城市下的区域及子区域，每获取完一个区域的子区域即返回，不等待整个城市
+    :param pool: 浏览器页面池，传入时各区域的子区域并行获取，仍按区域顺序返回
+    :return: 生成 (区域, 该区域下的子区域记录列表)
+    """
+    browser_goto(page, url)
+    regions = parse_base_areas(page.content(), url)
+    if pool:
+        sub_regions_iter = pool.imap(lambda worker_page, region: get_sub_region(worker_page, region['region_url']),
+                                     regions)
+    else:
+        sub_regions_iter = (get_sub_region(page=page, url=region['region_url']) for region in regions)
+    for region, sub_regions in zip(regions, sub_regions_iter):
+        if sub_regions:
+            yield region, [{**region, **sub_region} for sub_region in sub_regions]
+        else:
+            yield region, [{**region, 'sub_region_id': region['region_id'], 'sub_region_name': region['region_name'],
+                            'sub_region_url': region['region_url']}]
+
+
+EXPORT_SELECT_SQL = """
+select province_name   as `省份`
+     , city_name       as `城市`
+     , city_id         as `城市ID`
+     , region_id       as `区域ID`
+     , region_name     as `区域名称`
+     , sub_region_id   as `子区域ID`
+     , sub_region_name as `子区域名称`
+     , "`" || xiaoqu_id as `小区ID`
+     , xiaoqu_name     as `小区名称`
+     , xiaoqu_url      as `小区URL`
+     , xqdz            as `小区地址`
+     , fwzs            as `房屋总数`
+     , ldzs            as `楼栋总数`
+from ftx_export_xiaoqu
+"""
+
+
+def build_export_sql(province_name, city, area):
+    """
+    按省份/城市/区域从导出表读取，省份为空时导出全部
+    :return: (sql, 参数)
+    """
+    if not province_name:
+        return EXPORT_SELECT_SQL, ()
+    conditions, params = ["province_name = ?"], [province_name]
     if city:
-        lj_base_province_sql = f"(select * from ftx_base_province where province_name='{province_name}' and city_name='{city}' )"
-        file_path = f'{province_name}-{city}数据_{current_timestamp}.xlsx'
+        conditions.append("city_name = ?")
+        params.append(city)
         if area:
-            lj_base_areas_sql = f"(select * from ftx_base_areas t where region_name='{area}')"
-            file_path = f'{province_name}-{city}-{area}数据_{current_timestamp}.xlsx'
+            conditions.append("region_name = ?")
+            params.append(area)
+    return f"{EXPORT_SELECT_SQL}where {' and '.join(conditions)}", tuple(params)
+
+
+def rebuild_export_table():
+    """
+    清空并按EXPORT_SOURCE_SQL重新生成导出表
+    :return: 行数
+    """
+    db.flush()
+    with db.conn:
+        db.conn.execute("DELETE FROM ftx_export_xiaoqu")
+        db.conn.execute(EXPORT_INSERT_SQL.format(condition='true'))
+    count = db.count('ftx_export_xiaoqu')
+    Print.green(f"导出表已重建，共{count}行")
+    return count
+
+
+def verify_export_table():
+    """
+    比较导出表与EXPORT_SOURCE_SQL的结果
+    :return: 不一致的行数（导出表缺少的行 + 导出表多出或内容不同的行）
+    """
+    columns = ', '.join(EXPORT_TABLE_COLUMNS)
+    missing = db.query(f"SELECT count(*) AS n FROM ({EXPORT_SOURCE_SQL} EXCEPT "
+                       f"SELECT {columns} FROM ftx_export_xiaoqu)")[0]['n']
+    extra = db.query(f"SELECT count(*) AS n FROM (SELECT {columns} FROM ftx_export_xiaoqu EXCEPT "
+                     f"{EXPORT_SOURCE_SQL})")[0]['n']
+    if missing or extra:
+        Print.red(f"导出表与基础数据不一致: 缺少{missing}行，多出或不同{extra}行，可执行 python fang.py export-rebuild")
+    else:
+        Print.green("导出表与基础数据一致")
+    return missing + extra
+
+
+# 各分片的数据量及待采集数，{alias}替换为ATTACH的别名，?绑定分片名
+SHARD_SUMMARY_SQL = """
+SELECT ? AS shard
+     , (SELECT count(*) FROM {alias}.ftx_base_xiaoqu) AS xiaoqu
+     , (SELECT count(*) FROM {alias}.ftx_xiaoqu_detail) AS details
+     , (SELECT count(*) FROM {alias}.ftx_base_xiaoqu t
+        WHERE NOT EXISTS (SELECT 1 FROM {alias}.ftx_xiaoqu_detail d WHERE d.xiaoqu_id = t.xiaoqu_id)) AS pending_xiaoqu
+     , (SELECT count(*) FROM {alias}.ftx_detail_job WHERE status IN ('pending', 'running')) AS pending_jobs
+"""
+
+
+def migrate_shards(shards):
+    """
+    对所有分片执行建表及迁移
+    """
+    global db
+    current = db
+    try:
+        for database in shards.databases():
+            db = database
+            create_table()
+    finally:
+        db = current
+
+
+def print_shard_summary(shards):
+    """
+    ATTACH所有分片，输出每个分片的文件大小、小区数、详情数及待采集数
+    :return: 各分片的统计
+    """
+    rows = shards.union_query(SHARD_SUMMARY_SQL)
+    for row in rows:
+        size = os.path.getsize(shards.shard_path(row['shard']))
+        Print.print2(f"[{row['shard']}] {size / 1024 / 1024:.1f}MB 小区{row['xiaoqu']}个，详情{row['details']}个，"
+                     f"未采集{row['pending_xiaoqu']}个，未完成任务{row['pending_jobs']}个")
+    Print.green(f"共{len(rows)}个分片，未采集小区{sum(row['pending_xiaoqu'] for row in rows)}个")
+    return rows
+
+
+def vacuum_database(into_dir=None, shards=None):
+    """
+    整理数据库文件，传入shards时逐个整理所有分片
+    :param into_dir: 把整理后的副本写入该目录（可用于复制正在使用的数据库），原文件不变
+    :return: [(名称, 整理前字节数, 整理后字节数)]
+    """
+    if shards is not None:
+        result = shards.vacuum(into_dir=into_dir)
     else:
-        lj_base_province_sql = f"(select * from ftx_base_province where province_name='{province_name}' )"
-
-    sql = f'''
-    select 
-       lbp.province_name   as `省份`
-     , lbp.city_name       as `城市`
-     , lba.city_id         as `城市ID`
-     , lba.region_id       as `区域ID`
-     , lba.region_name     as `区域名称`
-     , lba.sub_region_id   as `子区域ID`
-     , lba.sub_region_name as `子区域名称`
-     , "`" || t.xiaoqu_id  as `小区ID`
-     , t.xiaoqu_name       as `小区名称`
-     , t.xiaoqu_url        as `小区URL`
-     , lxd.xqdz            as `小区地址`
-     , lxd.fwzs            as `房屋总数`
-     , lxd.ldzs            as `楼栋总数`
-from ftx_base_xiaoqu t
-left join {lj_base_areas_sql} lba on t.city_id = lba.city_id and t.region_id = lba.region_id and t.sub_region_id = lba.sub_region_id
-left join {lj_base_province_sql} lbp on lba.city_id = lbp.city_id
-left join ftx_xiaoqu_detail lxd on t.xiaoqu_id = lxd.xiaoqu_id
-where lbp.province_name = '{province_name}'
-group by 
-       lbp.province_name 
-     , lbp.city_name     
-     , lba.city_id      
-     , lba.region_id      
-     , lba.region_name     
-     , lba.sub_region_id   
-     , lba.sub_region_name 
-     , "`" || t.xiaoqu_id  
-     , t.xiaoqu_name      
-     , t.xiaoqu_url      
-     , lxd.fwzs        
-     , lxd.ldzs            
-;'''
-    query_list = db.query(sql)
-    result_df = pd.DataFrame(query_list)
-    result_df.to_excel(file_path, index=False)
-    Print.print2(f"导出成功:{file_path}")
-
-
-def db_init(page=None, province_name=None, city_name=None):
+        target = None
+        if into_dir:
+            os.makedirs(into_dir, exist_ok=True)
+            target = os.path.join(into_dir, os.path.basename(db.db_file))
+        before = os.path.getsize(db.db_file)
+        db.vacuum(into=target)
+        result = [(os.path.splitext(os.path.basename(db.db_file))[0], before, os.path.getsize(target or db.db_file))]
+    for key, before, after in result:
+        Print.print2(f"[{key}] {before / 1024 / 1024:.1f}MB -> {after / 1024 / 1024:.1f}MB")
+    return result
+
+
+def export_query(sql, file_path, fmt='xlsx', partition_by=None, chunk_size=None, params=(), source=None):
+    """
+    流式导出查询结果
+    :param file_path: 导出文件路径（不含扩展名），按列分区时作为目录名
+    :param fmt: xlsx/csv/parquet
+    :param partition_by: 分区列名，每个取值导出为目录下的单独文件
+    :param source: 查询的数据库，默认db，传入ShardedDB时合并所有分片
+    :return: 导出的文件列表
+    """
+    source = source or db
+    writer_class = EXPORT_WRITERS.get(fmt)
+    if writer_class is None:
+        raise Exception(f"不支持的导出格式: {fmt}")
+    writers = {}
+    columns = None
+    try:
+        for columns, rows in source.iter_query(sql, params, chunk_size=chunk_size):
+            if partition_by is None:
+                groups = {None: rows}
+            else:
+                index = columns.index(partition_by)
+                groups = {}
+                for row in rows:
+                    groups.setdefault(row[index], []).append(row)
+            metrics.incr('export_rows', len(rows))
+            for key, group_rows in groups.items():
+                writer = writers.get(key)
+                if writer is None:
+                    writer = writers[key] = writer_class(
+                        export_partition_path(file_path, key, partition_by, writer_class.extension), columns)
+                writer.write_rows(group_rows)
+        if not writers and partition_by is None:
+            # 无数据时也导出只有表头的文件
+            columns = columns or source.columns(sql, params)
+            writers[None] = writer_class(export_partition_path(file_path, None, None, writer_class.extension),
+                                         columns)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return [export_partition_path(file_path, key, partition_by, writer_class.extension) for key in writers]
+
+
+def export_partition_path(file_path, key, partition_by, extension):
+    if partition_by is None:
+        return f"{file_path}.{extension}"
+    os.makedirs(file_path, exist_ok=True)
+    return os.path.join(file_path, f"{key}.{extension}")
+
+
+@profile_phase('to_excel')
+def to_excel(province_name, city, area, fmt='xlsx', partition_by=None, source=None):
+    """
+    导出省份/城市/区域下的小区数据
+    :param province_name: 为空时导出全部小区
+    :param fmt: xlsx/csv/parquet
+    :param partition_by: 按省份或城市分区导出，可选 '省份'、'城市'
+    :param source: 查询的数据库，默认db，传入ShardedDB时合并所有分片
+    :return:
+    """
+    current_timestamp = time.time()
+    current_timestamp = int(current_timestamp)
+    file_path = f'{province_name or "全部"}数据_{current_timestamp}'
+    if province_name and city:
+        file_path = f'{province_name}-{city}数据_{current_timestamp}'
+        if area:
+            file_path = f'{province_name}-{city}-{area}数据_{current_timestamp}'
+    with metrics.timer('export'):
+        sql, params = build_export_sql(province_name, city, area)
+        files = export_query(sql, file_path, fmt=fmt, partition_by=partition_by, params=params, source=source)
+    for file in files:
+        Print.print2(f"导出成功:{file}")
+
+
+def prepare_sub_region(frontier, city, area):
+    """
+    登记子区域任务并确定起始分页
+    :return: (任务key, 起始页地址, 起始页码, 起始页是否已处理)
+    """
+    task_key = frontier.sub_region_key(city['city_id'], area['region_id'], area['sub_region_id'])
+    frontier.add(task_key, 'sub_region', province_name=city['province_name'], city_id=city['city_id'],
+                 region_id=area['region_id'], sub_region_id=area['sub_region_id'], url=None)
+    task = frontier.get(task_key)
+    if task and task['state'] == 'running' and task['url']:
+        # 从最后一个已完成的分页定位到下一页继续
+        Print.print2(f"{area['sub_region_url']} 从第{task['page_no'] + 1}页继续采集")
+        return task_key, task['url'], task['page_no'], True
+    return task_key, area['sub_region_url'], 1, False
+
+
+def save_xiaoqu_page(frontier, city, area, page_no, page_url, xiaoqu_list):
+    """
+    保存一页小区数据，并与分页任务进度在同一事务中提交
+    """
+    city_id = city['city_id']
+    region_id = area['region_id']
+    sub_region_id = area['sub_region_id']
+    for xiaoqu in xiaoqu_list:
+        # 已在其它子区域/分页中写入过
+        if not frontier.xiaoqu.add(xiaoqu['xiaoqu_id']):
+            continue
+        xiaoqu['city_id'] = city_id
+        xiaoqu['region_id'] = region_id
+        xiaoqu['xiaoqu_url'] = site_scheme + city['city_url'] + xiaoqu['xiaoqu_url']
+        xiaoqu['sub_region_id'] = sub_region_id
+        db.buffer_upsert(table='ftx_base_xiaoqu', data=xiaoqu, conflict=UNIQUE_KEYS['ftx_base_xiaoqu'])
+    frontier.add(frontier.page_key(city_id, region_id, sub_region_id, page_no), 'page',
+                 province_name=city['province_name'], city_id=city_id, region_id=region_id,
+                 sub_region_id=sub_region_id, url=page_url, page_no=page_no, state='done')
+    frontier.mark(frontier.sub_region_key(city_id, region_id, sub_region_id), 'running', url=page_url,
+                  page_no=page_no)
+    db.flush()
+
+
+def finish_sub_region(frontier, task_key, area, xiaoqu_count, resumed):
+    if xiaoqu_count == 0 and not resumed:
+        Print.print2(f"{area['sub_region_url']}下无小区信息")
+    frontier.mark(task_key, 'done')
+    db.flush()
+
+
+def crawl_sub_region(page, frontier, city, area):
+    """
+    采集一个子区域下所有分页的小区，每页的小区数据与任务进度在同一事务中提交
+    """
+    task_key, url, page_no, skip_first = prepare_sub_region(frontier, city, area)
+    xiaoqu_count = 0
+    for page_no, page_url, xiaoqu_list in iter_list_pages(page, url, page_no=page_no, skip_first=skip_first):
+        save_xiaoqu_page(frontier, city, area, page_no, page_url, xiaoqu_list)
+        xiaoqu_count += len(xiaoqu_list)
+    finish_sub_region(frontier, task_key, area, xiaoqu_count, skip_first)
+
+
+def crawl_sub_regions_parallel(pool, frontier, city, areas_list):
+    """
+    将子区域分发到浏览器页面池并行采集，采集结果统一由当前线程写入数据库
+    """
+    events = queue.Queue()
+
+    def crawl(worker_page, area, url, page_no, skip_first):
+        try:
+            for item in iter_list_pages(worker_page, url, page_no=page_no, skip_first=skip_first):
+                events.put(('page', area, item))
+            events.put(('done', area, None))
+        except Exception as e:
+            events.put(('error', area, e))
+
+    def on_done(future, area):
+        # crawl自身的异常已转为error事件；任务未执行（浏览器全部启动失败、被取消）时在这里补发
+        if future.cancelled():
+            events.put(('error', area, Exception("任务已取消")))
+        elif future.exception() is not None:
+            events.put(('error', area, future.exception()))
+
+    tasks = {}
+    for area in areas_list:
+        task_key, url, page_no, skip_first = prepare_sub_region(frontier, city, area)
+        tasks[task_key] = {'resumed': skip_first, 'count': 0}
+        future = pool.submit(crawl, area, url, page_no, skip_first)
+        future.add_done_callback(functools.partial(on_done, area=area))
+    errors = []
+    finished = 0
+    while finished < len(tasks):
+        event, area, payload = events.get()
+        task_key = frontier.sub_region_key(city['city_id'], area['region_id'], area['sub_region_id'])
+        if event == 'page':
+            page_no, page_url, xiaoqu_list = payload
+            save_xiaoqu_page(frontier, city, area, page_no, page_url, xiaoqu_list)
+            tasks[task_key]['count'] += len(xiaoqu_list)
+            continue
+        finished += 1
+        if event == 'done':
+            finish_sub_region(frontier, task_key, area, tasks[task_key]['count'], tasks[task_key]['resumed'])
+            Print.print2(f"[{city['city_name']}] ({finished}/{len(tasks)}) {area['sub_region_url']}")
+        else:
+            Print.red(f"{area['sub_region_url']} 采集失败: {payload}")
+            errors.append(payload)
+    if errors:
+        raise errors[0]
+
+
+def discover_city_areas(page, frontier, city, pool=None):
+    """
+    采集城市下所有区域、子区域，每获取完一个区域即写入该区域的子区域并登记子区域任务
+    城市任务在所有区域写入后才标记完成，中断后重新执行时先清除已写入的区域数据
+    """
+    city_id = city['city_id']
+    url = f"{site_scheme}{city['city_url']}/housing/"
+    db.buffer_delete(table='ftx_base_areas', condition={'city_id': city_id})
+    sub_region_count = 0
+    for index, (region, areas) in enumerate(iter_base_areas(page=page, url=url, pool=pool)):
+        for area in areas:
+            area['city_id'] = city_id
+            db.buffer_upsert(table='ftx_base_areas', data=area, conflict=UNIQUE_KEYS['ftx_base_areas'])
+            frontier.add(frontier.sub_region_key(city_id, area['region_id'], area['sub_region_id']), 'sub_region',
+                         province_name=city['province_name'], city_id=city_id, region_id=area['region_id'],
+                         sub_region_id=area['sub_region_id'], url=None)
+        db.flush()
+        sub_region_count += len(areas)
+        Print.print2(f"[{city['city_name']}] 区域{index + 1} {region['region_name']}: {len(areas)}个子区域，"
+                     f"累计{sub_region_count}个")
+    frontier.mark(frontier.city_key(city_id), 'done')
+    db.flush()
+
+
+@profile_phase('db_init')
+def db_init(page=None, province_name=None, city_name=None, pool_size=None):
     if not province_name:
         raise Exception("未传递省份参数province_name")
     Print.print2(f"开始初始化[{province_name}]省份基础数据...")
     province_list = get_base_province()
-    db.delete(table='ftx_base_province', condition=f" province_name='{province_name}' ")
     for province in province_list:
         if province['province_name'] == province_name:
-            db.insert(table='ftx_base_province', data=province, echo=DEBUG)
+            db.buffer_upsert(table='ftx_base_province', data=province, conflict=UNIQUE_KEYS['ftx_base_province'])
+    db.flush()
 
     # 获取省份-城市下所有区域信息
+    condition = {'province_name': province_name}
     if city_name:
-        condition = f" province_name='{province_name}' and city_name='{city_name}' "
-    else:
-        condition = f" province_name='{province_name}' "
+        condition['city_name'] = city_name
     city_list = db.select(table='ftx_base_province', condition=condition)
-    for city in city_list:
-        city_url = city['city_url']
-        city_id = city['city_id']
-        db.delete(table='ftx_base_areas', condition=f" city_id='{city_id}'")
-        url = f"https:{city_url}/housing/"
-        areas_list = get_base_areas(page=page, url=url)
-        for area in areas_list:
-            area['city_id'] = city_id
-            region_id = area['region_id']
-
-            db.insert(table='ftx_base_areas', data=area, echo=DEBUG)
-
-            # 获取区域下所有小区信息
-            sub_region_id = area['sub_region_id']
-            sub_region_url = area['sub_region_url']
-            xiaoqu_list = get_base_xiaoqu(page=page, url=sub_region_url)
-            if xiaoqu_list:
-                for xiaoqu in xiaoqu_list:
-                    xiaoqu_id = xiaoqu['xiaoqu_id']
-                    xiaoqu['city_id'] = city_id
-                    xiaoqu['region_id'] = region_id
-                    xiaoqu['xiaoqu_url'] = "https:" + city_url + xiaoqu['xiaoqu_url']
-                    xiaoqu['sub_region_id'] = sub_region_id
-                    db.delete(table='ftx_base_xiaoqu',
-                              condition=f" city_id='{city_id}' and xiaoqu_id='{xiaoqu_id}'")
-                    db.insert(table='ftx_base_xiaoqu', data=xiaoqu, echo=DEBUG)
-            else:
-                Print.print2(f"{sub_region_url}下无小区信息")
+    frontier = CrawlFrontier(db)
+    if frontier.reset_if_finished(province_name, [city['city_id'] for city in city_list]):
+        Print.print2(f"检测到[{province_name}]未完成的初始化任务，继续采集...")
+    pool_size = BROWSER_POOL_SIZE if pool_size is None else pool_size
+    with BrowserPool(pool_size) if pool_size > 1 else contextlib.nullcontext() as pool:
+        for city in city_list:
+            db_init_city(page, frontier, city, pool)
+        if pool:
+            pool.report()
+    Print.print2(f"小区去重统计: {frontier.xiaoqu.counters}")
     Print.print2(f"[{province_name}]省份下所有城市、区域、子区域、小区信息初始化完成......")
 
 
-def get_xiaoqu_detail(url):
+def db_init_city(page, frontier, city, pool=None):
+    city_id = city['city_id']
+    city_key = frontier.city_key(city_id)
+    frontier.add(city_key, 'city', province_name=city['province_name'], city_id=city_id,
+                 url=f"{site_scheme}{city['city_url']}/housing/")
+    if not frontier.is_done(city_key):
+        discover_city_areas(page, frontier, city, pool=pool)
+    areas_list = db.query("SELECT * FROM ftx_base_areas WHERE city_id = ? ORDER BY id", (city_id,))
+    pending = [area for area in areas_list
+               if not frontier.is_done(frontier.sub_region_key(city_id, area['region_id'], area['sub_region_id']))]
+    if pool:
+        crawl_sub_regions_parallel(pool, frontier, city, pending)
+        return
+    for index, area in enumerate(pending):
+        Print.print2(f"[{city['city_name']}] ({index}/{len(pending)}) {area['sub_region_url']}")
+        crawl_sub_region(page, frontier, city, area)
+
+
+def parse_xiaoqu_detail(response_text):
+    """
+    一次遍历解析小区详情页所有标签
+    :param response_text:
+    :return: {标签: 值}，同名标签取第一个
+    """
+    final_result = {}
+    with metrics.timer('parse'):
+        tree = etree.HTML(response_text)
+        for item in xiaoqu_detail_extractor.extract_all(tree):
+            final_result.setdefault(item['label'] or '', item['value'] or '')
+    return final_result
+
+
+def fetch_xiaoqu_detail_html(url):
+    """
+    :return: 详情页html，页面不存在等其它非200响应返回None；限流、5xx或出现验证码时抛出FetchError
+    """
     # TODO 这里get请求可以使用ip代理
-    response = requests.get(url)
+    response = http_cache.get(url)
     if response.status_code == 200:
-        final_result = []
-        tree = etree.HTML(response.text)
-        label_list = tree.xpath('//*[@id="baseinfo"]/div/ul/li')
-        for label in label_list:
-            label_key = label.xpath('./span/text()')
-            label_value = ''
-            if len(label.xpath('./div')) > 0 and label.xpath('./div')[0] is not None:
-                if len(label.xpath('./div/p')) and label.xpath('./div/p')[0] is not None:
-                    if len(label.xpath('./div/p/b')) > 0 and label.xpath('./div/p/b')[0] is not None:
-                        label_value = label.xpath('./div/p/b/text()')
-                    else:
-                        label_value = label.xpath('./div/p/b/text()')
-            if len(label.xpath('./p')) > 0 and label.xpath('./p')[0] is not None:
-                if len(label.xpath('./p/span')) > 0 and label.xpath('./p/span')[0] is not None:
-                    label_value = label.xpath('./p/span/text()')
-                else:
-                    label_value = label.xpath('./p/text()')
+        if is_captcha_page(response.text, content_marker='baseinfo'):
+            # 验证码页面不缓存、不归档，也不能当作空详情删除已有数据，小区保持待采集状态
+            http_cache.invalidate(url)
+            metrics.incr('detail_captcha')
+            raise FetchError(f"出现验证码: {url}")
+        page_archive.append(url, response.text, xiaoqu_id=canonical_xiaoqu_id(url))
+        return response.text
+    if response.status_code == 429 or response.status_code >= 500:
+        raise FetchError(f"HTTP {response.status_code}: {url}", status=response.status_code)
 
-            if isinstance(label_key, list):
-                if len(label_key) > 0:
-                    label_key = label_key[0]
-                    label_key = "".join(label_key.split())
-                else:
-                    label_key = ''
 
-            if isinstance(label_value, list):
-                if len(label_value) > 0:
-                    label_value = label_value[0]
-                    label_value = "".join(label_value.split())
-                else:
-                    label_value = ''
-            final_result.append({
-                "label": label_key,
-                "value": label_value
-            })
-        return final_result
+def get_xiaoqu_detail(url):
+    response_text = fetch_xiaoqu_detail_html(url)
+    if response_text is not None:
+        return parse_xiaoqu_detail(response_text)
 
 
 def get_specific_value(xiaoqu_detail, label):
+    if isinstance(xiaoqu_detail, dict):
+        return xiaoqu_detail.get(label)
     for xiaoqu in xiaoqu_detail:
         if xiaoqu['label'] == label:
             return xiaoqu['value']
     return None
 
 
-def process_list(all_xiaoqu_list):
+def get_xiaoqu_detail_url(xiaoqu):
+    return xiaoqu['xiaoqu_url'][:-4] + '/housedetail.htm'
+
+
+# 内容未变化时只更新采集时间；变化时更新字段、变化时间及次数（首次写入哈希不计为变化）
+DETAIL_UPSERT_SQL = """
+INSERT INTO ftx_xiaoqu_detail (xiaoqu_id, fwzs, ldzs, xqdz, content_hash, fetched_at, changed_at, change_count)
+VALUES (?, ?, ?, ?, ?, ?, ?, 0)
+ON CONFLICT (xiaoqu_id) DO UPDATE SET
+    fwzs = excluded.fwzs,
+    ldzs = excluded.ldzs,
+    xqdz = excluded.xqdz,
+    fetched_at = max(coalesce(fetched_at, 0), excluded.fetched_at),
+    change_count = change_count + (content_hash IS NOT NULL AND content_hash IS NOT excluded.content_hash),
+    changed_at = CASE WHEN content_hash IS excluded.content_hash THEN changed_at ELSE excluded.changed_at END,
+    update_time = CASE WHEN content_hash IS excluded.content_hash THEN update_time
+                       ELSE datetime(CURRENT_TIMESTAMP, 'localtime') END,
+    content_hash = excluded.content_hash
+"""
+
+# 与当前保存的版本不同时才写入历史
+DETAIL_HISTORY_SQL = """
+INSERT INTO ftx_xiaoqu_detail_history (xiaoqu_id, fwzs, ldzs, xqdz, content_hash, fetched_at)
+SELECT ?, ?, ?, ?, ?, ?
+WHERE NOT EXISTS (SELECT 1 FROM ftx_xiaoqu_detail WHERE xiaoqu_id = ? AND content_hash = ?)
+"""
+
+
+def detail_content_hash(insert_detail):
+    return hashlib.sha1(json.dumps(insert_detail, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def save_xiaoqu_detail(xiaoqu_id, xiaoqu_detail, previous_hash=None, fetched_at=None):
+    """
+    保存小区详情，内容哈希与已保存的相同时只更新采集时间
+    :param previous_hash: 已保存的内容哈希，未知时传None，由数据库比较
+    :param fetched_at: 页面采集时间，默认当前时间
+    """
+    page_archive.write_index()
+    if not xiaoqu_detail:
+        db.buffer_delete(table='ftx_xiaoqu_detail', condition={'xiaoqu_id': xiaoqu_id})
+        return
+    insert_detail = {
+        'xiaoqu_id': xiaoqu_id,
+        'fwzs': get_specific_value(xiaoqu_detail, '房屋总数'),
+        'ldzs': get_specific_value(xiaoqu_detail, '楼栋总数'),
+        'xqdz': get_specific_value(xiaoqu_detail, '小区地址')
+    }
+    content_hash = detail_content_hash(insert_detail)
+    fetched_at = fetched_at or time.time()
+    if content_hash == previous_hash:
+        metrics.incr('detail_unchanged')
+        db.buffer_execute("UPDATE ftx_xiaoqu_detail SET fetched_at = ? WHERE xiaoqu_id = ?", (fetched_at, xiaoqu_id))
+        return
+    metrics.incr('detail_changed')
+    values = (xiaoqu_id, insert_detail['fwzs'], insert_detail['ldzs'], insert_detail['xqdz'], content_hash,
+              fetched_at)
+    if DETAIL_HISTORY_ENABLED:
+        db.buffer_execute(DETAIL_HISTORY_SQL, values + (xiaoqu_id, content_hash))
+    db.buffer_execute(DETAIL_UPSERT_SQL, values + (fetched_at,))
+
+
+@profile_phase('process_list')
+def process_list(all_xiaoqu_list, workers=None, per_host_limit=None):
+    """
+    采集小区详情并写入ftx_xiaoqu_detail
+    :param all_xiaoqu_list: 待采集小区列表
+    :param workers: 并发线程数，默认detail_workers()，<=1时串行采集，>1时按DETAIL_PARSE_PROCESSES决定是否使用流水线
+    :param per_host_limit: 同一host最大并发请求数，默认DETAIL_PER_HOST_LIMIT
+    :return:
+    """
+    workers = detail_workers(workers)
+    dedup = XiaoquDedup()
+    all_xiaoqu_list = [xiaoqu for xiaoqu in all_xiaoqu_list
+                       if dedup.add(canonical_xiaoqu_id(get_xiaoqu_detail_url(xiaoqu)))]
+    if dedup.counters['duplicate']:
+        Print.print2(f"跳过{dedup.counters['duplicate']}个重复的小区详情地址")
+    if workers <= 1:
+        process_list_serial(all_xiaoqu_list)
+    elif not use_detail_pipeline():
+        process_list_concurrent(all_xiaoqu_list, workers=workers, per_host_limit=per_host_limit)
+    else:
+        process_list_pipeline(all_xiaoqu_list, workers=workers, per_host_limit=per_host_limit)
+    page_archive.write_index()
+    db.flush()
+
+
+def detail_workers(workers=None):
+    """
+    详情采集的并发线程数：参数、DETAIL_WORKERS，都为None时与fetch_controller的并发上限相同，
+    线程数不会限制控制器提升并发
+    """
+    if workers is None:
+        workers = DETAIL_WORKERS
+    return fetch_controller.max_limit if workers is None else workers
+
+
+def use_detail_pipeline():
+    """
+    DETAIL_PARSE_PROCESSES为None时只在多核机器上使用流水线
+    """
+    if DETAIL_PARSE_PROCESSES is None:
+        return (os.cpu_count() or 1) > 1
+    return DETAIL_PARSE_PROCESSES > 0
+
+
+def process_list_serial(all_xiaoqu_list):
     list_size = len(all_xiaoqu_list)
     for index, xiaoqu in enumerate(all_xiaoqu_list):
-        xiaoqu_id = xiaoqu['xiaoqu_id']
-        db.delete(table='ftx_xiaoqu_detail', condition=f" xiaoqu_id = '{xiaoqu_id}'")
-        xiaoqu_url = xiaoqu['xiaoqu_url'][:-4] + '/housedetail.htm'
-        xiaoqu_detail = get_xiaoqu_detail(url=xiaoqu_url)
+        xiaoqu_url = get_xiaoqu_detail_url(xiaoqu)
+        try:
+            xiaoqu_detail = get_xiaoqu_detail(url=xiaoqu_url)
+        except (FetchError, requests.exceptions.RequestException) as e:
+            # 限流或网络异常时不写入，下次采集时仍为待采集状态
+            Print.red(f"({index}/{list_size}) {xiaoqu_url} 采集失败: {e}")
+            continue
         Print.print2(f"({index}/{list_size}) {xiaoqu_url}")
-        if xiaoqu_detail:
-            insert_detail = {
-                'xiaoqu_id': xiaoqu_id,
-                'fwzs': get_specific_value(xiaoqu_detail, '房屋总数'),
-                'ldzs': get_specific_value(xiaoqu_detail, '楼栋总数'),
-                'xqdz': get_specific_value(xiaoqu_detail, '小区地址')
-            }
-            db.insert(table='ftx_xiaoqu_detail', data=insert_detail)
+        save_xiaoqu_detail(xiaoqu['xiaoqu_id'], xiaoqu_detail, previous_hash=xiaoqu.get('content_hash'))
 
 
-def spider_by_condition(province, city=None, area=None):
-    area_msg = f"{province}"
-    ftx_base_areas_sql = f"ftx_base_areas"
+def process_list_concurrent(all_xiaoqu_list, workers=None, per_host_limit=None):
+    """
+    线程池并发请求详情页，数据库写入仍在当前线程中串行完成
+    """
+    workers = detail_workers(workers)
+    list_size = len(all_xiaoqu_list)
+    limiter = HostLimiter(DETAIL_PER_HOST_LIMIT if per_host_limit is None else per_host_limit)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for xiaoqu in all_xiaoqu_list:
+            xiaoqu_url = get_xiaoqu_detail_url(xiaoqu)
+            future = executor.submit(limiter.call, xiaoqu_url, get_xiaoqu_detail, xiaoqu_url)
+            futures[future] = (xiaoqu, xiaoqu_url)
+        for index, future in enumerate(as_completed(futures)):
+            xiaoqu, xiaoqu_url = futures[future]
+            try:
+                xiaoqu_detail = future.result()
+            except (FetchError, requests.exceptions.RequestException) as e:
+                Print.red(f"({index}/{list_size}) {xiaoqu_url} 采集失败: {e}")
+                continue
+            Print.print2(f"({index}/{list_size}) {xiaoqu_url}")
+            save_xiaoqu_detail(xiaoqu['xiaoqu_id'], xiaoqu_detail, previous_hash=xiaoqu.get('content_hash'))
+
+
+def process_list_pipeline(all_xiaoqu_list, workers=None, per_host_limit=None, parse_processes=None,
+                          queue_size=None):
+    """
+    流水线采集：workers个线程请求详情页html放入有界队列 -> 进程池解析 -> 单个写入线程保存
+    解析在独立进程中进行，不占用请求线程的GIL；队列满时上游阶段等待，内存占用与列表大小无关
+    结束后输出各阶段的处理条数、利用率及因下游队列满而等待的时间
+    :param parse_processes: 解析进程数，默认DETAIL_PARSE_PROCESSES，None表示CPU核数
+    :param queue_size: 阶段之间队列的容量，默认DETAIL_PIPELINE_QUEUE_SIZE
+    :return: 各阶段统计
+    """
+    workers = detail_workers(workers)
+    parse_processes = parse_processes or DETAIL_PARSE_PROCESSES or os.cpu_count() or 1
+    queue_size = queue_size or DETAIL_PIPELINE_QUEUE_SIZE
+    list_size = len(all_xiaoqu_list)
+    limiter = HostLimiter(DETAIL_PER_HOST_LIMIT if per_host_limit is None else per_host_limit)
+    pending = queue.Queue()
+    for xiaoqu in all_xiaoqu_list:
+        pending.put(xiaoqu)
+    fetched = queue.Queue(maxsize=queue_size)
+    parsed = queue.Queue(maxsize=queue_size)
+    fetch_stage = PipelineStage('fetch', workers)
+    parse_stage = PipelineStage('parse', parse_processes)
+    write_stage = PipelineStage('write', 1)
+    write_errors = []
+    fetch_errors = []
+
+    def fetch_worker():
+        while True:
+            try:
+                xiaoqu = pending.get_nowait()
+            except queue.Empty:
+                return
+            xiaoqu_url = get_xiaoqu_detail_url(xiaoqu)
+            with fetch_stage.working():
+                try:
+                    response_text = limiter.call(xiaoqu_url, fetch_xiaoqu_detail_html, xiaoqu_url)
+                except (FetchError, requests.exceptions.RequestException) as e:
+                    # 限流或网络异常时不写入，下次采集时仍为待采集状态
+                    Print.red(f"{xiaoqu_url} 采集失败: {e}")
+                    continue
+                except Exception as e:
+                    # 数据库、归档文件等其他异常：记录后继续处理剩余的小区，结束后抛出
+                    Print.red(f"{xiaoqu_url} 采集异常: {e!r}")
+                    fetch_errors.append(e)
+                    continue
+            fetch_stage.put(fetched, (xiaoqu, xiaoqu_url, response_text))
+
+    def parse_worker(pool):
+        # 每个线程同一时刻只向进程池提交一个页面，线程数与进程数相同
+        while True:
+            item = fetched.get()
+            if item is None:
+                parse_stage.put(parsed, None)
+                return
+            xiaoqu, xiaoqu_url, response_text = item
+            with parse_stage.working():
+                try:
+                    xiaoqu_detail = None if response_text is None else \
+                        pool.submit(parse_xiaoqu_detail, response_text).result()
+                except Exception as e:
+                    Print.red(f"{xiaoqu_url} 解析失败: {e}")
+                    continue
+            parse_stage.put(parsed, (xiaoqu, xiaoqu_url, xiaoqu_detail))
+
+    def write_worker():
+        finished = 0
+        while finished < parse_processes:
+            item = parsed.get()
+            if item is None:
+                finished += 1
+                continue
+            xiaoqu, xiaoqu_url, xiaoqu_detail = item
+            if write_errors:
+                # 写入出错后继续取出队列中的数据，避免上游阶段一直等待
+                continue
+            with write_stage.working():
+                try:
+                    save_xiaoqu_detail(xiaoqu['xiaoqu_id'], xiaoqu_detail, previous_hash=xiaoqu.get('content_hash'))
+                except Exception as e:
+                    write_errors.append(e)
+                    continue
+            Print.print2(f"({write_stage.items}/{list_size}) {xiaoqu_url}")
+
+    start = time.perf_counter()
+    # spawn方式启动解析进程，避免在已有请求线程时fork；子进程只导入本模块，不会连接数据库
+    with ProcessPoolExecutor(max_workers=parse_processes, mp_context=multiprocessing.get_context('spawn')) as pool:
+        writer = threading.Thread(target=write_worker, name='detail-writer')
+        writer.start()
+        parsers = [threading.Thread(target=parse_worker, args=(pool,), name=f'detail-parser-{i}')
+                   for i in range(parse_processes)]
+        fetchers = [threading.Thread(target=fetch_worker, name=f'detail-fetcher-{i}') for i in range(workers)]
+        for thread in parsers + fetchers:
+            thread.start()
+        for thread in fetchers:
+            thread.join()
+        for _ in parsers:
+            fetched.put(None)
+        for thread in parsers:
+            thread.join()
+        writer.join()
+    elapsed = time.perf_counter() - start
+    if write_errors:
+        raise write_errors[0]
+    if fetch_errors:
+        Print.red(f"{len(fetch_errors)}个详情页请求出现异常，未写入")
+        raise fetch_errors[0]
+    report = [stage.report(elapsed) for stage in (fetch_stage, parse_stage, write_stage)]
+    Print.green(f"流水线耗时{elapsed:.2f}秒")
+    for stage in report:
+        Print.print2(f"  {stage['stage']:<6} 并行数={stage['workers']:<3} 处理={stage['items']:<6} "
+                     f"利用率={stage['utilisation']:.0%} 等待下游={stage['blocked_seconds']}s")
+    return report
+
+
+def reextract_archive_batch(archive_dir, rows):
+    """
+    在解析进程中按分段顺序读取一批归档页面并解析
+    :param rows: [(xiaoqu_id, segment, offset, length, fetched_at)]
+    :return: [(xiaoqu_id, 小区详情, 采集时间)]
+    """
+    results = []
+    handles = {}
+    try:
+        for xiaoqu_id, segment, offset, length, fetched_at in rows:
+            handle = handles.get(segment)
+            if handle is None:
+                handle = handles[segment] = open(os.path.join(archive_dir, segment), 'rb')
+            _, response_text = PageArchive.read_record(None, offset, length, handle=handle)
+            results.append((xiaoqu_id, parse_xiaoqu_detail(response_text), fetched_at))
+    finally:
+        for handle in handles.values():
+            handle.close()
+    return results
+
+
+def reextract_archive(processes=None, batch_size=200):
+    """
+    不联网，用归档中每个小区最近一次的详情页重新解析并写入ftx_xiaoqu_detail（新增字段或修改解析规则后使用）
+    归档记录按分段、偏移顺序分批交给解析进程，批次在途数量有上限，内存占用与归档大小无关
+    :param processes: 解析进程数，默认DETAIL_PARSE_PROCESSES，None表示CPU核数
+    :return: 重新解析的页面数
+    """
+    processes = processes or DETAIL_PARSE_PROCESSES or os.cpu_count() or 1
+    page_archive.close()
+    sql = """
+    SELECT a.xiaoqu_id, a.segment, a.offset, a.length, a.fetched_at
+    FROM ftx_page_archive a
+    JOIN (SELECT max(id) AS id FROM ftx_page_archive WHERE xiaoqu_id IS NOT NULL GROUP BY xiaoqu_id) latest
+      ON a.id = latest.id
+    ORDER BY a.segment, a.offset
+    """
+    pages = 0
+    start = time.perf_counter()
+
+    def save(future):
+        results = future.result()
+        for xiaoqu_id, xiaoqu_detail, fetched_at in results:
+            save_xiaoqu_detail(xiaoqu_id, xiaoqu_detail, fetched_at=fetched_at)
+        return len(results)
+
+    with ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn')) as pool:
+        pending = deque()
+        for _, rows in db.iter_query(sql, chunk_size=batch_size):
+            pending.append(pool.submit(reextract_archive_batch, page_archive.archive_dir, rows))
+            if len(pending) >= processes * 2:
+                pages += save(pending.popleft())
+        while pending:
+            pages += save(pending.popleft())
+    db.flush()
+    elapsed = time.perf_counter() - start
+    Print.green(f"从归档重新解析{pages}个页面，耗时{elapsed:.2f}秒，{pages / elapsed if elapsed else 0:.1f} pages/s")
+    return pages
+
+
+def enqueue_detail_jobs(province, city=None, area=None, refresh=False, budget=None, max_age_days=None):
+    """
+    将待采集小区登记到ftx_detail_job任务表，供 python fang.py worker 启动的进程领取
+    刷新模式参数同spider_by_condition
+    """
+    all_xiaoqu = db.query(*build_detail_target_sql(province, city, area, refresh=refresh, budget=budget,
+                                                   max_age_days=max_age_days))
+    count = DetailJobQueue(db).enqueue(all_xiaoqu)
+    Print.green(f"已登记{count}个小区详情采集任务")
+    return count
+
+
+def run_detail_worker(owner=None, batch_size=20, workers=None, idle_sleep=5.0, exit_when_idle=True):
+    """
+    详情采集工作进程：循环领取任务、并发请求详情页、写入ftx_xiaoqu_detail并回写任务状态
+    :param owner: 工作进程标识，默认 主机名:进程号
+    :param batch_size: 每次领取的任务数
+    :param workers: 单个进程内的并发请求数
+    :param exit_when_idle: 没有待领取的任务时退出
+    :return: 处理的任务数
+    """
+    import socket
+    owner = owner or f"{socket.gethostname()}:{os.getpid()}"
+    job_queue = DetailJobQueue(db)
+    workers = detail_workers(workers)
+    limiter = HostLimiter(DETAIL_PER_HOST_LIMIT)
+    processed = 0
+    Print.green(f"详情采集进程[{owner}]已启动")
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        while True:
+            jobs = job_queue.claim(owner, limit=batch_size)
+            if not jobs:
+                next_time = job_queue.next_available()
+                pending = job_queue.counts().get('pending', 0)
+                # 剩余任务均由其它进程处理中时退出；其它进程异常退出遗留的任务在租约过期后由后续启动的进程领取
+                if exit_when_idle and not pending:
+                    break
+                time.sleep(idle_sleep if next_time is None else min(idle_sleep, max(0.1, next_time - time.time())))
+                continue
+            futures = {executor.submit(limiter.call, job['detail_url'], get_xiaoqu_detail, job['detail_url']): job
+                       for job in jobs}
+            for future in as_completed(futures):
+                job = futures[future]
+                try:
+                    xiaoqu_detail = future.result()
+                    if xiaoqu_detail is None:
+                        raise Exception("详情页请求失败")
+                    save_xiaoqu_detail(job['xiaoqu_id'], xiaoqu_detail)
+                    job_queue.complete(job, owner)
+                except Exception as e:
+                    Print.red(f"{job['detail_url']} 第{job['attempts']}次采集失败: {e}")
+                    job_queue.fail(job, owner, e)
+                processed += 1
+                Print.print2(f"[{owner}] ({processed}) {job['detail_url']}")
+            db.flush()
+    Print.green(f"详情采集进程[{owner}]结束，任务状态: {job_queue.counts()}")
+    return processed
+
+
+def build_pending_xiaoqu_sql(province, city=None, area=None, refresh_before=None, limit=None):
+    """
+    :param refresh_before: 刷新模式，同时选出采集时间早于该时间戳的小区，未采集的优先，其余按过期时长×(1+变化次数)排序
+    :param limit: 最多选出的小区数（采集预算）
+    :return: (sql, 参数)，相同条件组合的sql文本相同，可复用预编译语句
+    """
+    conditions, params = ["lbp.province_name = ?"], [province]
     if city:
-        area_msg += f"-{city}"
-        ftx_base_province_sql = f"(select * from ftx_base_province where province_name='{province}' and city_name='{city}' )"
+        conditions.append("lbp.city_name = ?")
+        params.append(city)
         if area:
-            area_msg += f"-{area}"
-            ftx_base_areas_sql = f"(select * from ftx_base_areas t where region_name='{area}')"
+            conditions.append("lba.region_name = ?")
+            params.append(area)
+    order_sql = ""
+    if refresh_before is None:
+        conditions.append("lxd.xiaoqu_id is null")
     else:
-        ftx_base_province_sql = f"(select * from ftx_base_province where province_name='{province}' )"
-
-    sql = f"""
+        conditions.append("(lxd.xiaoqu_id is null or coalesce(lxd.fetched_at, 0) < ?)")
+        params.append(float(refresh_before))
+        order_sql = "order by lxd.xiaoqu_id is not null, " \
+                    "(? - coalesce(lxd.fetched_at, 0)) * (1 + coalesce(lxd.change_count, 0)) desc"
+        params.append(time.time())
+    limit_sql = ""
+    if limit:
+        limit_sql = "limit ?"
+        params.append(int(limit))
+
+    return f"""
     select
     lbp.province_name
     ,lbp.city_name
@@ -622,71 +3604,117 @@ def spider_by_condition(province, city=None, area=None):
     ,t.xiaoqu_id
     ,t.xiaoqu_name
     ,t.xiaoqu_url
+    ,lxd.content_hash
     from ftx_base_xiaoqu t
-    inner join {ftx_base_areas_sql} lba on t.city_id = lba.city_id and t.region_id=lba.region_id and t.sub_region_id=lba.sub_region_id
-    inner join {ftx_base_province_sql} lbp on lba.city_id = lbp.city_id
+    inner join ftx_base_areas lba on t.city_id = lba.city_id and t.region_id=lba.region_id and t.sub_region_id=lba.sub_region_id
+    inner join ftx_base_province lbp on lba.city_id = lbp.city_id
     left join ftx_xiaoqu_detail lxd on t.xiaoqu_id = lxd.xiaoqu_id
-    where 1=1
-      and lxd.xiaoqu_id is null
-    group by
-    lbp.province_name
-    ,lbp.city_name
-    ,lba.city_id
-    ,lba.sub_region_id
-    ,lba.sub_region_name
-    ,t.xiaoqu_id
-    ,t.xiaoqu_name
-    ,t.xiaoqu_url
-    ;
+    where {' and '.join(conditions)}
+    {order_sql}
+    {limit_sql}
+    """, tuple(params)
+
+
+def build_detail_target_sql(province, city=None, area=None, refresh=False, budget=None, max_age_days=None):
+    """
+    待采集详情的小区：默认只选未采集的，刷新模式同时选出过期的
+    :return: (sql, 参数)
+    """
+    if not refresh:
+        return build_pending_xiaoqu_sql(province, city, area)
+    max_age_days = DETAIL_REFRESH_MAX_AGE_DAYS if max_age_days is None else max_age_days
+    return build_pending_xiaoqu_sql(province, city, area, refresh_before=time.time() - max_age_days * 86400,
+                                    limit=DETAIL_REFRESH_BUDGET if budget is None else budget)
+
+
+@profile_phase('spider_by_condition')
+def spider_by_condition(province, city=None, area=None, workers=None, refresh=False, budget=None, max_age_days=None):
+    """
+    采集区域下小区详情
+    :param refresh: 刷新模式，除未采集的小区外，同时重新采集过期的小区详情
+    :param budget: 刷新模式下最多采集的小区数，默认DETAIL_REFRESH_BUDGET
+    :param max_age_days: 刷新模式下详情的有效天数，默认DETAIL_REFRESH_MAX_AGE_DAYS
     """
-    Print.print2(sql)
-    all_xiaoqu = db.query(sql)
+    area_msg = f"{province}"
+    if city:
+        area_msg += f"-{city}"
+        if area:
+            area_msg += f"-{area}"
+    sql, params = build_detail_target_sql(province, city, area, refresh=refresh, budget=budget,
+                                          max_age_days=max_age_days)
+    Print.print2(sql, params)
+    all_xiaoqu = db.query(sql, params)
     if all_xiaoqu:
         Print.green(f"开始采集[{area_msg}]区域下数据...")
-        process_list(all_xiaoqu)
+        process_list(all_xiaoqu, workers=workers)
+    elif refresh:
+        Print.green(f"[{area_msg}]区域下没有需要刷新的小区")
     else:
         # Print.red(f"[{area_msg}]区域下无小区信息，请先进行区域信息初始化.")
         raise Exception(f"[{area_msg}]区域下无小区信息，请先进行区域信息初始化.")
 
 
+@contextlib.contextmanager
+def open_login_page(captcha_wait=20):
+    """
+    打开房天下页面等待人工完成滑动验证，并将cookies保存到cookies_path
+    精简模式下保存cookies后关闭该浏览器，返回使用保存的cookies启动的无界面精简浏览器页面
+    :param captcha_wait: 等待滑动验证的秒数，0表示不等待（直接使用已保存的cookies）
+    """
+    with open_browser_page(storage_state=cookies_path, lean=False) as page:
+        page.goto(housing_url)
+        if captcha_wait:
+            Print.red(f"请在{captcha_wait}s内滑动验证码......")
+            time.sleep(captcha_wait)
+        page.context.storage_state(path=cookies_path)
+        if not BROWSER_LEAN_MODE:
+            yield page
+            return
+    Print.print2("cookies已保存，切换到无界面精简浏览器采集")
+    with open_browser_page(storage_state=cookies_path, lean=True) as page:
+        yield page
+
+
+def print_run_summary():
+    Print.print2(f"HTTP缓存统计: {http_cache.stats()}")
+    Print.print2(f"并发控制统计: {fetch_controller.snapshot()}")
+    snapshot = metrics.snapshot()
+    navigation = snapshot['stages'].get('browser_navigation')
+    if navigation and navigation['total_seconds']:
+        Print.print2(f"浏览器页面: {navigation['count']}页 "
+                     f"{navigation['count'] / navigation['total_seconds'] * 60:.1f} pages/min "
+                     f"下载{snapshot['counters'].get('browser_response_bytes', 0) / 1024:.0f}KB "
+                     f"拦截请求{snapshot['counters'].get('browser_blocked_requests', 0)}个")
+    metrics.stop_reporter()
+    metrics.print_summary()
+
+
+@profile_phase('main')
 def main():
+    global db
     try:
         disclaimer_accepted = print_disclaimer()
         if not disclaimer_accepted:
             exit()
-        create_table()
+        if not DB_SHARD_BY:
+            create_table()
+        metrics.start_reporter()
         print("功能选项：\n1. 按区域采集并导出\n2. 区域信息初始化")
         function_choice = input("请输入功能序号: ")
         province = input("请输入省份名称(必填): ")
         city = input("请输入省份下城市名称(可选): ")
         area = input("请输入省份下城市下区域名称(可选): ")
+        if province and DB_SHARD_BY:
+            db = ShardedDB().shard(province, city)
+            create_table()
         if province:
-            with sync_playwright() as playwright:
-                browser = playwright.chromium.launch(
-                    headless=False,
-                    slow_mo=1000,
-                    args=['--start-maximized']
-                )
-
-                context = browser.new_context(
-                    no_viewport=True,
-                    accept_downloads=True
-                )
-                page = context.new_page()
-                page.set_default_timeout(200000)
-                page.goto(housing_url)
-                Print.red("请在20s内滑动验证码......")
-                time.sleep(20)
-
-                context.storage_state(path=cookies_path)
-
+            with open_login_page() as page:
                 if function_choice == '1':
                     spider_by_condition(province=province, city=city, area=area)
                     to_excel(province, city, area)
                 elif function_choice == '2':
                     db_init(page=page, province_name=province, city_name=city)
-                context.close()
-                browser.close()
+                print_run_summary()
         else:
             Print.red("省份名称未输入！")
     except Exception as e:
@@ -694,6 +3722,136 @@ def main():
         exit(1)
 
 
+def cli_main(argv):
+    """
+    非交互式命令行，便于脚本批量执行：
+    python fang.py crawl --province 广西 [--city 玉林] [--area 玉州] [--format csv] [--login] --yes
+    python fang.py crawl --province 广西 --refresh [--budget 5000] [--max-age-days 30] --yes
+    python fang.py init --province 广西 [--city 玉林] [--pool-size 2] [--captcha-wait 20] [--lean] --yes
+    python fang.py enqueue --province 广西 [--city 玉林] [--area 玉州]
+    python fang.py worker [--batch 20] [--workers 4] [--db fang.db]
+    python fang.py reextract [--processes 4]   # 不联网，用页面归档重建ftx_xiaoqu_detail
+    python fang.py export-verify | export-rebuild   # 校验/重建导出表ftx_export_xiaoqu
+    python fang.py export [--province 广西] [--format csv]   # 只导出，不指定省份时导出全部
+    python fang.py vacuum [--into DIR]   # 整理数据库，--into时写入整理后的副本
+    任一命令加 --shard-by province|city [--shard-dir DIR] 按省份（或省份-城市）分库，数据写入各自的数据库文件；
+    分库时export、vacuum不指定--province则作用于所有分片，python fang.py shards --shard-by province 查看各分片的数据量及待采集数
+    任一命令加 --profile [DIR] [--profile-phases process_list] 按阶段记录性能分析数据
+    """
+    import argparse
+    global db, profiler, BROWSER_LEAN_MODE
+    parser = argparse.ArgumentParser(prog='fang.py')
+    parser.add_argument('command', choices=['crawl', 'init', 'enqueue', 'worker', 'requeue-dead', 'reextract',
+                                            'export-rebuild', 'export-verify', 'export', 'vacuum', 'shards'])
+    parser.add_argument('--db', default=None, help='数据库文件，默认fang.db')
+    parser.add_argument('--shard-by', choices=['province', 'city'], default=None, help='按省份或省份-城市分库')
+    parser.add_argument('--shard-dir', default=None, help='分库文件目录，默认./fang_shards')
+    parser.add_argument('--into', default=None, metavar='DIR', help='vacuum把整理后的副本写入DIR')
+    parser.add_argument('--province')
+    parser.add_argument('--city')
+    parser.add_argument('--area')
+    parser.add_argument('--yes', action='store_true', help='同意免责声明，不再交互确认')
+    parser.add_argument('--format', default='xlsx', choices=sorted(EXPORT_WRITERS), help='crawl/export导出格式')
+    parser.add_argument('--partition-by', choices=['省份', '城市'], help='crawl/export按省份或城市分区导出')
+    parser.add_argument('--login', action='store_true', help='crawl前打开浏览器完成滑动验证并更新cookies')
+    parser.add_argument('--refresh', action='store_true', help='crawl/enqueue同时重新采集过期的小区详情')
+    parser.add_argument('--budget', type=int, default=None, help='刷新模式最多采集的小区数')
+    parser.add_argument('--max-age-days', type=float, default=None, help='刷新模式下详情的有效天数')
+    parser.add_argument('--captcha-wait', type=int, default=20, help='等待滑动验证的秒数')
+    parser.add_argument('--pool-size', type=int, default=None, help='init使用的浏览器页面数')
+    parser.add_argument('--lean', action='store_true', help='完成滑动验证后使用无界面精简浏览器采集')
+    parser.add_argument('--profile', nargs='?', const='profile', default=None, metavar='DIR',
+                        help='按阶段记录cProfile及tracemalloc数据到DIR（默认./profile）下的运行目录')
+    parser.add_argument('--profile-phases', default=None,
+                        help='逗号分隔的分析阶段，默认db_init,spider_by_condition,to_excel')
+    parser.add_argument('--batch', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--processes', type=int, default=None, help='reextract使用的解析进程数，默认CPU核数')
+    parser.add_argument('--owner', default=None)
+    parser.add_argument('--wait', action='store_true', help='没有任务时继续等待新任务')
+    args = parser.parse_args(argv)
+    if args.command in ('crawl', 'init', 'enqueue') and not args.province:
+        parser.error(f"{args.command}需要指定--province")
+    if args.command in ('crawl', 'init'):
+        print_disclaimer(accepted=args.yes)
+    shard_by = args.shard_by or DB_SHARD_BY
+    shards = None
+    # 分库时export、vacuum、shards不指定省份则作用于所有分片，其余命令只连接所属分片
+    all_shards = bool(shard_by) and args.command in ('export', 'vacuum', 'shards') and not args.province
+    if shard_by:
+        if args.db:
+            parser.error("--db不能与分库同时使用")
+        shards = ShardedDB(args.shard_dir, shard_by)
+        if all_shards and not shards.keys():
+            parser.error(f"{args.shard_dir}下没有分片数据库，请先按--shard-by采集")
+        if not all_shards:
+            if not args.province or (shard_by == 'city' and not args.city):
+                parser.error(f"分库模式下{args.command}需要指定--province" + ("和--city" if shard_by == 'city' else ""))
+            db = shards.shard(args.province, args.city)
+    elif args.command == 'shards':
+        parser.error("shards需要开启分库（--shard-by或DB_SHARD_BY）")
+    if args.db:
+        db = SQLiteDB(args.db)
+    if args.lean:
+        BROWSER_LEAN_MODE = True
+    if args.profile:
+        profiler = Profiler(args.profile, phases=args.profile_phases.split(',') if args.profile_phases else None)
+    if all_shards:
+        migrate_shards(shards)
+    else:
+        create_table()
+    metrics.start_reporter()
+    exit_code = 0
+    with profiler.phase('main'):
+        if args.command == 'crawl':
+            if args.login:
+                with open_login_page(captcha_wait=args.captcha_wait):
+                    pass
+            spider_by_condition(province=args.province, city=args.city, area=args.area, workers=args.workers,
+                                refresh=args.refresh, budget=args.budget, max_age_days=args.max_age_days)
+            to_excel(args.province, args.city, args.area, fmt=args.format, partition_by=args.partition_by)
+        elif args.command == 'init':
+            with open_login_page(captcha_wait=args.captcha_wait) as page:
+                db_init(page=page, province_name=args.province, city_name=args.city, pool_size=args.pool_size)
+        elif args.command == 'enqueue':
+            enqueue_detail_jobs(args.province, args.city, args.area, refresh=args.refresh, budget=args.budget,
+                                max_age_days=args.max_age_days)
+        elif args.command == 'worker':
+            run_detail_worker(owner=args.owner, batch_size=args.batch, workers=args.workers,
+                              exit_when_idle=not args.wait)
+        elif args.command == 'reextract':
+            reextract_archive(processes=args.processes)
+        elif args.command == 'export-rebuild':
+            rebuild_export_table()
+        elif args.command == 'export-verify':
+            exit_code = 1 if verify_export_table() else 0
+        elif args.command == 'export':
+            to_excel(args.province, args.city, args.area, fmt=args.format, partition_by=args.partition_by,
+                     source=shards if all_shards else None)
+        elif args.command == 'vacuum':
+            vacuum_database(into_dir=args.into, shards=shards if all_shards else None)
+        elif args.command == 'shards':
+            print_shard_summary(shards)
+        else:
+            DetailJobQueue(db).requeue_dead()
+    page_archive.close()
+    db.close()
+    if shards:
+        shards.close()
+    if args.command in ('crawl', 'init'):
+        print_run_summary()
+    else:
+        metrics.stop_reporter()
+        metrics.print_summary()
+    if exit_code:
+        sys.exit(exit_code)
+
+
 if __name__ == "__main__":
-    main()
+    # 打包为exe时解析进程池的子进程从这里进入
+    multiprocessing.freeze_support()
+    if len(sys.argv) > 1:
+        cli_main(sys.argv[1:])
+    else:
+        main()
     Print.green("程序运行完成...")